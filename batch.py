@@ -0,0 +1,256 @@
+# This module runs the delete, encrypt and decrypt actions over every
+# image in a directory tree. Files are handed out to a pool of worker
+# processes, with a bounded number of files in flight at once. With a
+# journal (see journal.py) a run can be stopped and started again
+# without repeating finished files. Every output file is synced to disk
+# before it replaces the original; with group_commit the workers sync
+# their finished files and leave them next to the originals, and the
+# main process renames them in groups, syncing each directory once per
+# group instead of once per file.
+
+import collections
+import concurrent.futures
+import os
+import shutil
+import time
+
+import core
+import safeio
+import tracing
+
+# File extensions picked up when walking a directory
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".tif", ".tiff", ".bmp")
+
+# Actions that can be run over a directory
+OPERATIONS = ("strip", "encrypt", "decrypt")
+
+# Outcome of processing one file
+FileResult = collections.namedtuple("FileResult", ["path", "ok", "size", "error"])
+
+# Hashes of files already produced by the action, set in each worker
+# process of a journaled run
+_finished_hashes = frozenset()
+
+
+def find_images(root, exclude=None):
+    """
+    This function yields the path of every image under root in a
+    stable order. Directories under exclude are skipped.
+    """
+    if exclude is not None:
+        exclude = os.path.abspath(exclude)
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        if exclude is not None:
+            dirnames[:] = [name for name in dirnames
+                           if os.path.abspath(os.path.join(dirpath, name)) != exclude]
+
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def process_file(operation, path, password=None, out_path=None):
+    """
+    This function runs one action on one image and returns a
+    FileResult instead of raising. The image is replaced by the result
+    unless out_path is given.
+    """
+    size = 0
+    try:
+        size = os.path.getsize(path)
+
+        if operation == "strip":
+            # Delete metadata from a copy when writing elsewhere
+            if out_path is not None:
+                shutil.copyfile(path, out_path)
+                path = out_path
+            core.strip_metadata(path)
+
+        elif operation == "encrypt":
+            # Files are already spread over processes, so use one thread each
+            core.encrypt_image(path, password, out_path, threads=1)
+
+        elif operation == "decrypt":
+            # Decrypt in place unless writing elsewhere
+            core.decrypt_image(path, password or "", out_path or path, threads=1)
+
+        else:
+            raise ValueError("Unknown operation: " + operation)
+
+    except Exception as error:
+        return FileResult(path, False, size, type(error).__name__ + ": " + str(error))
+
+    return FileResult(path, True, size, None)
+
+
+def _load_hashes(hashes):
+    """
+    This function gives a worker process the hashes of the files the
+    journal says were already produced.
+    """
+    global _finished_hashes
+    _finished_hashes = hashes
+
+
+def process_file_journaled(operation, path, password=None, out_path=None):
+    """
+    This function runs one action on one image for a journaled run and
+    returns (path, FileResult or None, reason skipped or None, input
+    hash, output hash). Images whose contents the action already
+    produced, and images that are already encrypted when encrypting,
+    are skipped.
+    """
+    from catalog import file_hash
+
+    try:
+        input_hash = file_hash(path)
+        if input_hash in _finished_hashes:
+            return path, None, "identical", input_hash, input_hash
+        if operation == "encrypt" and core.is_encrypted(path):
+            return path, None, "encrypted", input_hash, input_hash
+    except OSError as error:
+        return path, FileResult(path, False, 0, type(error).__name__ + ": " + str(error)), None, None, None
+
+    result = process_file(operation, path, password, out_path)
+    output_hash = None
+    if result.ok:
+        output_hash = file_hash(safeio.written_path(out_path if out_path is not None else path))
+    return path, result, None, input_hash, output_hash
+
+
+def run_deferred(task, *args):
+    """
+    This function runs task(*args) in a worker of a group-committed run
+    and returns its result together with the finished files it left to
+    be moved into place (see safeio.deferred()).
+    """
+    with safeio.deferred() as pending:
+        result = task(*args)
+    return result, pending
+
+
+def run_batch(root, operation, password=None, out_dir=None, workers=None,
+              max_in_flight=None, on_result=None, journal_path=None, group_commit=None):
+    """
+    This function runs an action over every image under root using a
+    process pool and returns a summary dict with file counts, bytes,
+    elapsed seconds, files/s and MB/s. When out_dir is given, results
+    are written there with the same relative paths instead of changing
+    the originals. on_result is called with each FileResult as files
+    finish. With journal_path, finished files are recorded there and
+    skipped when the run is started again (see journal.Journal).
+    With group_commit, finished files are moved into place group_commit
+    at a time (see safeio.GroupCommit), and each file is only reported
+    and journaled once it is in place. The span totals of the workers
+    are added to this process's (see tracing.run_traced()).
+    """
+    if operation not in OPERATIONS:
+        raise ValueError("Unknown operation: " + operation)
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 4
+
+    summary = {"files": 0, "failed": 0, "skipped": 0, "bytes": 0}
+
+    log = None
+    task = process_file
+    initializer, initargs = None, ()
+    if journal_path is not None:
+        from journal import Journal
+        log = Journal(journal_path, operation, out_dir, password)
+        task = process_file_journaled
+        initializer, initargs = _load_hashes, (frozenset(log.hashes),)
+
+    def record(result):
+        if log is not None:
+            path, result, skipped, input_hash, output_hash = result
+            if result is None:
+                summary["skipped"] += 1
+                log.record(path, skipped, input_hash, output_hash)
+                return
+            if result.ok:
+                log.record(path, "done", input_hash, output_hash)
+
+        summary["files"] += 1
+        summary["bytes"] += result.size
+        if not result.ok:
+            summary["failed"] += 1
+        if on_result is not None:
+            on_result(result)
+
+    group = None
+    waiting = []
+    if group_commit is not None:
+        group = safeio.GroupCommit(max_files=group_commit)
+
+    def finish(outcome):
+        result, error, totals = outcome
+        tracing.add_totals(totals)
+        if error is not None:
+            raise error
+
+        if group is None:
+            record(result)
+            return
+
+        # Hold results back until their files have been committed
+        result, pending = result
+        waiting.append(result)
+        group.add(pending)
+        if not group.pending:
+            for result in waiting:
+                record(result)
+            waiting.clear()
+
+    start = time.perf_counter()
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                                                    initargs=initargs) as pool:
+            pending = set()
+
+            for path in find_images(root, exclude=out_dir):
+                # Skip files the journal says are finished without reading them
+                if log is not None and log.finished(path, os.stat(path)):
+                    summary["skipped"] += 1
+                    continue
+
+                out_path = None
+                if out_dir is not None:
+                    out_path = os.path.join(out_dir, os.path.relpath(path, root))
+                    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+                if group is None:
+                    pending.add(pool.submit(tracing.run_traced, task, operation, path, password, out_path))
+                else:
+                    pending.add(pool.submit(tracing.run_traced, run_deferred, task, operation, path, password,
+                                            out_path))
+
+                # Wait for a file to finish before queueing more
+                if len(pending) >= max_in_flight:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        finish(future.result())
+
+            for future in concurrent.futures.as_completed(pending):
+                finish(future.result())
+
+        if group is not None:
+            group.commit()
+            for result in waiting:
+                record(result)
+    finally:
+        if group is not None:
+            # Files of a run that failed are left where they were
+            safeio.discard(group.pending)
+        if log is not None:
+            log.close()
+        tracing.write_metrics()
+
+    seconds = time.perf_counter() - start
+    summary["seconds"] = seconds
+    summary["files_per_second"] = summary["files"] / seconds if seconds else 0.0
+    summary["mb_per_second"] = summary["bytes"] / (1024 * 1024) / seconds if seconds else 0.0
+    return summary
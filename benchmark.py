@@ -0,0 +1,463 @@
+# This program times the hot paths of the image metadata tool so that
+# changes can be checked for speed. Run "python benchmark.py --help"
+# for the available benchmarks.
+#
+# A full run generates synthetic inputs, times every benchmark on each
+# of them and compares the results with a saved baseline:
+#
+#   python benchmark.py generate bench-images
+#   python benchmark.py run bench-images -o baseline.json
+#   ... make changes ...
+#   python benchmark.py run bench-images -o current.json
+#   python benchmark.py compare baseline.json current.json
+
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import core
+
+# Input sizes generated by default
+SIZES = ("100KB", "1MB", "10MB", "100MB", "500MB")
+
+# Formats generated by default, with their file extensions
+FORMATS = {"jpeg": ".jpg", "png": ".png", "tiff": ".tif"}
+
+# Largest number of pixels in a generated image. Larger inputs are
+# padded after the end of the image data, which decoders ignore.
+MAX_PIXELS = 16 * 1024 * 1024
+
+# Password used by the cipher benchmarks
+PASSWORD = "Benchmark-Password1"
+
+# Slowdown (as a fraction) that compare reports as a regression
+THRESHOLD = 0.10
+
+# Modules timed by the startup benchmark
+STARTUP_MODULES = ("metadata", "cli")
+
+
+def best_time(func, repeat):
+    """
+    This function runs func repeat times and returns the fastest
+    run in seconds.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def exif_package_tags(imgpath):
+    """
+    This function extracts the tags the way the View Metadata window
+    used to: a full exif.Image parse of the whole file.
+    """
+    import exif
+
+    with open(imgpath, "rb") as img_file:
+        current_image = exif.Image(img_file)
+    if not current_image.has_exif:
+        return None
+    return [[key, current_image.get(val, 'No Data')] for key, val in core.tags.items()]
+
+
+def exif_command(args):
+    """
+    This function compares the exif package with exifreader on
+    each image and prints the time per read and the speedup.
+    """
+    status = 0
+    for imgpath in args.images:
+        expected = exif_package_tags(imgpath)
+        actual = core.read_metadata(imgpath)
+        if expected != actual:
+            print(imgpath + ": values differ from the exif package", file=sys.stderr)
+            status = 1
+
+        slow = best_time(lambda: exif_package_tags(imgpath), args.repeat)
+        fast = best_time(lambda: core.read_metadata(imgpath), args.repeat)
+        print("%s: exif %.3f ms, exifreader %.3f ms, %.1fx faster" % (
+            imgpath, slow * 1000, fast * 1000, slow / fast))
+    return status
+
+
+def parse_size(text):
+    """
+    This function converts a size such as "100KB" or "10MB" to bytes.
+    """
+    units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "B": 1}
+    text = text.strip().upper()
+    for unit, scale in units.items():
+        if text.endswith(unit):
+            return int(float(text[:-len(unit)]) * scale)
+    return int(text)
+
+
+def sample_exif():
+    """
+    This function returns a Pillow Exif block with a few of the tags
+    shown in the View Metadata window.
+    """
+    from PIL import Image
+
+    exif = Image.Exif()
+    exif[0x010F] = "Benchmark"
+    exif[0x0110] = "Synthetic Camera"
+    exif[0x0112] = 1
+    exif[0x0131] = "benchmark.py"
+    exif[0x0132] = "2024:01:01 12:00:00"
+    return exif
+
+
+def make_image(path, format, size, with_exif, seed):
+    """
+    This function writes a noise image of about size bytes. Noise
+    does not compress, so the pixel count follows the requested size
+    up to MAX_PIXELS, and the file is padded up to size after that.
+    """
+    from PIL import Image
+
+    rng = random.Random(seed)
+    pixels = max(16, min(size // 3, MAX_PIXELS))
+    width = int(pixels ** 0.5)
+    height = max(1, pixels // width)
+    img = Image.frombytes("RGB", (width, height), rng.randbytes(width * height * 3))
+
+    options = {}
+    if with_exif:
+        options["exif"] = sample_exif()
+    if format == "jpeg":
+        options["quality"] = 95
+    img.save(path, format.upper(), **options)
+
+    # Pad after the end of the image data
+    padding = size - os.path.getsize(path)
+    if padding > 0:
+        with open(path, "ab") as img_file:
+            while padding > 0:
+                count = min(padding, 8 * 1024 * 1024)
+                img_file.write(rng.randbytes(count))
+                padding -= count
+
+
+def generate_command(args):
+    """
+    This function generates the synthetic benchmark inputs.
+    """
+    os.makedirs(args.directory, exist_ok=True)
+    for size_text in args.sizes.split(","):
+        size = parse_size(size_text)
+        for format in args.formats.split(","):
+            for with_exif in (True, False):
+                name = "%s-%s-%s%s" % (format, size_text.strip(), "exif" if with_exif else "plain", FORMATS[format])
+                path = os.path.join(args.directory, name)
+                if os.path.exists(path) and not args.force:
+                    continue
+                make_image(path, format, size, with_exif, args.seed)
+                print("%s: %d bytes" % (path, os.path.getsize(path)))
+    return 0
+
+
+def peak_rss():
+    """
+    This function returns the peak resident set size of this process
+    in bytes, or None where the resource module is not available.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def setup_case(name, imgpath, workdir):
+    """
+    This function prepares one benchmark and returns the function to
+    time. Setup (e.g. encrypting the input for the decrypt benchmark)
+    is not included in the timing.
+    """
+    if name == "encrypt":
+        out_path = os.path.join(workdir, "encrypted")
+        return lambda: core.encrypt_image(imgpath, PASSWORD, out_path=out_path)
+
+    if name == "decrypt":
+        encrypted = os.path.join(workdir, "encrypted")
+        core.encrypt_image(imgpath, PASSWORD, out_path=encrypted)
+        out_path = os.path.join(workdir, "decrypted")
+        return lambda: core.decrypt_image(encrypted, PASSWORD, out_path=out_path)
+
+    if name in ("adjust_password", "save_new_image"):
+        with open(imgpath, "rb") as img_file:
+            text = base64.b64encode(img_file.read()).decode()
+
+        if name == "adjust_password":
+            from cipher import adjust_password
+            return lambda: adjust_password(text, PASSWORD)
+
+        # save_new_image lives in the GUI module, which needs PySimpleGUI
+        from metadata import save_new_image
+        copy = os.path.join(workdir, os.path.basename(imgpath))
+        return lambda: save_new_image(copy, text, "decrypted")
+
+    if name == "read_exif":
+        return lambda: core.read_metadata(imgpath)
+
+    if name == "strip":
+        import stripper
+        out_path = os.path.join(workdir, "stripped")
+        return lambda: stripper.strip_file(imgpath, out_path=out_path)
+
+    if name == "thumbnail":
+        import preview
+        return lambda: preview.make_thumbnail(imgpath)
+
+    raise ValueError("Unknown benchmark: " + name)
+
+
+# Benchmarks run for every input
+BENCHMARKS = ("encrypt", "decrypt", "adjust_password", "save_new_image", "read_exif", "strip", "thumbnail")
+
+
+def case_command(args):
+    """
+    This function runs one benchmark on one input and prints the
+    result as JSON. It is run in a child process by run so that the
+    peak RSS belongs to that benchmark alone.
+    """
+    workdir = tempfile.mkdtemp(prefix="benchmark-")
+    try:
+        func = setup_case(args.name, args.image, workdir)
+        seconds = best_time(func, args.repeat)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(json.dumps({"seconds": seconds, "peak_rss": peak_rss()}))
+    return 0
+
+
+def run_case(name, imgpath, repeat):
+    """
+    This function runs one benchmark in a child process and returns
+    its result.
+    """
+    size = os.path.getsize(imgpath)
+    result = {"name": name, "input": os.path.basename(imgpath), "bytes": size}
+
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "case", name, imgpath, "--repeat", str(repeat)],
+        capture_output=True, text=True)
+    if child.returncode != 0:
+        lines = child.stderr.strip().splitlines()
+        result["error"] = lines[-1] if lines else "exit status %d" % child.returncode
+        return result
+
+    result.update(json.loads(child.stdout.strip().splitlines()[-1]))
+    result["mb_per_second"] = size / (1024 * 1024) / result["seconds"] if result["seconds"] else None
+    return result
+
+
+def run_command(args):
+    """
+    This function times every benchmark on every input in a directory
+    and saves the results as JSON.
+    """
+    names = args.only.split(",") if args.only else BENCHMARKS
+    images = sorted(os.path.join(args.directory, name) for name in os.listdir(args.directory)
+                    if os.path.splitext(name)[1].lower() in FORMATS.values())
+
+    results = []
+    for imgpath in images:
+        for name in names:
+            result = run_case(name, imgpath, args.repeat)
+            results.append(result)
+            if "error" in result:
+                print("%s %s: skipped (%s)" % (result["input"], name, result["error"]), file=sys.stderr)
+            else:
+                print("%s %s: %.3f ms, peak RSS %s" % (
+                    result["input"], name, result["seconds"] * 1000, format_bytes(result["peak_rss"])))
+
+    save_report(results, args.output, args.repeat)
+    return 0
+
+
+def save_report(results, output, repeat):
+    """
+    This function saves benchmark results as JSON.
+    """
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": repeat,
+        "results": results,
+    }
+    with open(output, "w") as outfile:
+        json.dump(report, outfile, indent=2)
+
+
+def import_times(module):
+    """
+    This function imports module in a fresh interpreter with
+    "python -X importtime" and returns {module name: cumulative
+    seconds} for module and every module it imported. Modules loaded
+    by the interpreter itself at startup are left out.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    child = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module],
+                           cwd=here, capture_output=True, text=True, check=True)
+
+    lines = []
+    for line in child.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        lines.append((name[1:], int(cumulative_us) / 1000000))
+
+    # Lines are printed after their imports, so the modules imported by
+    # module are the indented lines just before it
+    times = {}
+    for name, seconds in reversed(lines):
+        if times and not name.startswith(" "):
+            break
+        times[name.strip()] = seconds
+    return times
+
+
+def startup_command(args):
+    """
+    This function measures how long the GUI and command-line modules
+    take to import, using the fastest of several fresh interpreters,
+    and lists the slowest modules they pull in.
+    """
+    results = []
+    for module in args.modules:
+        best = None
+        for i in range(args.repeat):
+            times = import_times(module)
+            if best is None or times[module] < best[module]:
+                best = times
+
+        print("import %s: %.1f ms" % (module, best[module] * 1000))
+        slowest = sorted((seconds, name) for name, seconds in best.items() if name != module)[::-1]
+        for seconds, name in slowest[:args.top]:
+            print("    %-30s %.1f ms" % (name, seconds * 1000))
+
+        results.append({"name": "import", "input": module, "bytes": 0, "seconds": best[module], "peak_rss": None})
+
+    if args.output:
+        save_report(results, args.output, args.repeat)
+    return 0
+
+
+def format_bytes(count):
+    """
+    This function formats a byte count in MB for display.
+    """
+    if count is None:
+        return "n/a"
+    return "%.1f MB" % (count / (1024 * 1024))
+
+
+def compare_command(args):
+    """
+    This function compares two result files and reports benchmarks
+    that got slower or used more memory by more than the threshold.
+    Returns 1 if there are regressions.
+    """
+    with open(args.baseline) as infile:
+        baseline = json.load(infile)
+    with open(args.current) as infile:
+        current = json.load(infile)
+
+    before = {(result["name"], result["input"]): result for result in baseline["results"] if "error" not in result}
+    regressions = 0
+    for result in current["results"]:
+        old = before.get((result["name"], result["input"]))
+        if old is None or "error" in result:
+            continue
+
+        problems = []
+        ratio = result["seconds"] / old["seconds"] if old["seconds"] else 1.0
+        if ratio > 1 + args.threshold:
+            problems.append("%.0f%% slower" % ((ratio - 1) * 100))
+        if old.get("peak_rss") and result.get("peak_rss"):
+            if result["peak_rss"] > old["peak_rss"] * (1 + args.threshold):
+                problems.append("peak RSS %s -> %s" % (format_bytes(old["peak_rss"]), format_bytes(result["peak_rss"])))
+
+        status = "REGRESSION: " + ", ".join(problems) if problems else "ok"
+        print("%s %s: %.3f ms -> %.3f ms (%.2fx) %s" % (
+            result["input"], result["name"], old["seconds"] * 1000, result["seconds"] * 1000, ratio, status))
+        if problems:
+            regressions += 1
+
+    print("%d regression(s)" % regressions)
+    return 1 if regressions else 0
+
+
+def build_parser():
+    """
+    This function builds the command-line argument parser.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the image metadata tool.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    exif = commands.add_parser("exif", help="compare the exif package with exifreader")
+    exif.add_argument("images", nargs="+")
+    exif.add_argument("--repeat", type=int, default=20)
+    exif.set_defaults(func=exif_command)
+
+    generate = commands.add_parser("generate", help="generate synthetic input images")
+    generate.add_argument("directory")
+    generate.add_argument("--sizes", default=",".join(SIZES), help="comma-separated sizes, e.g. 100KB,1MB")
+    generate.add_argument("--formats", default=",".join(FORMATS), help="comma-separated formats")
+    generate.add_argument("--seed", type=int, default=361)
+    generate.add_argument("--force", action="store_true", help="replace existing inputs")
+    generate.set_defaults(func=generate_command)
+
+    run = commands.add_parser("run", help="time every benchmark on the inputs in a directory")
+    run.add_argument("directory")
+    run.add_argument("-o", "--output", default="benchmark.json")
+    run.add_argument("--repeat", type=int, default=3)
+    run.add_argument("--only", help="comma-separated benchmarks (%s)" % ", ".join(BENCHMARKS))
+    run.set_defaults(func=run_command)
+
+    compare = commands.add_parser("compare", help="compare results with a saved baseline")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=THRESHOLD)
+    compare.set_defaults(func=compare_command)
+
+    startup = commands.add_parser("startup", help="time importing the GUI and command-line modules")
+    startup.add_argument("modules", nargs="*", default=list(STARTUP_MODULES))
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--top", type=int, default=10, help="number of slowest imports to list")
+    startup.add_argument("-o", "--output", help="save the results as JSON for compare")
+    startup.set_defaults(func=startup_command)
+
+    case = commands.add_parser("case", help=argparse.SUPPRESS)
+    case.add_argument("name", choices=BENCHMARKS)
+    case.add_argument("image")
+    case.add_argument("--repeat", type=int, default=3)
+    case.set_defaults(func=case_command)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    sys.exit(args.func(args))
@@ -0,0 +1,280 @@
+# This module keeps an on-disk SQLite catalog of extracted EXIF data so
+# that viewing an image that has not changed is a single indexed lookup
+# instead of parsing the file again. Entries are keyed by path and are
+# only used while the file size and modification time still match.
+# Deleting an image's metadata or encrypting it removes its entry (see
+# forget()), so the catalog never keeps a copy of metadata that is gone
+# from the file.
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import core
+import tracing
+
+# Environment variable that overrides where the catalog is stored
+CATALOG_ENV = "METADATA_CATALOG"
+
+# Catalog used when the environment variable is not set
+DEFAULT_CATALOG = os.path.join(os.path.expanduser("~"), ".image_metadata_catalog.sqlite3")
+
+# Bytes read at a time when hashing file contents
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash TEXT,
+    has_exif INTEGER NOT NULL,
+    tags TEXT,
+    indexed_at REAL NOT NULL
+)
+"""
+
+
+def catalog_path():
+    """
+    This function returns the path of the catalog database.
+    """
+    return os.environ.get(CATALOG_ENV, DEFAULT_CATALOG)
+
+
+def connect(path=None):
+    """
+    This function opens the catalog, creating it if needed. WAL mode
+    lets several processes read while one writes.
+    """
+    conn = sqlite3.connect(path or catalog_path(), timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(_SCHEMA)
+    return conn
+
+
+def file_hash(imgpath):
+    """
+    This function returns the SHA-256 hex digest of a file.
+    """
+    digest = hashlib.sha256()
+    with open(imgpath, "rb") as imgfile:
+        for block in iter(lambda: imgfile.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _encode(data):
+    """
+    This function converts [tag, value] pairs to the JSON stored in
+    the catalog. Values are stored as the text the table displays.
+    """
+    if data is None:
+        return None
+    return json.dumps([[key, str(val)] for key, val in data])
+
+
+def _decode(has_exif, tags):
+    """
+    This function converts a catalog row back to [tag, value] pairs,
+    or None if the image has no EXIF data.
+    """
+    if not has_exif:
+        return None
+    return json.loads(tags)
+
+
+def lookup(conn, imgpath, stat=None):
+    """
+    This function returns (True, data) if the catalog has a fresh entry
+    for the image, where data is a list of [tag, value] pairs or None
+    for an image without EXIF data. Returns (False, None) if the entry
+    is missing or the file has changed since it was indexed.
+    """
+    path = os.path.abspath(imgpath)
+    stat = stat or os.stat(path)
+
+    row = conn.execute("SELECT size, mtime_ns, has_exif, tags FROM images WHERE path = ?", (path,)).fetchone()
+    if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+        return False, None
+    return True, _decode(row[2], row[3])
+
+
+def store(conn, imgpath, data, stat=None, digest=None):
+    """
+    This function saves the extracted EXIF data for an image.
+    """
+    path = os.path.abspath(imgpath)
+    stat = stat or os.stat(path)
+    conn.execute(
+        "INSERT OR REPLACE INTO images (path, size, mtime_ns, hash, has_exif, tags, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (path, stat.st_size, stat.st_mtime_ns, digest, data is not None, _encode(data), time.time()),
+    )
+
+
+def _refresh_by_hash(conn, path, stat):
+    """
+    This function checks whether a changed file still has the contents
+    that were indexed (e.g. it was only touched or copied). If so, the
+    entry is updated with the new size and mtime and its data returned.
+    """
+    row = conn.execute("SELECT hash, has_exif, tags FROM images WHERE path = ?", (path,)).fetchone()
+    if row is None or row[0] is None:
+        return False, None, None
+
+    digest = file_hash(path)
+    if digest != row[0]:
+        return False, None, digest
+
+    conn.execute("UPDATE images SET size = ?, mtime_ns = ?, indexed_at = ? WHERE path = ?",
+                 (stat.st_size, stat.st_mtime_ns, time.time(), path))
+    return True, _decode(row[1], row[2]), digest
+
+
+def forget(imgpath, conn=None):
+    """
+    This function removes the entry for an image. Nothing is created if
+    there is no catalog yet.
+    """
+    close = conn is None
+    if close:
+        path = catalog_path()
+        if not os.path.exists(path):
+            return
+        conn = connect(path)
+
+    try:
+        with conn:
+            conn.execute("DELETE FROM images WHERE path = ?", (os.path.abspath(imgpath),))
+    finally:
+        if close:
+            conn.close()
+
+
+def get_metadata(imgpath, conn=None):
+    """
+    This function returns the image EXIF data as a list of [tag, value]
+    pairs (None if the image has no EXIF data), reading it from the
+    catalog when the entry is fresh and extracting and storing it
+    otherwise.
+    """
+    close = conn is None
+    if close:
+        conn = connect()
+
+    try:
+        with tracing.operation("get_metadata", path=imgpath) as trace:
+            stat = os.stat(imgpath)
+            found, data = lookup(conn, imgpath, stat)
+            trace.phase("catalog_lookup")
+            trace.set(cached=found)
+            if found:
+                return data
+
+            data = core.read_metadata(imgpath)
+            trace.phase("extract")
+            with conn:
+                store(conn, imgpath, data, stat)
+            trace.phase("catalog_store")
+            return data
+    finally:
+        if close:
+            conn.close()
+
+
+def _extract(path, with_hash):
+    """
+    This function extracts the EXIF data for one image in a worker
+    process. Returns (path, stat, data, digest, error).
+    """
+    digest = None
+    try:
+        stat = os.stat(path)
+        data = core.read_metadata(path)
+        if with_hash:
+            digest = file_hash(path)
+    except Exception as error:
+        return path, None, None, None, type(error).__name__ + ": " + str(error)
+    return path, stat, data, digest, None
+
+
+def index_directory(root, conn=None, workers=None, with_hash=False, on_error=None):
+    """
+    This function (re)indexes every image under root. Images whose
+    entry is still fresh are skipped after a single lookup, the rest are
+    extracted in a process pool. With with_hash=True, a content hash is also
+    stored and used to keep entries for files that were touched but not
+    changed. Returns a dict with counts of indexed, fresh and failed
+    images.
+    """
+    import batch
+    import concurrent.futures
+
+    close = conn is None
+    if close:
+        conn = connect()
+
+    counts = {"indexed": 0, "fresh": 0, "failed": 0}
+    try:
+        # Only files whose entry is missing or stale need extracting
+        stale = []
+        with conn:
+            for path in batch.find_images(root):
+                path = os.path.abspath(path)
+                stat = os.stat(path)
+                found, data = lookup(conn, path, stat)
+                if not found and with_hash:
+                    found, data, digest = _refresh_by_hash(conn, path, stat)
+                if found:
+                    counts["fresh"] += 1
+                else:
+                    stale.append(path)
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(_extract, stale, [with_hash] * len(stale), chunksize=16)
+            with conn:
+                for path, stat, data, digest, error in results:
+                    if error is not None:
+                        counts["failed"] += 1
+                        if on_error is not None:
+                            on_error(path, error)
+                        continue
+                    store(conn, path, data, stat, digest)
+                    counts["indexed"] += 1
+    finally:
+        if close:
+            conn.close()
+    return counts
+
+
+def prune(conn=None):
+    """
+    This function removes entries for files that no longer exist or
+    have changed since they were indexed. Only file stats are checked,
+    so this is cheap even for large catalogs. Returns the number of
+    entries removed.
+    """
+    close = conn is None
+    if close:
+        conn = connect()
+
+    try:
+        stale = []
+        for path, size, mtime_ns in conn.execute("SELECT path, size, mtime_ns FROM images"):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stale.append((path,))
+                continue
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                stale.append((path,))
+
+        with conn:
+            conn.executemany("DELETE FROM images WHERE path = ?", stale)
+    finally:
+        if close:
+            conn.close()
+    return len(stale)
@@ -0,0 +1,811 @@
+# This module contains the one-time pad style cipher used to encrypt
+# and decrypt images. Instead of converting every character through
+# a dictionary inside a Python loop, each key character gets a
+# precomputed 256-entry translation table so whole buffers can be
+# processed with bytes.translate(). Large raw format images are split
+# into chunks that are ciphered on several threads with NumPy, whose
+# array arithmetic releases the GIL; chunks start at a whole number of
+# key repetitions so every chunk lines up with the same key bytes.
+
+import binascii
+import contextlib
+import hashlib
+import hmac
+import math
+import operator
+import os
+import struct
+
+import tracing
+from safeio import atomic_output
+
+# Index that is used for converting a character to a number
+convert_to_nums = {
+    'A': 1,
+    'B': 2,
+    'C': 3,
+    'D': 4,
+    'E': 5,
+    'F': 6,
+    'G': 7,
+    'H': 8,
+    'I': 9,
+    'J': 10,
+    'K': 11,
+    'L': 12,
+    'M': 13,
+    'N': 14,
+    'O': 15,
+    'P': 16,
+    'Q': 17,
+    'R': 18,
+    'S': 19,
+    'T': 20,
+    'U': 21,
+    'V': 22,
+    'W': 23,
+    'X': 24,
+    'Y': 25,
+    'Z': 26,
+    'a': 27,
+    'b': 28,
+    'c': 29,
+    'd': 30,
+    'e': 31,
+    'f': 32,
+    'g': 33,
+    'h': 34,
+    'i': 35,
+    'j': 36,
+    'k': 37,
+    'l': 38,
+    'm': 39,
+    'n': 40,
+    'o': 41,
+    'p': 42,
+    'q': 43,
+    'r': 44,
+    's': 45,
+    't': 46,
+    'u': 47,
+    'v': 48,
+    'w': 49,
+    'x': 50,
+    'y': 51,
+    'z': 52,
+    '0': 53,
+    '1': 54,
+    '2': 55,
+    '3': 56,
+    '4': 57,
+    '5': 58,
+    '6': 59,
+    '7': 60,
+    '8': 61,
+    '9': 62,
+    '+': 63,
+    '/': 64,
+    '=': 65,
+    '!': 66,
+    '@': 67,
+    '#': 68,
+    '$': 69,
+    '%': 70,
+    '^': 71,
+    '&': 72,
+    '*': 73,
+    '(': 74,
+    ')': 75,
+    '_': 76,
+    '-': 77,
+    ' ': 78,
+    '?': 79,
+    '.': 80,
+    ',': 81,
+    ':': 82,
+}
+
+# Index that is used for converting a number to a character
+convert_to_chars = {
+    1: 'A',
+    2: 'B',
+    3: 'C',
+    4: 'D',
+    5: 'E',
+    6: 'F',
+    7: 'G',
+    8: 'H',
+    9: 'I',
+    10: 'J',
+    11: 'K',
+    12: 'L',
+    13: 'M',
+    14: 'N',
+    15: 'O',
+    16: 'P',
+    17: 'Q',
+    18: 'R',
+    19: 'S',
+    20: 'T',
+    21: 'U',
+    22: 'V',
+    23: 'W',
+    24: 'X',
+    25: 'Y',
+    26: 'Z',
+    27: 'a',
+    28: 'b',
+    29: 'c',
+    30: 'd',
+    31: 'e',
+    32: 'f',
+    33: 'g',
+    34: 'h',
+    35: 'i',
+    36: 'j',
+    37: 'k',
+    38: 'l',
+    39: 'm',
+    40: 'n',
+    41: 'o',
+    42: 'p',
+    43: 'q',
+    44: 'r',
+    45: 's',
+    46: 't',
+    47: 'u',
+    48: 'v',
+    49: 'w',
+    50: 'x',
+    51: 'y',
+    52: 'z',
+    53: '0',
+    54: '1',
+    55: '2',
+    56: '3',
+    57: '4',
+    58: '5',
+    59: '6',
+    60: '7',
+    61: '8',
+    62: '9',
+    63: '+',
+    64: '/',
+}
+
+# Number of image bytes read at a time when streaming a file. Must be a
+# multiple of 3 so every block base64-encodes without padding.
+BLOCK_SIZE = 3 * 1024 * 1024
+
+# Encryption formats. FORMAT_LEGACY ciphers the base64 text of the image
+# with the character index above. FORMAT_RAW adds the password bytes to
+# the image bytes directly and ends the file with a trailer: a random
+# salt, a key check value (HMAC-SHA256 of the salt keyed with the
+# password), then a version byte and RAW_MAGIC so the two formats can be
+# told apart. The trailer goes at the end rather than the start so that
+# every image byte keeps its offset and the key lines up the same way in
+# every block.
+#
+# The check value only has to tell a wrong password from the right one,
+# so it is a single HMAC rather than a slow key derivation like PBKDF2.
+# A slow check would cost tens of milliseconds per image without making
+# the password any harder to recover: the cipher adds the repeating
+# password to the image bytes, so the well-known bytes at the start of
+# every image format already give the password away to anyone with the
+# file.
+FORMAT_LEGACY = 0
+FORMAT_RAW = 1
+RAW_MAGIC = b"IMMCRYPT"
+_TRAILER = struct.Struct(">16s32sB8s")
+
+# Number of bytes decrypted to check a password for legacy images,
+# which have no key check value. Must be a multiple of 3 like BLOCK_SIZE.
+CHECK_SIZE = 24
+
+# File extension -> the signatures a correctly decrypted image starts with
+IMAGE_SIGNATURES = {
+    ".jpg": (b"\xff\xd8\xff",),
+    ".jpeg": (b"\xff\xd8\xff",),
+    ".png": (b"\x89PNG\r\n\x1a\n",),
+    ".gif": (b"GIF87a", b"GIF89a"),
+    ".tif": (b"II*\x00", b"MM\x00*"),
+    ".tiff": (b"II*\x00", b"MM\x00*"),
+    ".bmp": (b"BM",),
+}
+
+# Smallest image ciphered on several threads
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024
+
+# Bytes given to one thread at a time. Each step of a threaded run
+# covers at least one chunk per thread.
+THREAD_CHUNK_SIZE = 1024 * 1024
+
+# Character used to pad the key and the last character of the output
+PADDING = ord('=')
+
+# Byte value -> character number (0 for characters outside the index)
+_NUMS = bytearray(256)
+for char, num in convert_to_nums.items():
+    _NUMS[ord(char)] = num
+_NUMS = bytes(_NUMS)
+
+# Bytes that are allowed to appear in the text and the key
+_VALID = bytes(ord(char) for char in convert_to_nums)
+
+# (sum or difference of character numbers) -> output character.
+# Encrypt adds and decrypt subtracts, but both wrap the result into the
+# range 1..64. Since 256 is a multiple of 64, a negative difference can
+# index this table directly and still land on the right character.
+_RESULT = bytes(ord(convert_to_chars[((i - 1) % 64) + 1]) for i in range(256))
+
+class Cancelled(Exception):
+    """
+    Raised by a progress callback to stop an operation.
+    """
+
+
+class WrongPassword(ValueError):
+    """
+    Raised when the password does not match the image's key check value
+    (or, for legacy images, the image does not decrypt to a valid image
+    header), before anything has been written.
+    """
+
+
+# Per key character translation tables, built on first use
+_encrypt_tables = {}
+_decrypt_tables = {}
+_raw_encrypt_tables = {}
+_raw_decrypt_tables = {}
+
+
+def _encrypt_table(k):
+    """
+    This function returns the translation table that encrypts
+    every character with the key character number k.
+    """
+    table = _encrypt_tables.get(k)
+    if table is None:
+        table = bytes(_RESULT[(_NUMS[c] + k) & 0xFF] for c in range(256))
+        _encrypt_tables[k] = table
+    return table
+
+
+def _decrypt_table(k):
+    """
+    This function returns the translation table that decrypts
+    every character with the key character number k.
+    """
+    table = _decrypt_tables.get(k)
+    if table is None:
+        table = bytes(_RESULT[(_NUMS[c] - k) & 0xFF] for c in range(256))
+        _decrypt_tables[k] = table
+    return table
+
+
+def _to_bytes(text):
+    """
+    This function converts a str to ASCII bytes and checks that every
+    character is in the index. Unknown characters made the original
+    dictionary based version fail, so they still raise an error here.
+    """
+    if isinstance(text, str):
+        try:
+            text = text.encode('ascii')
+        except UnicodeEncodeError:
+            raise ValueError("Unsupported character in cipher input.")
+    if text.translate(None, _VALID):
+        raise ValueError("Unsupported character in cipher input.")
+    return bytes(text)
+
+
+def _key_numbers(password):
+    """
+    This function converts a password to a list of character numbers.
+    """
+    return [_NUMS[c] for c in _to_bytes(password)]
+
+
+def _apply(data, key, total, start, get_table):
+    """
+    This function runs the cipher over data, which holds the characters
+    found at positions start..start+len(data) of a text that is total
+    characters long. The key is the password repeated as many whole
+    times as fits in the text, followed by "=" padding, which is the
+    same key adjust_password() builds.
+    """
+    length = len(data)
+    end = start + length
+    out = bytearray(length)
+    period = len(key)
+
+    # Last position covered by whole repetitions of the password
+    body_end = (total // period) * period
+    body_end = max(0, min(end, body_end) - start)
+
+    # Positions that share a key character are one stride apart, so
+    # each key character translates its stride in a single call
+    for j, k in enumerate(key):
+        first = (j - start) % period
+        if first < body_end:
+            out[first:body_end:period] = data[first:body_end:period].translate(get_table(k))
+
+    # Remaining positions are matched with "=" padding
+    if body_end < length:
+        out[body_end:] = data[body_end:].translate(get_table(convert_to_nums['=']))
+
+    # Change last character in string to a "=" for padding
+    if end == total and length:
+        out[-1] = PADDING
+
+    return out
+
+
+def encrypt_text(plaintext, password):
+    """
+    This function encrypts a base64 string with a password. The result
+    is identical to encrypt(plaintext, adjust_password(plaintext, password)).
+    """
+    data = _to_bytes(plaintext)
+    key = _key_numbers(password)
+    if not data or not key:
+        raise ValueError("Nothing to encrypt.")
+    return _apply(data, key, len(data), 0, _encrypt_table).decode('ascii')
+
+
+def decrypt_text(encrypted_word, password):
+    """
+    This function decrypts a string with a password. The result is
+    identical to decrypt(encrypted_word, adjust_password(encrypted_word, password)).
+    """
+    data = _to_bytes(encrypted_word)
+    key = _key_numbers(password)
+    if not data or not key:
+        raise ValueError("Nothing to decrypt.")
+    return _apply(data, key, len(data), 0, _decrypt_table).decode('ascii')
+
+
+def _apply_key(text, key, combine):
+    """
+    This function runs the cipher with a key that is already as long
+    as the text. Character numbers are combined pairwise with map(),
+    which keeps the per-character work out of the Python interpreter.
+    """
+    data = _to_bytes(text)
+    key = _to_bytes(key)
+    if not data or len(key) < len(data):
+        raise ValueError("Key must be at least as long as the text.")
+
+    nums = data.translate(_NUMS)
+    key_nums = key[:len(data)].translate(_NUMS)
+    out = bytearray(map(_RESULT.__getitem__, map(combine, nums, key_nums)))
+
+    # Change last character in string to a "=" for padding
+    out[-1] = PADDING
+    return out.decode('ascii')
+
+
+def encrypt(plaintext, key):
+    """
+    This function takes in two parameters: a plaintext
+    string and a key. The plaintext is encrypted using
+    one-time pad style encryption.
+    """
+    return _apply_key(plaintext, key, operator.add)
+
+
+def decrypt(encrypted_word, key):
+    """
+    This function takes in two parameters: an encrypted string
+    and a key. The string is decrypted with the key using
+    one-time pad style encryption.
+    """
+    return _apply_key(encrypted_word, key, operator.sub)
+
+
+def _stream(infile, outfile, size, password, get_table, block_size, progress=None):
+    """
+    This function reads an image in fixed size blocks and writes the
+    ciphered blocks as it goes. Each block is base64 encoded, ciphered
+    at its offset in the full base64 string and decoded again, so the
+    output matches ciphering the whole string at once while only one
+    block is held in memory.
+
+    progress(bytes done, size) is called before each block.
+    """
+    if block_size <= 0 or block_size % 3:
+        raise ValueError("Block size must be a positive multiple of 3.")
+
+    key = _key_numbers(password)
+    if size == 0 or not key:
+        raise ValueError("Nothing to cipher.")
+
+    # Length of the base64 string for the whole image
+    total = -(-size // 3) * 4
+
+    read_pos = 0
+    start = 0
+    with tracing.span("legacy_cipher", bytes=size) as trace:
+        while read_pos < size:
+            if progress is not None:
+                progress(read_pos, size)
+                trace.phase("progress")
+
+            block = infile.read(min(block_size, size - read_pos))
+            if not block:
+                break
+            trace.phase("read", len(block))
+
+            text = binascii.b2a_base64(block, newline=False)
+            trace.phase("base64_encode", len(text))
+            ciphered = _apply(text, key, total, start, get_table)
+            trace.phase("cipher", len(text))
+            data = binascii.a2b_base64(ciphered)
+            trace.phase("decode", len(data))
+
+            outfile.write(data)
+            trace.phase("write", len(data))
+
+            read_pos += len(block)
+            start += len(text)
+
+
+def _transform_file(imgpath, password, out_path, get_table, block_size, progress=None):
+    """
+    This function ciphers imgpath with the legacy format into out_path,
+    or over itself when out_path is None. out_path can also be an open
+    binary file such as sys.stdout.buffer.
+    """
+    # The image is closed before the output replaces it
+    with atomic_output(out_path or imgpath, like=imgpath) as outfile, open(imgpath, 'rb') as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size
+        _stream(imgfile, outfile, size, password, get_table, block_size, progress)
+
+
+def _raw_encrypt_table(k):
+    """
+    This function returns the translation table that adds the key
+    byte k to every byte, for the raw format.
+    """
+    table = _raw_encrypt_tables.get(k)
+    if table is None:
+        table = bytes((i + k) & 0xFF for i in range(256))
+        _raw_encrypt_tables[k] = table
+    return table
+
+
+def _raw_decrypt_table(k):
+    """
+    This function returns the translation table that subtracts the
+    key byte k from every byte, for the raw format.
+    """
+    table = _raw_decrypt_tables.get(k)
+    if table is None:
+        table = bytes((i - k) & 0xFF for i in range(256))
+        _raw_decrypt_tables[k] = table
+    return table
+
+
+def _raw_key(password):
+    """
+    This function converts a password to the key bytes used by the
+    raw format. Any character can be used since nothing is looked up
+    in the character index.
+    """
+    key = password.encode('utf-8')
+    if not key:
+        raise ValueError("No password entered.")
+    return key
+
+
+def _apply_raw(buf, start, stop, pos, key, get_table, pool=None):
+    """
+    This function ciphers buf[start:stop] in place, where buf[start]
+    is byte number pos of the image. Bytes that share a key byte are
+    one stride apart, so each key byte translates its stride in a
+    single call. With a thread
+    pool, the work is split between its threads instead.
+    """
+    if pool is not None:
+        _apply_raw_threads(buf, start, stop, pos, key, get_table, pool)
+        return
+
+    period = len(key)
+    for j, k in enumerate(key):
+        first = start + (j - pos) % period
+        if first < stop:
+            buf[first:stop:period] = buf[first:stop:period].translate(get_table(k))
+
+
+def _apply_raw_threads(buf, start, stop, pos, key, get_table, pool):
+    """
+    This function ciphers buf[start:stop] like _apply_raw() on the
+    threads of pool. The range is cut into chunks that are a whole
+    number of key repetitions long, so every chunk adds (or subtracts)
+    the same run of key bytes, which NumPy does without holding the GIL.
+    """
+    import numpy
+
+    combine = numpy.add if get_table is _raw_encrypt_table else numpy.subtract
+    period = len(key)
+    chunk = max(1, THREAD_CHUNK_SIZE // period) * period
+
+    # Key bytes lined up with buf[start], repeated to cover one chunk
+    shift = pos % period
+    pad = numpy.frombuffer((key[shift:] + key[:shift]) * (chunk // period), dtype=numpy.uint8)
+    data = numpy.frombuffer(buf, dtype=numpy.uint8)
+
+    def run(first):
+        last = min(first + chunk, stop)
+        part = data[first:last]
+        # uint8 arithmetic wraps around like the translation tables
+        combine(part, pad[:last - first], out=part)
+
+    for done in pool.map(run, range(start, stop, chunk)):
+        pass
+
+
+def _thread_count(threads, size):
+    """
+    This function returns how many threads to cipher an image of size
+    bytes with. threads defaults to the number of CPUs; one thread is
+    used for small images and when NumPy is not installed.
+    """
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if threads <= 1 or size < PARALLEL_MIN_SIZE:
+        return 1
+    try:
+        import numpy
+    except ImportError:
+        return 1
+    return threads
+
+
+def _thread_pool(threads):
+    """
+    This function returns a context manager giving a pool of threads,
+    or None for a single thread.
+    """
+    if threads == 1:
+        return contextlib.nullcontext()
+
+    import concurrent.futures
+    return concurrent.futures.ThreadPoolExecutor(max_workers=threads)
+
+
+def _raw_stream(infile, outfile, size, key, get_table, block_size, progress=None, threads=None):
+    """
+    This function reads size bytes from infile one block at a time,
+    ciphers them in a reused buffer and writes them to outfile.
+    progress(bytes done, size) is called before each block. Large
+    images are ciphered on up to threads threads.
+    """
+    threads = _thread_count(threads, size)
+    step = block_size if threads == 1 else max(block_size, threads * THREAD_CHUNK_SIZE)
+    buf = bytearray(step)
+    view = memoryview(buf)
+    pos = 0
+    with tracing.span("raw_cipher", bytes=size, threads=threads) as trace, _thread_pool(threads) as pool:
+        while pos < size:
+            if progress is not None:
+                progress(pos, size)
+                trace.phase("progress")
+            n = infile.readinto(view[:min(step, size - pos)])
+            if not n:
+                break
+            trace.phase("read", n)
+            _apply_raw(buf, 0, n, pos, key, get_table, pool)
+            trace.phase("cipher", n)
+            outfile.write(view[:n])
+            trace.phase("write", n)
+            pos += n
+
+
+def read_format(imgfile):
+    """
+    This function returns the format an open image was encrypted with:
+    FORMAT_RAW if it ends with the raw format trailer, otherwise
+    FORMAT_LEGACY.
+    """
+    size = os.fstat(imgfile.fileno()).st_size
+    if size < _TRAILER.size:
+        return FORMAT_LEGACY
+
+    imgfile.seek(size - _TRAILER.size)
+    salt, check, version, magic = _TRAILER.unpack(imgfile.read(_TRAILER.size))
+    imgfile.seek(0)
+
+    if magic != RAW_MAGIC:
+        return FORMAT_LEGACY
+    if version != FORMAT_RAW:
+        raise ValueError("Unsupported encryption format version: %d" % version)
+    return version
+
+
+def _valid_header(header, extension):
+    """
+    This function returns True if header can be the start of an image
+    with the given file extension. Extensions without a known signature
+    are always accepted.
+    """
+    signatures = IMAGE_SIGNATURES.get(extension.lower())
+    if signatures is None:
+        return True
+    if not header.startswith(signatures):
+        return False
+
+    # Check the structure that follows the signature
+    if signatures == IMAGE_SIGNATURES[".jpg"]:
+        # SOI is followed by a segment marker such as APP0, APP1 or DQT
+        # and its length; APP0 and APP1 then name their contents
+        if len(header) < 11:
+            return True
+        marker = header[3]
+        length = (header[4] << 8) | header[5]
+        if not 0xC0 <= marker <= 0xFE or length < 2:
+            return False
+        if marker == 0xE0:
+            return header[6:11] in (b"JFIF\x00", b"JFXX\x00")
+        if marker == 0xE1:
+            return header[6:10] in (b"Exif", b"http")
+        return True
+    if signatures == IMAGE_SIGNATURES[".png"]:
+        # The first chunk is always a 13 byte IHDR
+        return len(header) < 16 or header[8:16] == b"\x00\x00\x00\x0dIHDR"
+    return True
+
+
+def _key_check(password, salt):
+    """
+    This function returns the key check value stored in the raw format
+    trailer for a password and salt.
+    """
+    return hmac.new(_raw_key(password), salt, hashlib.sha256).digest()
+
+
+def _decrypt_header(imgfile, password):
+    """
+    This function returns the first CHECK_SIZE bytes of an open legacy
+    format image decrypted with password, or None if the image is too
+    small to check.
+    """
+    size = os.fstat(imgfile.fileno()).st_size
+    if size <= CHECK_SIZE:
+        return None
+
+    imgfile.seek(0)
+    block = imgfile.read(CHECK_SIZE)
+    imgfile.seek(0)
+
+    key = _key_numbers(password)
+    if not key:
+        raise ValueError("Nothing to cipher.")
+    total = -(-size // 3) * 4
+    text = binascii.b2a_base64(block, newline=False)
+    return binascii.a2b_base64(_apply(text, key, total, 0, _decrypt_table))
+
+
+def password_matches(imgpath, password):
+    """
+    This function returns False if password is not the one an image
+    was encrypted with. Raw format images are checked against the key
+    check value in their trailer. Legacy images have none, so only the
+    first few bytes are decrypted and must be a valid header for the
+    image's file type; this catches most but not all wrong passwords,
+    and legacy images that are too small or have an unknown file type
+    always return True.
+    """
+    with open(imgpath, 'rb') as imgfile:
+        return _password_matches(imgfile, password, read_format(imgfile))
+
+
+def _password_matches(imgfile, password, format):
+    """
+    This function checks the password for an open encrypted image.
+    """
+    if format == FORMAT_RAW:
+        imgfile.seek(-_TRAILER.size, os.SEEK_END)
+        salt, check, version, magic = _TRAILER.unpack(imgfile.read(_TRAILER.size))
+        imgfile.seek(0)
+        return hmac.compare_digest(check, _key_check(password, salt))
+
+    header = _decrypt_header(imgfile, password)
+    if header is None:
+        return True
+    return _valid_header(header, os.path.splitext(imgfile.name)[1])
+
+
+def _encrypt_raw(imgpath, password, out_path, block_size, progress=None, threads=None):
+    """
+    This function encrypts an image with the raw format, writing the
+    ciphered bytes followed by the trailer.
+    """
+    key = _raw_key(password)
+    salt = os.urandom(16)
+    trailer = _TRAILER.pack(salt, _key_check(password, salt), FORMAT_RAW, RAW_MAGIC)
+
+    with atomic_output(out_path or imgpath, like=imgpath) as outfile, open(imgpath, 'rb') as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size
+        if size == 0:
+            raise ValueError("Nothing to cipher.")
+        _raw_stream(imgfile, outfile, size, key, _raw_encrypt_table, block_size, progress, threads)
+        outfile.write(trailer)
+
+
+def _decrypt_raw(imgpath, password, out_path, block_size, progress=None, threads=None):
+    """
+    This function decrypts an image that uses the raw format and drops
+    the trailer.
+    """
+    key = _raw_key(password)
+
+    with atomic_output(out_path or imgpath, like=imgpath) as outfile, open(imgpath, 'rb') as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size - _TRAILER.size
+        _raw_stream(imgfile, outfile, size, key, _raw_decrypt_table, block_size, progress, threads)
+
+
+def encrypt_file(imgpath, password, out_path=None, block_size=BLOCK_SIZE, format=FORMAT_RAW, progress=None,
+                 threads=None):
+    """
+    This function encrypts an image file with a password. The encrypted
+    image is written to out_path, or over the original image when no
+    out_path is given. Memory use is bounded by block_size.
+    New images use the raw format; FORMAT_LEGACY writes the original
+    base64 alphabet format instead. Raw format images of at least
+    PARALLEL_MIN_SIZE bytes are ciphered on threads threads (default:
+    one per CPU) when NumPy is installed, with the same output as one
+    thread; memory use is then up to threads * THREAD_CHUNK_SIZE.
+
+    progress(bytes done, total bytes) is called before each block and
+    may raise Cancelled to stop. The output is written to a temporary
+    file that replaces out_path (or the original) only once it is
+    complete and synced to disk, so a cancelled run, an error or a
+    crash leaves the original image unchanged and does not create
+    out_path.
+    """
+    if format == FORMAT_LEGACY:
+        _transform_file(imgpath, password, out_path, _encrypt_table, block_size, progress)
+    elif format == FORMAT_RAW:
+        _encrypt_raw(imgpath, password, out_path, block_size, progress, threads)
+    else:
+        raise ValueError("Unsupported encryption format version: %d" % format)
+
+
+def decrypt_file(imgpath, password, out_path=None, block_size=BLOCK_SIZE, progress=None, verify=True,
+                 threads=None):
+    """
+    This function decrypts an image file with a password. The decrypted
+    image is written to out_path, or over the encrypted image when no
+    out_path is given. Memory use is bounded by block_size. Both the
+    raw and the legacy format are recognized. progress and threads work
+    the same way as for encrypt_file().
+
+    Unless verify is False, the password is checked first (see
+    password_matches()) and WrongPassword is raised, without writing
+    anything, if it is wrong.
+    """
+    with open(imgpath, 'rb') as imgfile:
+        format = read_format(imgfile)
+        if verify:
+            with tracing.span("password_check", path=imgpath):
+                if not _password_matches(imgfile, password, format):
+                    raise WrongPassword("Incorrect password.")
+
+    if format == FORMAT_RAW:
+        _decrypt_raw(imgpath, password, out_path, block_size, progress, threads)
+    else:
+        _transform_file(imgpath, password, out_path, _decrypt_table, block_size, progress)
+
+
+def adjust_password(str, key):
+    """
+    This function adjusts password length to match image string length
+    """
+    with tracing.span("key_stretch", bytes=len(str)):
+        difference = len(str)/len(key)
+        difference = math.floor(difference)
+        key = key * difference
+        padding = len(str) - len(key)
+        key += ("=" * padding)
+    return key
@@ -0,0 +1,401 @@
+# This program runs the image metadata operations from the command line
+# without building the GUI, so they can be used from scripts and piped
+# together. Run "python -m cli --help" for usage.
+
+import argparse
+import json
+import os
+import sys
+
+import cipher
+import core
+import tracing
+
+# Environment variable checked for the password before reading stdin
+PASSWORD_ENV = "METADATA_PASSWORD"
+
+
+def read_password(args):
+    """
+    This function returns the password from the environment variable
+    named by --password-env, or else from the first line of stdin.
+    """
+    password = os.environ.get(args.password_env)
+    if password is None:
+        password = sys.stdin.readline().rstrip("\r\n")
+    return password
+
+
+def view_command(args):
+    """
+    This function prints the image EXIF data.
+    """
+    if args.no_catalog:
+        data = core.read_metadata(args.image)
+    else:
+        import catalog
+        data = catalog.get_metadata(args.image)
+
+    if data is None:
+        print("Image does not contain any EXIF data.", file=sys.stderr)
+        return 1
+
+    out = sys.stdout
+    if args.output != "-":
+        out = open(args.output, "w", newline="")
+
+    try:
+        if args.format == "csv":
+            core.write_csv(data, out)
+        elif args.format == "json":
+            json.dump({key: str(val) for key, val in data}, out, indent=2)
+            out.write("\n")
+        else:
+            for key, val in data:
+                out.write(key + ": " + str(val) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+def strip_command(args):
+    """
+    This function deletes the image EXIF data.
+    """
+    if not core.strip_metadata(args.image):
+        print("Image does not contain any EXIF data to delete.", file=sys.stderr)
+        return 1
+    return 0
+
+
+def output_target(args):
+    """
+    This function returns where encrypt/decrypt should write: stdout
+    for "-", otherwise the path given with --output.
+    """
+    if args.output == "-":
+        return sys.stdout.buffer
+    return args.output
+
+
+def encrypt_command(args):
+    """
+    This function encrypts the image, overwriting it unless
+    --output is given.
+    """
+    format = cipher.FORMAT_LEGACY if args.legacy else cipher.FORMAT_RAW
+    core.encrypt_image(args.image, read_password(args), output_target(args), format, threads=args.threads)
+    return 0
+
+
+def decrypt_command(args):
+    """
+    This function decrypts the image into --output, or into a new
+    "decrypted" image next to the original.
+    """
+    out_path = core.decrypt_image(args.image, read_password(args), output_target(args), verify=not args.force,
+                                  threads=args.threads)
+    if args.output != "-":
+        print(out_path)
+    return 0
+
+
+def batch_command(args):
+    """
+    This function runs an action over every image in a directory
+    and prints one line per file followed by a summary.
+    """
+    import batch
+
+    password = None
+    if args.operation in ("encrypt", "decrypt"):
+        password = read_password(args)
+        if args.operation == "encrypt":
+            core.check_password(password)
+
+    def report(result):
+        if result.ok:
+            print("ok " + result.path, flush=True)
+        else:
+            print("FAILED " + result.path + ": " + result.error, flush=True)
+
+    summary = batch.run_batch(args.directory, args.operation, password, args.output_dir,
+                              args.workers, args.max_in_flight, report, args.journal, args.group_commit)
+
+    print("%d files, %d failed, %d skipped, %.1f s, %.1f files/s, %.1f MB/s" % (
+        summary["files"], summary["failed"], summary["skipped"], summary["seconds"],
+        summary["files_per_second"], summary["mb_per_second"]), file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+def scan_command(args):
+    """
+    This function prints whether each image in a directory is plain,
+    encrypted or corrupt, followed by a count of each.
+    """
+    import sniffer
+
+    counts = {sniffer.PLAIN: 0, sniffer.ENCRYPTED: 0, sniffer.CORRUPT: 0}
+    for path, result in sniffer.scan(args.directory, args.workers):
+        counts[result.status] += 1
+        if args.only and result.status != args.only:
+            continue
+        line = "%-9s %-6s %s" % (result.status, result.kind or "-", path)
+        if result.detail:
+            line += ": " + result.detail
+        print(line, flush=True)
+
+    print("%d plain, %d encrypted, %d corrupt" % (
+        counts[sniffer.PLAIN], counts[sniffer.ENCRYPTED], counts[sniffer.CORRUPT]), file=sys.stderr)
+    return 1 if counts[sniffer.CORRUPT] else 0
+
+
+def export_command(args):
+    """
+    This function writes the metadata of every image in a directory to
+    one CSV, JSON Lines or Parquet file.
+    """
+    import export
+
+    def report(path, error):
+        print("FAILED " + path + ": " + error, file=sys.stderr)
+
+    format = args.format or export.export_format(args.output)
+    out = sys.stdout.buffer if args.output == "-" else args.output
+    counts = export.export_metadata(args.directory, out, format, args.full, args.workers, on_error=report)
+    print("%d exported, %d failed" % (counts["exported"], counts["failed"]), file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+def watch_command(args):
+    """
+    This function strips or encrypts images as they appear in the
+    given directories until interrupted, printing one line per file.
+    """
+    import signal
+    import watch
+
+    password = None
+    if args.operation == "encrypt":
+        password = read_password(args)
+        core.check_password(password)
+
+    def report(result):
+        if result.ok:
+            print("ok " + result.path, flush=True)
+        else:
+            print("FAILED " + result.path + ": " + result.error, flush=True)
+
+    watcher = watch.Watcher(args.directory, args.operation, password, args.output_dir, args.workers,
+                            args.max_in_flight, args.settle, args.poll_interval, not args.poll,
+                            args.new_only, args.metrics, report)
+    signal.signal(signal.SIGTERM, lambda signum, frame: watcher.stop())
+    print("Watching %s (%s), press Ctrl+C to stop" % (", ".join(watcher.directories), watcher.mode()), file=sys.stderr)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        watcher.stop()
+
+    stats = watcher.stats()
+    print("%d processed, %d skipped, %d failed, %.2f s average latency, %d backpressure waits" % (
+        stats["processed"], stats["skipped"], stats["failed"], stats["latency_avg_seconds"],
+        stats["backpressure_waits"]), file=sys.stderr)
+    return 1 if stats["failed"] else 0
+
+
+def serve_command(args):
+    """
+    This function runs the local service until interrupted. It listens
+    on a Unix socket unless a host or port is given (or the platform has
+    no Unix sockets), in which case the TCP token is saved to the token
+    file.
+    """
+    import asyncio
+    import signal
+    import socket
+    import server
+
+    socket_path = args.socket
+    if socket_path is None and args.host is None and args.port is None and hasattr(socket, "AF_UNIX"):
+        socket_path = server.default_socket_path()
+    host = args.host or server.HOST
+    port = server.PORT if args.port is None else args.port
+
+    service = server.Server(args.workers, args.max_jobs, args.max_waiting, args.timeout, args.max_upload,
+                            roots=args.root)
+
+    def on_ready(address):
+        if socket_path is None:
+            server.write_token(service.token, args.token_file)
+            print("Token saved to %s" % args.token_file, file=sys.stderr)
+        print("Serving on %s, press Ctrl+C to stop" % address, file=sys.stderr, flush=True)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, service.stop)
+        await service.serve(host, port, socket_path, on_ready=on_ready)
+
+    asyncio.run(serve())
+    stats = service.stats()
+    print("%d requests, %d failed, %d rejected, %d timed out" % (
+        stats["requests"], stats["failed"], stats["rejected"], stats["timeouts"]), file=sys.stderr)
+    return 0
+
+
+def index_command(args):
+    """
+    This function updates the metadata catalog for a directory.
+    """
+    import catalog
+
+    def report(path, error):
+        print("FAILED " + path + ": " + error)
+
+    if args.prune:
+        print("%d stale entries removed" % catalog.prune(), file=sys.stderr)
+
+    counts = catalog.index_directory(args.directory, workers=args.workers, with_hash=args.hash, on_error=report)
+    print("%d indexed, %d fresh, %d failed" % (counts["indexed"], counts["fresh"], counts["failed"]), file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+
+def build_parser():
+    """
+    This function builds the command-line argument parser.
+    """
+    parser = argparse.ArgumentParser(prog="python -m cli", description="View, delete, encrypt or decrypt image metadata.")
+    parser.add_argument("--trace", metavar="FILE", help="append timing spans to FILE as JSON lines")
+    parser.add_argument("--trace-metrics", metavar="FILE", help="write span totals to FILE in Prometheus text format")
+    parser.add_argument("--profile", metavar="DIR", help="save a cProfile dump of each operation in DIR")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    view = commands.add_parser("view", help="print the image EXIF data")
+    view.add_argument("image")
+    view.add_argument("--format", choices=["text", "csv", "json"], default="text")
+    view.add_argument("-o", "--output", default="-", help="file to write to (default: stdout)")
+    view.add_argument("--no-catalog", action="store_true", help="always parse the image instead of using the catalog")
+    view.set_defaults(func=view_command)
+
+    strip = commands.add_parser("strip", help="delete the image EXIF data (overwrites the image)")
+    strip.add_argument("image")
+    strip.set_defaults(func=strip_command)
+
+    for name, func, help in [
+        ("encrypt", encrypt_command, "encrypt the image (overwrites it unless --output is given)"),
+        ("decrypt", decrypt_command, "decrypt the image into a new file"),
+    ]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument("image")
+        command.add_argument("-o", "--output", help='file to write to, or "-" for stdout')
+        command.add_argument("--password-env", default=PASSWORD_ENV,
+                             help="environment variable holding the password; "
+                                  "stdin is read when it is not set (default: %(default)s)")
+        command.add_argument("--threads", type=int,
+                             help="threads used for large images (default: CPU count; needs NumPy)")
+        if name == "encrypt":
+            command.add_argument("--legacy", action="store_true",
+                                 help="use the original base64 alphabet format instead of the raw format")
+        else:
+            command.add_argument("--force", action="store_true",
+                                 help="decrypt even if the password check says the password is wrong")
+        command.set_defaults(func=func)
+
+    run = commands.add_parser("batch", help="run strip, encrypt or decrypt over a directory tree")
+    run.add_argument("operation", choices=["strip", "encrypt", "decrypt"])
+    run.add_argument("directory")
+    run.add_argument("--output-dir", help="write results here instead of changing the originals")
+    run.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    run.add_argument("--max-in-flight", type=int, help="most files queued at once (default: 4 per worker)")
+    run.add_argument("--journal", metavar="FILE",
+                     help="record finished files in FILE and skip them when the same command is run again")
+    run.add_argument("--group-commit", type=int, metavar="N",
+                     help="sync finished files to disk and move them into place N at a time "
+                          "instead of one by one")
+    run.add_argument("--password-env", default=PASSWORD_ENV,
+                     help="environment variable holding the password; "
+                          "stdin is read when it is not set (default: %(default)s)")
+    run.set_defaults(func=batch_command)
+
+    scan = commands.add_parser("scan", help="report which images in a directory tree are plain, encrypted or corrupt")
+    scan.add_argument("directory")
+    scan.add_argument("--workers", type=int, help="number of reader threads (default: 4 per CPU, at most 32)")
+    scan.add_argument("--only", choices=["plain", "encrypted", "corrupt"], help="only list images with this status")
+    scan.set_defaults(func=scan_command)
+
+    export = commands.add_parser("export", help="write the metadata of every image in a directory tree to one file")
+    export.add_argument("directory")
+    export.add_argument("-o", "--output", required=True, help='.csv, .jsonl or .parquet file, or "-" for stdout with --format')
+    export.add_argument("--format", choices=["csv", "jsonl", "parquet"], help="default: from the output file extension")
+    export.add_argument("--full", action="store_true", help="add every EXIF tag as a JSON column")
+    export.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    export.set_defaults(func=export_command)
+
+    watch = commands.add_parser("watch", help="strip or encrypt new images as they appear in directories")
+    watch.add_argument("operation", choices=["strip", "encrypt"])
+    watch.add_argument("directory", nargs="+")
+    watch.add_argument("--output-dir", help="write results here instead of changing the originals")
+    watch.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    watch.add_argument("--max-in-flight", type=int, help="most files queued at once (default: 4 per worker)")
+    watch.add_argument("--settle", type=float, default=2.0,
+                       help="seconds a file must be unchanged before it is processed (default: %(default)s)")
+    watch.add_argument("--poll", action="store_true", help="rescan the directories instead of using inotify")
+    watch.add_argument("--poll-interval", type=float, default=1.0,
+                       help="seconds between rescans when polling (default: %(default)s)")
+    watch.add_argument("--new-only", action="store_true", help="leave images that are already there alone")
+    watch.add_argument("--metrics", metavar="FILE", help="write queue and latency counters to FILE in Prometheus text format")
+    watch.add_argument("--password-env", default=PASSWORD_ENV,
+                       help="environment variable holding the password; "
+                            "stdin is read when it is not set (default: %(default)s)")
+    watch.set_defaults(func=watch_command)
+
+    serve = commands.add_parser("serve", help="serve view, strip, encrypt and decrypt over local HTTP")
+    serve.add_argument("--host", help="listen on TCP at this address instead of a Unix socket (default port 8361)")
+    serve.add_argument("--port", type=int, help="listen on TCP at this port instead of a Unix socket "
+                                                "(default address 127.0.0.1)")
+    serve.add_argument("--socket", metavar="PATH",
+                       help="Unix socket to listen on (default: image-metadata.sock in $XDG_RUNTIME_DIR, "
+                            "or ~/.image_metadata.sock)")
+    serve.add_argument("--token-file", metavar="PATH", default=os.path.join("~", ".image_metadata_service_token"),
+                       type=os.path.expanduser,
+                       help="where to save the token TCP requests must carry (default: %(default)s)")
+    serve.add_argument("--root", action="append", metavar="DIR",
+                       help="only read and write paths under this directory (can be repeated)")
+    serve.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    serve.add_argument("--max-jobs", type=int, help="most actions running at once (default: one per worker)")
+    serve.add_argument("--max-waiting", type=int,
+                       help="most requests waiting for a free worker before new ones are refused "
+                            "(default: 4 per running action)")
+    serve.add_argument("--timeout", type=float, default=60.0,
+                       help="seconds a request may take before it is answered with 504 (default: %(default)s)")
+    serve.add_argument("--max-upload", type=int, default=1024 * 1024 * 1024,
+                       help="largest image accepted in a request body, in bytes (default: %(default)s)")
+    serve.set_defaults(func=serve_command)
+
+    index = commands.add_parser("index", help="add a directory tree to the metadata catalog")
+    index.add_argument("directory")
+    index.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    index.add_argument("--hash", action="store_true", help="also store a content hash to detect touched but unchanged files")
+    index.add_argument("--prune", action="store_true", help="first remove entries for missing or changed files")
+    index.set_defaults(func=index_command)
+
+    return parser
+
+
+def main(argv=None):
+    """
+    This function runs the command given on the command line and
+    returns the exit status.
+    """
+    args = build_parser().parse_args(argv)
+    tracing.configure(args.trace, args.trace_metrics, args.profile)
+    try:
+        return args.func(args)
+    except Exception as error:
+        print("Error: " + str(error), file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+# This module contains the image operations behind the GUI windows
+# without any PySimpleGUI code, so they can also be used from scripts
+# and the command-line interface.
+# Referred to https://exif.readthedocs.io/en/latest/usage.html
+# for reference on using the exif module to access exif data in image.
+
+import os
+
+import exifreader
+import sniffer
+import stripper
+import tracing
+from cipher import encrypt_file, decrypt_file, FORMAT_RAW
+from safeio import unique_path
+
+# Index of exif module attribute tags
+tags = {
+    "Lens Make": "lens_make",
+    "Lens Model": "model",
+    "Focal Length": "focal_length",
+    "White Balance": "white_balance",
+    "Orientation": "orientation",
+    "Date Time": "datetime_original",
+    "Brightness": "brightness_value",
+    "Shutter Speed": "shutter_speed_value",
+    "Aperture": "aperture_value",
+    "GPS Latitude": "gps_latitude",
+    "GPS Latitude Direction": "gps_latitude_ref",
+    "GPS Longitude": "gps_longitude",
+    "GPS Longitude Direction": "gps_longitude_ref",
+    "GPS Timestamp": "gps_timestamp",
+    "GPS Speed": "gps_speed",
+    "GPS Altitude": "gps_altitude",
+    "Exposure Time": "exposure_time",
+    "Exposure Program": "exposure_program",
+    "OS Version": "software",
+    "Color": "color_space",
+    "F Number": "f_number",
+    "X Resolution":"pixel_x_dimension",
+    "Y Resolution": "pixel_y_dimension",
+}
+
+# Shortest and longest password allowed for encryption
+MIN_PASSWORD_LENGTH = 8
+MAX_PASSWORD_LENGTH = 30
+
+
+def open_exif(imgpath):
+    """
+    This function opens an image file with the exif module.
+    """
+    import exif
+
+    with open(imgpath, "rb") as img_file:
+        return exif.Image(img_file)
+
+
+def has_exif(imgpath):
+    """
+    This function returns True if the image contains EXIF data.
+    """
+    with exifreader.open_exif(imgpath) as current_image:
+        return current_image.has_exif
+
+
+def read_metadata(imgpath):
+    """
+    This function returns the image EXIF data as a list of
+    [tag, value] pairs, or None if the image has no EXIF data.
+    Only the EXIF segment is read, not the whole image.
+    """
+    with tracing.operation("read_metadata", path=imgpath) as trace, exifreader.open_exif(imgpath) as current_image:
+        trace.phase("exif_open")
+
+        # Check if image has EXIF data
+        if not current_image.has_exif:
+            return None
+
+        # Extract EXIF data from image
+        data = []
+        for key, val in tags.items():
+            info = current_image.get(val, 'No Data')
+            data.append([key, info])
+        trace.phase("exif_parse")
+        return data
+
+
+def write_csv(data, outfile):
+    """
+    This function writes [tag, value] pairs to an open CSV file.
+    """
+    import csv
+
+    writer = csv.writer(outfile)
+    writer.writerows(data)
+
+
+def has_metadata(imgpath):
+    """
+    This function returns True if the image contains metadata
+    segments that strip_metadata() would remove.
+    """
+    return bool(stripper.find_metadata(imgpath))
+
+
+def strip_metadata(imgpath, progress=None, out_path=None):
+    """
+    This function deletes the image metadata (EXIF, XMP and IPTC in
+    JPEGs; eXIf and text chunks in PNGs) and overwrites the image, or
+    writes the result to out_path if given. Returns False if the image
+    has no metadata to delete, in which case nothing is written.
+    progress(bytes done, total bytes) is called while copying; if it
+    raises, the image is left unchanged. The catalog entry of the image
+    written is removed.
+    """
+    with tracing.operation("strip_metadata", path=imgpath):
+        changed = stripper.strip_file(imgpath, out_path, progress=progress) > 0
+        if changed:
+            _forget_metadata(out_path or imgpath)
+        return changed
+
+
+def _forget_metadata(imgpath):
+    """
+    This function removes an image whose metadata was deleted or
+    encrypted from the metadata catalog, so the catalog does not keep
+    the EXIF and GPS data the file no longer shows.
+    """
+    import catalog
+
+    catalog.forget(imgpath)
+
+
+class AlreadyEncrypted(ValueError):
+    """
+    Raised when asked to encrypt an image that is already encrypted.
+    """
+
+
+def is_encrypted(imgpath):
+    """
+    This function returns True if the image is encrypted, judging by
+    its first few KB (see sniffer.classify()).
+    """
+    return sniffer.classify(imgpath).status == sniffer.ENCRYPTED
+
+
+def check_password(password):
+    """
+    This function raises ValueError if the password cannot be used
+    to encrypt an image.
+    """
+    if (len(password) == 0):
+        raise ValueError("No password entered.")
+
+    if (len(password) < MIN_PASSWORD_LENGTH or len(password) > MAX_PASSWORD_LENGTH):
+        raise ValueError("Password must be between 8 and 30 characters long.")
+
+
+def new_image_path(imgpath, type):
+    """
+    This function returns the path of a new image file saved in the
+    same directory as imgpath, e.g. photo-encrypted.jpg for photo.jpg.
+    Existing files are never reused: photo-encrypted-2.jpg and so on
+    are tried until a free name is found.
+    """
+
+    # Create new image name to save in same directory as encrypted image
+    extension = os.path.splitext(os.path.basename(imgpath))
+    directory = os.path.dirname(imgpath)
+    new_name = extension[0] + "-" + type + extension[1]
+    return unique_path(os.path.join(directory, new_name))
+
+
+def encrypt_image(imgpath, password, out_path=None, format=FORMAT_RAW, progress=None, threads=None):
+    """
+    This function encrypts an image. The original image is
+    overwritten unless out_path is given. Large images are ciphered
+    on threads threads (see cipher.encrypt_file()). Raises
+    AlreadyEncrypted rather than encrypting an image a second time,
+    which could not be decrypted again. The catalog entry of the
+    image written is removed.
+    """
+    with tracing.operation("encrypt_image", path=imgpath, format=format):
+        check_password(password)
+        if is_encrypted(imgpath):
+            raise AlreadyEncrypted("This image is already encrypted.")
+        encrypt_file(imgpath, password, out_path, format=format, progress=progress, threads=threads)
+        if not hasattr(out_path, "write"):
+            _forget_metadata(out_path or imgpath)
+
+
+def decrypt_image(imgpath, password, out_path=None, progress=None, verify=True, threads=None):
+    """
+    This function decrypts an image into out_path, or into a new
+    "decrypted" image next to the original when no out_path is given.
+    Returns the path that was written. A wrong password is detected
+    from the first block and raises WrongPassword unless verify is False.
+    """
+    with tracing.operation("decrypt_image", path=imgpath):
+        if (len(password) == 0):
+            raise ValueError("No password entered.")
+
+        if out_path is None:
+            out_path = new_image_path(imgpath, "decrypted")
+        decrypt_file(imgpath, password, out_path, progress=progress, verify=verify, threads=threads)
+    return out_path
@@ -0,0 +1,297 @@
+# This module reads EXIF tags without building a full exif.Image object.
+# The file is memory-mapped and only the bytes that are needed are
+# touched: the JPEG marker headers up to the APP1 segment (or the TIFF
+# header), the IFD entry tables and the values of the requested tags.
+# Compressed image data is never read. Values match what the exif
+# module returns for the attributes listed in core.tags.
+# Referred to the EXIF 2.32 / TIFF 6.0 specifications for tag layouts.
+
+import mmap
+import struct
+
+# Tag ID pointing from IFD0 to the Exif and GPS IFDs
+EXIF_IFD_POINTER = 0x8769
+GPS_IFD_POINTER = 0x8825
+
+# exif module attribute name -> (IFD, tag ID)
+ATTRIBUTE_TAGS = {
+    "model": ("ifd0", 0x0110),
+    "orientation": ("ifd0", 0x0112),
+    "software": ("ifd0", 0x0131),
+    "exposure_time": ("exif", 0x829A),
+    "f_number": ("exif", 0x829D),
+    "exposure_program": ("exif", 0x8822),
+    "datetime_original": ("exif", 0x9003),
+    "shutter_speed_value": ("exif", 0x9201),
+    "aperture_value": ("exif", 0x9202),
+    "brightness_value": ("exif", 0x9203),
+    "focal_length": ("exif", 0x920A),
+    "color_space": ("exif", 0xA001),
+    "pixel_x_dimension": ("exif", 0xA002),
+    "pixel_y_dimension": ("exif", 0xA003),
+    "white_balance": ("exif", 0xA403),
+    "lens_make": ("exif", 0xA433),
+    "gps_latitude_ref": ("gps", 0x0001),
+    "gps_latitude": ("gps", 0x0002),
+    "gps_longitude_ref": ("gps", 0x0003),
+    "gps_longitude": ("gps", 0x0004),
+    "gps_altitude": ("gps", 0x0006),
+    "gps_timestamp": ("gps", 0x0007),
+    "gps_speed": ("gps", 0x000D),
+}
+
+# Attributes the exif module returns as enums, by enum class name
+ENUM_ATTRIBUTES = {
+    "orientation": "Orientation",
+    "color_space": "ColorSpace",
+    "white_balance": "WhiteBalance",
+    "exposure_program": "ExposureProgram",
+}
+
+# TIFF field type -> size in bytes of one value
+_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8}
+
+# TIFF field type -> struct format of one value (rationals are two values)
+_TYPE_FORMATS = {1: "B", 3: "H", 4: "I", 5: "II", 6: "b", 7: "B", 8: "h", 9: "i", 10: "ii", 11: "f", 12: "d"}
+
+_ASCII = 2
+
+
+def _enum(attribute, value):
+    """
+    This function converts a numeric value to the enum the exif module
+    uses for the attribute, or leaves it as an int if exif is missing.
+    """
+    try:
+        import exif
+        return getattr(exif, ENUM_ATTRIBUTES[attribute])(value)
+    except (ImportError, AttributeError, ValueError):
+        return value
+
+
+def _find_tiff(buf):
+    """
+    This function returns the offset of the TIFF header holding the
+    EXIF data, or None if the image has no EXIF data. Like the exif
+    module, files that are neither JPEG nor TIFF have no EXIF data.
+    """
+    if buf[:4] in (b"II*\x00", b"MM\x00*"):
+        return 0
+
+    if buf[:2] != b"\xff\xd8":
+        return None
+
+    # Walk the JPEG marker segments until the EXIF APP1 segment. Only
+    # the 4 byte segment headers are read; segment bodies are skipped.
+    pos = 2
+    size = len(buf)
+    while pos + 4 <= size:
+        if buf[pos] != 0xFF:
+            return None
+        marker = buf[pos + 1]
+
+        # Fill bytes and standalone markers have no length
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            pos += 2
+            continue
+
+        # Image data starts after SOS, so stop looking there
+        if marker in (0xDA, 0xD9):
+            return None
+
+        length = (buf[pos + 2] << 8) | buf[pos + 3]
+        if marker == 0xE1 and buf[pos + 4:pos + 10] == b"Exif\x00\x00":
+            return pos + 10
+        pos += 2 + length
+
+    return None
+
+
+class ExifData:
+    """
+    Lazily decoded EXIF data of one image. Supports the has_exif and
+    get() parts of the exif.Image interface. IFD entry tables are
+    indexed on first use and tag values are decoded only when asked
+    for.
+    """
+
+    def __init__(self, buf, tiff):
+        self._buf = buf
+        self._tiff = tiff
+        self._ifds = {}
+        self.has_exif = tiff is not None
+
+        # A corrupt TIFF header is treated as no EXIF data
+        order = bytes(buf[tiff:tiff + 2]) if self.has_exif else b""
+        if order == b"II":
+            self._order = "<"
+        elif order == b"MM":
+            self._order = ">"
+        else:
+            self.has_exif = False
+
+    def close(self):
+        """
+        This function releases the memory map.
+        """
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _unpack(self, format, offset):
+        """
+        This function unpacks values at an offset from the TIFF header.
+        """
+        return struct.unpack_from(self._order + format, self._buf, self._tiff + offset)
+
+    def _read_ifd(self, offset):
+        """
+        This function returns {tag ID: entry offset} for the IFD at an
+        offset from the TIFF header. Only the entry table is read.
+        """
+        count, = self._unpack("H", offset)
+        entries = {}
+        for i in range(count):
+            entry = offset + 2 + 12 * i
+            tag, = self._unpack("H", entry)
+            entries[tag] = entry
+        return entries
+
+    def _ifd(self, name):
+        """
+        This function returns the entry index of ifd0, exif or gps,
+        reading it on first use.
+        """
+        if name not in self._ifds:
+            if name == "ifd0":
+                offset, = self._unpack("I", 4)
+                self._ifds[name] = self._read_ifd(offset)
+            else:
+                pointer = EXIF_IFD_POINTER if name == "exif" else GPS_IFD_POINTER
+                entry = self._ifd("ifd0").get(pointer)
+                if entry is None:
+                    self._ifds[name] = {}
+                else:
+                    offset, = self._unpack("I", entry + 8)
+                    self._ifds[name] = self._read_ifd(offset)
+        return self._ifds[name]
+
+    def _value(self, entry):
+        """
+        This function decodes the value of one IFD entry the same way
+        the exif module does: text for ASCII, a float for rationals, a
+        tuple when there is more than one value.
+        """
+        type, count = self._unpack("HI", entry + 2)
+        size = _TYPE_SIZES.get(type)
+        if size is None:
+            raise ValueError("Unknown field type %d." % type)
+
+        # Values up to 4 bytes are stored in the entry itself
+        offset = entry + 8
+        if size * count > 4:
+            offset, = self._unpack("I", entry + 8)
+
+        if type == _ASCII:
+            start = self._tiff + offset
+            text = bytes(self._buf[start:start + count])
+            return text.split(b"\x00", 1)[0].decode("ascii", "replace")
+
+        values = self._unpack(_TYPE_FORMATS[type] * count, offset)
+        if type in (5, 10):
+            values = tuple(values[i] / values[i + 1] for i in range(0, len(values), 2))
+
+        if count == 1:
+            return values[0]
+        return tuple(values)
+
+    def get(self, attribute, default=None):
+        """
+        This function returns the value of an exif module attribute
+        such as "gps_latitude", or default if the image does not have it.
+        """
+        if not self.has_exif or attribute not in ATTRIBUTE_TAGS:
+            return default
+
+        ifd, tag = ATTRIBUTE_TAGS[attribute]
+        try:
+            entry = self._ifd(ifd).get(tag)
+            if entry is None:
+                return default
+            value = self._value(entry)
+        except (struct.error, ValueError, ZeroDivisionError):
+            return default
+
+        if attribute in ENUM_ATTRIBUTES:
+            value = _enum(attribute, value)
+        return value
+
+    def items(self):
+        """
+        This function yields (IFD name, tag ID, value) for every tag in
+        the ifd0, exif and gps IFDs, in file order. Values are decoded
+        like get() does, except that undefined (type 7) values are
+        returned as bytes. Tags that cannot be decoded are skipped.
+        """
+        if not self.has_exif:
+            return
+
+        for ifd in ("ifd0", "exif", "gps"):
+            try:
+                entries = self._ifd(ifd)
+            except struct.error:
+                continue
+
+            for tag, entry in entries.items():
+                if ifd == "ifd0" and tag in (EXIF_IFD_POINTER, GPS_IFD_POINTER):
+                    continue
+                try:
+                    type, = self._unpack("H", entry + 2)
+                    value = self._value(entry)
+                except (struct.error, ValueError, ZeroDivisionError):
+                    continue
+
+                if type == 7:
+                    value = bytes(value) if isinstance(value, tuple) else bytes([value])
+                yield ifd, tag, value
+
+
+def open_exif(imgpath):
+    """
+    This function memory-maps an image and returns its ExifData.
+    """
+    with open(imgpath, "rb") as img_file:
+        try:
+            buf = mmap.mmap(img_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files cannot be mapped
+            buf = b""
+
+    return ExifData(buf, _find_tiff(buf))
+
+
+def read_tags(imgpath, attributes):
+    """
+    This function returns {attribute: value} for the requested exif
+    module attributes (missing ones are left out), or None if the image
+    has no EXIF data.
+    """
+    with open_exif(imgpath) as data:
+        if not data.has_exif:
+            return None
+
+        values = {}
+        missing = object()
+        for attribute in attributes:
+            value = data.get(attribute, missing)
+            if value is not missing:
+                values[attribute] = value
+        return values
@@ -0,0 +1,250 @@
+# This module exports the metadata of every image in a directory tree
+# to one CSV, JSON Lines or Parquet file, with one row per image and a
+# column per entry in core.tags. Images are read in parallel by a
+# process pool and rows are written as they arrive, in file order, so
+# memory use stays the same however many images there are: only a
+# bounded number of chunks are in flight and, for Parquet, one row
+# group is buffered.
+
+import collections
+import datetime
+import io
+import json
+import os
+
+import core
+import exifreader
+from batch import find_images
+from safeio import atomic_output
+
+# Formats that can be written, by file extension
+FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".parquet": "parquet"}
+
+# Images extracted per worker task, to keep pool overhead low
+CHUNK_SIZE = 64
+
+# Rows buffered per Parquet row group
+ROW_GROUP_SIZE = 10000
+
+# Longest undefined (binary) value written in full with --full
+FULL_VALUE_LIMIT = 1024
+
+# Columns written before the tag columns
+FILE_COLUMNS = ["path", "size", "modified", "has_exif"]
+
+# Column holding the full EXIF data as JSON
+FULL_COLUMN = "exif"
+
+# exif module attribute name for each (IFD, tag ID) exifreader knows
+_TAG_NAMES = {key: name for name, key in exifreader.ATTRIBUTE_TAGS.items()}
+
+
+def columns(full=False):
+    """
+    This function returns the column names of an export.
+    """
+    names = FILE_COLUMNS + list(core.tags)
+    if full:
+        names.append(FULL_COLUMN)
+    return names
+
+
+def _text(value):
+    """
+    This function converts a tag value to the text that is exported,
+    the same way the catalog stores it.
+    """
+    if value is None:
+        return None
+    return str(value)
+
+
+def _json_value(value):
+    """
+    This function converts a full EXIF value to something JSON can hold.
+    Binary values are written as hex, or summarized if they are long.
+    """
+    if isinstance(value, bytes):
+        if len(value) > FULL_VALUE_LIMIT:
+            return "<%d bytes>" % len(value)
+        return value.hex()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def extract_row(path, full=False):
+    """
+    This function returns the export row of one image as a dict.
+    """
+    stat = os.stat(path)
+    row = {
+        "path": path,
+        "size": stat.st_size,
+        "modified": datetime.datetime.fromtimestamp(stat.st_mtime, datetime.timezone.utc).isoformat(),
+    }
+
+    with exifreader.open_exif(path) as data:
+        row["has_exif"] = data.has_exif
+        for key, val in core.tags.items():
+            row[key] = _text(data.get(val))
+
+        if full:
+            tags = {}
+            for ifd, tag, value in data.items():
+                name = _TAG_NAMES.get((ifd, tag), "%s.0x%04X" % (ifd, tag))
+                tags[name] = _json_value(value)
+            row[FULL_COLUMN] = json.dumps(tags, default=str)
+    return row
+
+
+def _extract_chunk(paths, full):
+    """
+    This function extracts a chunk of images in a worker process and
+    returns (path, row, error) for each of them.
+    """
+    results = []
+    for path in paths:
+        try:
+            results.append((path, extract_row(path, full), None))
+        except Exception as error:
+            results.append((path, None, type(error).__name__ + ": " + str(error)))
+    return results
+
+
+def _chunks(paths, size):
+    """
+    This function groups paths into lists of up to size paths.
+    """
+    chunk = []
+    for path in paths:
+        chunk.append(path)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def iter_rows(root, full=False, workers=None, max_in_flight=None):
+    """
+    This function yields (path, row or None, error or None) for every
+    image under root in file order, extracting chunks of images in a
+    process pool with at most max_in_flight chunks queued at a time.
+    """
+    import concurrent.futures
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for chunk in _chunks(find_images(root), CHUNK_SIZE):
+            pending.append(pool.submit(_extract_chunk, chunk, full))
+
+            # Wait for the oldest chunk before queueing more
+            if len(pending) >= max_in_flight:
+                yield from pending.popleft().result()
+
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _write_csv(rows, outfile, names):
+    """
+    This function writes rows to a binary file as CSV.
+    """
+    import csv
+
+    text = io.TextIOWrapper(outfile, encoding="utf-8", newline="")
+    try:
+        writer = csv.DictWriter(text, fieldnames=names)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+    finally:
+        text.flush()
+        text.detach()
+
+
+def _write_jsonl(rows, outfile, names):
+    """
+    This function writes rows to a binary file as JSON Lines.
+    """
+    for row in rows:
+        line = {name: row.get(name) for name in names}
+        if FULL_COLUMN in line:
+            line[FULL_COLUMN] = json.loads(line[FULL_COLUMN])
+        outfile.write((json.dumps(line, default=str) + "\n").encode("utf-8"))
+
+
+def _write_parquet(rows, outfile, names):
+    """
+    This function writes rows to a binary file as Parquet, one row group
+    of ROW_GROUP_SIZE rows at a time. Needs the pyarrow package.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet export needs the pyarrow package (pip install pyarrow).")
+
+    types = {"size": pyarrow.int64(), "has_exif": pyarrow.bool_()}
+    schema = pyarrow.schema([(name, types.get(name, pyarrow.string())) for name in names])
+
+    with pyarrow.parquet.ParquetWriter(outfile, schema) as writer:
+        group = []
+        for row in rows:
+            group.append(row)
+            if len(group) == ROW_GROUP_SIZE:
+                writer.write_table(pyarrow.Table.from_pylist(group, schema=schema))
+                group = []
+        if group:
+            writer.write_table(pyarrow.Table.from_pylist(group, schema=schema))
+
+
+_WRITERS = {"csv": _write_csv, "jsonl": _write_jsonl, "parquet": _write_parquet}
+
+
+def export_format(out_path):
+    """
+    This function returns the export format for an output file name.
+    """
+    extension = os.path.splitext(out_path)[1].lower()
+    if extension not in FORMATS:
+        raise ValueError("Unknown export format %r; use %s." % (extension, ", ".join(FORMATS)))
+    return FORMATS[extension]
+
+
+def export_metadata(root, out_path, format=None, full=False, workers=None, max_in_flight=None, on_error=None):
+    """
+    This function writes the metadata of every image under root to
+    out_path (a path, or an open binary file such as sys.stdout.buffer)
+    as "csv", "jsonl" or "parquet". The format is taken from the file
+    extension when not given. A new file is only put in place once it
+    is complete. With full=True every EXIF tag is added as a JSON
+    column. on_error(path, error) is called for images that could not
+    be read, which are left out. Returns a dict with counts of exported
+    and failed images.
+    """
+    if format is None:
+        format = export_format(out_path)
+    if format not in _WRITERS:
+        raise ValueError("Unknown export format: " + format)
+
+    names = columns(full)
+    counts = {"exported": 0, "failed": 0}
+
+    def rows():
+        for path, row, error in iter_rows(root, full, workers, max_in_flight):
+            if error is not None:
+                counts["failed"] += 1
+                if on_error is not None:
+                    on_error(path, error)
+                continue
+            counts["exported"] += 1
+            yield row
+
+    with atomic_output(out_path) as outfile:
+        _WRITERS[format](rows(), outfile, names)
+    return counts
@@ -0,0 +1,177 @@
+# This module holds the non-GUI part of the thumbnail gallery: listing a
+# folder, working out which images are in view, and decoding their
+# thumbnails on a small pool of threads. Only the tiles in view (and the
+# page after them) are decoded, requests for tiles that were scrolled
+# away are dropped before they start, and decoded thumbnails are kept in
+# an LRU cache, so browsing costs the same for 50 images or 50,000.
+
+import collections
+import os
+import threading
+
+from batch import IMAGE_EXTENSIONS
+from preview import make_thumbnail, PREVIEW_MEMORY_LIMIT
+
+# Largest width and height of a gallery thumbnail
+THUMBNAIL_SIZE = (128, 128)
+
+# Tiles shown at once
+GALLERY_COLUMNS = 5
+GALLERY_ROWS = 4
+
+# Threads decoding thumbnails
+THUMBNAIL_WORKERS = 4
+
+# Threads that may decode a large image at the same time
+LARGE_THUMBNAIL_WORKERS = 1
+
+# Decoded thumbnails kept in memory (about 50 KB each)
+THUMBNAIL_CACHE_SIZE = 600
+
+# Event posted to the window when a thumbnail is ready
+THUMBNAIL_EVENT = "-THUMBNAIL-"
+
+
+def list_images(directory):
+    """
+    This function returns the paths of the images directly inside
+    directory, sorted by name.
+    """
+    with os.scandir(directory) as entries:
+        names = sorted(entry.name for entry in entries
+                       if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+    return [os.path.join(directory, name) for name in names]
+
+
+def visible_range(count, first_row, columns=GALLERY_COLUMNS, rows=GALLERY_ROWS):
+    """
+    This function returns the (start, stop) indexes of the images shown
+    when the view starts at first_row.
+    """
+    start = max(0, first_row) * columns
+    return min(start, count), min(start + rows * columns, count)
+
+
+def last_row(count, columns=GALLERY_COLUMNS, rows=GALLERY_ROWS):
+    """
+    This function returns the highest first_row that still fills the
+    view, i.e. how far the gallery can scroll.
+    """
+    total_rows = -(-count // columns)
+    return max(0, total_rows - rows)
+
+
+def _cache_key(path):
+    """
+    This function returns the cache key for an image, which changes
+    when the file does (e.g. after it is encrypted).
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+class ThumbnailLoader:
+    """
+    Decodes thumbnails for a window on a fixed number of threads.
+    request() replaces the list of wanted images, so paths that are no
+    longer in view are skipped, and finished thumbnails are posted to
+    the window as (path, PPM bytes or None, error or None).
+    """
+
+    def __init__(self, window, workers=THUMBNAIL_WORKERS, size=THUMBNAIL_SIZE,
+                 cache_size=THUMBNAIL_CACHE_SIZE, event=THUMBNAIL_EVENT, max_memory=PREVIEW_MEMORY_LIMIT,
+                 large_workers=LARGE_THUMBNAIL_WORKERS):
+        self.window = window
+        self.max_memory = max_memory
+        # Each decode may use max_memory, so only a few large images are
+        # decoded at the same time
+        self._large_decodes = threading.BoundedSemaphore(large_workers)
+        self.size = size
+        self.cache_size = cache_size
+        self.event = event
+        self._cache = collections.OrderedDict()
+        self._pending = collections.deque()
+        self._wanted = set()
+        self._running = set()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._threads = [threading.Thread(target=self._run, daemon=True) for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def cached(self, path):
+        """
+        This function returns (PPM bytes or None, error or None) for a
+        cached thumbnail, or None if it has not been decoded.
+        """
+        key = _cache_key(path)
+        with self._condition:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+            return result
+
+    def request(self, paths):
+        """
+        This function asks for the thumbnails of paths, in order,
+        dropping earlier requests that have not started. Paths that are
+        already cached are not decoded again.
+        """
+        with self._condition:
+            self._pending.clear()
+            self._wanted = set(paths)
+            for path in paths:
+                if _cache_key(path) not in self._cache and path not in self._running:
+                    self._pending.append(path)
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        This function stops the worker threads once their current
+        thumbnail is done.
+        """
+        with self._condition:
+            self._closed = True
+            self._pending.clear()
+            self._condition.notify_all()
+
+    def _store(self, key, result):
+        """
+        This function adds a thumbnail to the cache, dropping the least
+        recently used one when it is full.
+        """
+        self._cache[key] = result
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _run(self):
+        """
+        This function decodes requested thumbnails until close().
+        """
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                path = self._pending.popleft()
+                self._running.add(path)
+
+            key = _cache_key(path)
+            try:
+                result = (make_thumbnail(path, self.size, self.max_memory, self._large_decodes), None)
+            except Exception as error:
+                result = (None, error)
+
+            with self._condition:
+                self._running.discard(path)
+                self._store(key, result)
+                wanted = path in self._wanted and not self._closed
+
+            # Do not post thumbnails that were scrolled away while decoding
+            if wanted:
+                self.window.write_event_value(self.event, (path,) + result)
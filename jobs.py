@@ -0,0 +1,132 @@
+# This module runs long image operations on a background thread so the
+# GUI stays responsive. A job tracks how many bytes have been processed
+# and can be cancelled, which stops the operation at the next block and
+# leaves the original image unchanged.
+
+import threading
+import time
+
+from cipher import Cancelled
+
+
+class Job:
+    """
+    Runs func(*args, progress=..., **kwargs) on a background thread.
+    func must call progress(bytes done, total bytes) regularly, which is
+    where a cancelled job stops by raising Cancelled.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self.done_bytes = 0
+        self.total_bytes = 0
+        self.result = None
+        self.error = None
+        self.cancelled = False
+        self.started = None
+        self.finished = None
+        self._cancel = threading.Event()
+        kwargs["progress"] = self._progress
+        self._thread = threading.Thread(target=self._run, args=(func, args, kwargs), daemon=True)
+
+    def start(self):
+        """
+        This function starts the job and returns it.
+        """
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """
+        This function asks the job to stop at the next block.
+        """
+        self._cancel.set()
+
+    def cancel_requested(self):
+        """
+        This function returns True once cancel() has been called.
+        """
+        return self._cancel.is_set()
+
+    def is_running(self):
+        """
+        This function returns True until the job has finished.
+        """
+        return self._thread.is_alive()
+
+    def wait(self, timeout=None):
+        """
+        This function waits for the job to finish.
+        """
+        self._thread.join(timeout)
+
+    def _progress(self, done, total):
+        """
+        This function records progress and stops a cancelled job.
+        """
+        self.done_bytes = done
+        self.total_bytes = total
+        if self._cancel.is_set():
+            raise Cancelled()
+
+    def _run(self, func, args, kwargs):
+        """
+        This function runs the job and records how it ended.
+        """
+        try:
+            self.result = func(*args, **kwargs)
+            self.done_bytes = self.total_bytes
+        except Cancelled:
+            self.cancelled = True
+        except Exception as error:
+            self.error = error
+        finally:
+            self.finished = time.perf_counter()
+
+    def elapsed(self):
+        """
+        This function returns the seconds the job has been running.
+        """
+        if self.started is None:
+            return 0.0
+        end = self.finished if self.finished is not None else time.perf_counter()
+        return end - self.started
+
+    def fraction(self):
+        """
+        This function returns the share of the work done, from 0 to 1.
+        """
+        if not self.total_bytes:
+            return 0.0
+        return min(1.0, self.done_bytes / self.total_bytes)
+
+    def throughput(self):
+        """
+        This function returns the average bytes processed per second.
+        """
+        elapsed = self.elapsed()
+        if not elapsed:
+            return 0.0
+        return self.done_bytes / elapsed
+
+    def eta(self):
+        """
+        This function returns the estimated seconds left, or None if
+        there is not enough progress yet to estimate it.
+        """
+        rate = self.throughput()
+        if not rate or not self.total_bytes:
+            return None
+        return (self.total_bytes - self.done_bytes) / rate
+
+    def status(self):
+        """
+        This function returns a one-line progress summary, e.g.
+        "12.0 of 48.0 MB, 95.1 MB/s, 1 s left".
+        """
+        mb = 1024 * 1024
+        text = "%.1f of %.1f MB, %.1f MB/s" % (self.done_bytes / mb, self.total_bytes / mb, self.throughput() / mb)
+        eta = self.eta()
+        if eta is not None:
+            text += ", %d s left" % round(eta)
+        return text
@@ -0,0 +1,201 @@
+# This module keeps the journal that makes batch runs resumable. The
+# journal is an append-only JSON-lines file: a header naming the action,
+# the output folder and a salted fingerprint of the password, then one
+# line per finished file with its size and modification time afterwards
+# and the SHA-256 of its contents before and after. When a run is
+# started again with the same journal, files whose size and
+# modification time still match are skipped without being read, and
+# files whose contents match something the run already produced (e.g.
+# an image that is already encrypted) are skipped after hashing them.
+#
+# Lines are written as files finish but only fsynced every SYNC_EVERY
+# lines or SYNC_SECONDS seconds, so a crash can lose the last few
+# entries. Those files are simply processed again, which is safe:
+# stripping is idempotent and encrypted images are recognized by
+# sniffer before being encrypted a second time.
+#
+# A journal is only used again by a run with the same action, output
+# folder and password, since what it records was produced by those.
+
+import hashlib
+import hmac
+import json
+import os
+import time
+
+# Version written in the journal header
+JOURNAL_VERSION = 2
+
+# PBKDF2 iterations of the password fingerprint
+FINGERPRINT_ITERATIONS = 100000
+
+# Entries written between fsyncs
+SYNC_EVERY = 256
+
+# Seconds after the last fsync at which the next entry is synced anyway
+SYNC_SECONDS = 1.0
+
+
+class Journal:
+    """
+    Journal of one batch action, loaded from path if it exists and
+    appended to as files finish. Files are recorded by absolute path.
+    Raises ValueError if the existing journal is for a different
+    action, output folder or password, or is not a journal.
+    """
+
+    def __init__(self, path, operation, out_dir=None, password=None, sync_every=SYNC_EVERY,
+                 sync_seconds=SYNC_SECONDS):
+        self.path = path
+        self.operation = operation
+        self.out_dir = None if out_dir is None else os.path.abspath(out_dir)
+        self.password = password or None
+        self.sync_every = sync_every
+        self.sync_seconds = sync_seconds
+
+        # path -> (size, mtime_ns) of each finished file
+        self.done = {}
+        # Hashes of the files the action produced
+        self.hashes = set()
+
+        end = self._load()
+        self._file = open(path, "ab")
+        if end is None:
+            # New journal, or one whose header was cut off by a crash
+            self._file.truncate(0)
+            salt = None if self.password is None else os.urandom(16)
+            self._write({"journal": JOURNAL_VERSION, "operation": operation, "out_dir": self.out_dir,
+                         "salt": salt and salt.hex(), "password": salt and self._fingerprint(salt),
+                         "started": time.time()})
+            self.sync()
+        elif end != self._file.tell():
+            # Drop a line that was cut off by a crash
+            self._file.truncate(end)
+            self._file.seek(end)
+
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def _fingerprint(self, salt):
+        """
+        This function returns the hex PBKDF2 fingerprint of the password
+        with salt, which identifies it without revealing it.
+        """
+        return hashlib.pbkdf2_hmac("sha256", self.password.encode("utf-8"), salt, FINGERPRINT_ITERATIONS).hex()
+
+    def _check_header(self, header):
+        """
+        This function raises ValueError unless header is for this
+        action, output folder and password.
+        """
+        if header.get("journal") != JOURNAL_VERSION:
+            raise ValueError("Journal %s was written by a different version of this program." % self.path)
+        if header["operation"] != self.operation:
+            raise ValueError("Journal %s is for %s, not %s." % (self.path, header["operation"], self.operation))
+        if header["out_dir"] != self.out_dir:
+            raise ValueError("Journal %s is for output folder %s, not %s." % (
+                self.path, header["out_dir"] or "(in place)", self.out_dir or "(in place)"))
+
+        same_password = header["password"] is None and self.password is None
+        if header["password"] is not None and self.password is not None:
+            fingerprint = self._fingerprint(bytes.fromhex(header["salt"]))
+            same_password = hmac.compare_digest(fingerprint, header["password"])
+        if not same_password:
+            raise ValueError("Journal %s was made with a different password." % self.path)
+
+    def _load(self):
+        """
+        This function reads an existing journal and returns the offset
+        after its last complete line, or None if there is no journal or
+        only part of its header was written.
+        """
+        try:
+            journal = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+
+        end = 0
+        with journal:
+            for line in journal:
+                complete = line.endswith(b"\n")
+                try:
+                    entry = json.loads(line) if complete else None
+                except ValueError:
+                    entry = None
+
+                if end == 0:
+                    if entry is None:
+                        # A header cut off by a crash is written again, but
+                        # anything else is not ours to overwrite
+                        start = b'{"journal": '
+                        if not complete and (line.startswith(start) or start.startswith(line)):
+                            return None
+                        raise ValueError("%s is not a batch journal." % self.path)
+                    if not isinstance(entry, dict) or "journal" not in entry:
+                        raise ValueError("%s is not a batch journal." % self.path)
+                    self._check_header(entry)
+                    end += len(line)
+                    continue
+
+                if entry is None:
+                    break
+                end += len(line)
+                self.done[entry["path"]] = (entry["size"], entry["mtime_ns"])
+                if entry.get("output_hash"):
+                    self.hashes.add(entry["output_hash"])
+
+        return end if end else None
+
+    def finished(self, path, stat):
+        """
+        This function returns True if path was finished by this action
+        and has not changed since.
+        """
+        return self.done.get(os.path.abspath(path)) == (stat.st_size, stat.st_mtime_ns)
+
+    def record(self, path, status, input_hash=None, output_hash=None):
+        """
+        This function adds a finished file to the journal. status is
+        "done" or the reason the file was skipped.
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        self.done[path] = (stat.st_size, stat.st_mtime_ns)
+        if output_hash:
+            self.hashes.add(output_hash)
+
+        self._write({"path": path, "status": status, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                     "input_hash": input_hash, "output_hash": output_hash})
+        self._unsynced += 1
+        if self._unsynced >= self.sync_every or time.monotonic() - self._synced_at >= self.sync_seconds:
+            self.sync()
+
+    def _write(self, entry):
+        self._file.write((json.dumps(entry) + "\n").encode("utf-8"))
+
+    def sync(self):
+        """
+        This function writes the buffered entries to disk.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        """
+        This function syncs and closes the journal.
+        """
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
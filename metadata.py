@@ -3,361 +3,122 @@
 # Used https://pysimplegui.readthedocs.io/en/latest/#pysimplegui-users-manual
 # as reference for implementing the GUI.
 
-import PySimpleGUI as sg
-from PIL import Image
-import base64
-import csv
-import exif
-import io
-import math
+from cipher import WrongPassword
+from core import has_metadata, write_csv, strip_metadata, new_image_path, encrypt_image, decrypt_image
+from jobs import Job
+from preview import PreviewWorker, PREVIEW_EVENT
+from sniffer import classify, ENCRYPTED, CORRUPT
 import os
-import re
-import subprocess
-import time
-
-# Index that is used for converting a character to a number
-convert_to_nums = {
-    'A': 1,
-    'B': 2,
-    'C': 3,
-    'D': 4,
-    'E': 5,
-    'F': 6,
-    'G': 7,
-    'H': 8,
-    'I': 9,
-    'J': 10,
-    'K': 11,
-    'L': 12,
-    'M': 13,
-    'N': 14,
-    'O': 15,
-    'P': 16,
-    'Q': 17,
-    'R': 18,
-    'S': 19,
-    'T': 20,
-    'U': 21,
-    'V': 22,
-    'W': 23,
-    'X': 24,
-    'Y': 25,
-    'Z': 26,
-    'a': 27,
-    'b': 28,
-    'c': 29,
-    'd': 30,
-    'e': 31,
-    'f': 32,
-    'g': 33,
-    'h': 34,
-    'i': 35,
-    'j': 36,
-    'k': 37,
-    'l': 38,
-    'm': 39,
-    'n': 40,
-    'o': 41,
-    'p': 42,
-    'q': 43,
-    'r': 44,
-    's': 45,
-    't': 46,
-    'u': 47,
-    'v': 48,
-    'w': 49,
-    'x': 50,
-    'y': 51,
-    'z': 52,
-    '0': 53,
-    '1': 54,
-    '2': 55,
-    '3': 56,
-    '4': 57,
-    '5': 58,
-    '6': 59,
-    '7': 60,
-    '8': 61,
-    '9': 62,
-    '+': 63,
-    '/': 64,
-    '=': 65,
-    '!': 66,
-    '@': 67,
-    '#': 68,
-    '$': 69,
-    '%': 70,
-    '^': 71,
-    '&': 72,
-    '*': 73,
-    '(': 74,
-    ')': 75,
-    '_': 76,
-    '-': 77,
-    ' ': 78,
-    '?': 79,
-    '.': 80,
-    ',': 81,
-    ':': 82,
-}
-
-# Index that is used for converting a number to a character
-convert_to_chars = {
-    1: 'A',
-    2: 'B',
-    3: 'C',
-    4: 'D',
-    5: 'E',
-    6: 'F',
-    7: 'G',
-    8: 'H',
-    9: 'I',
-    10: 'J',
-    11: 'K',
-    12: 'L',
-    13: 'M',
-    14: 'N',
-    15: 'O',
-    16: 'P',
-    17: 'Q',
-    18: 'R',
-    19: 'S',
-    20: 'T',
-    21: 'U',
-    22: 'V',
-    23: 'W',
-    24: 'X',
-    25: 'Y',
-    26: 'Z',
-    27: 'a',
-    28: 'b',
-    29: 'c',
-    30: 'd',
-    31: 'e',
-    32: 'f',
-    33: 'g',
-    34: 'h',
-    35: 'i',
-    36: 'j',
-    37: 'k',
-    38: 'l',
-    39: 'm',
-    40: 'n',
-    41: 'o',
-    42: 'p',
-    43: 'q',
-    44: 'r',
-    45: 's',
-    46: 't',
-    47: 'u',
-    48: 'v',
-    49: 'w',
-    50: 'x',
-    51: 'y',
-    52: 'z',
-    53: '0',
-    54: '1',
-    55: '2',
-    56: '3',
-    57: '4',
-    58: '5',
-    59: '6',
-    60: '7',
-    61: '8',
-    62: '9',
-    63: '+',
-    64: '/',
-}
-
-# Index of exif module attribute tags 
-tags = {
-    "Lens Make": "lens_make",
-    "Lens Model": "model",
-    "Focal Length": "focal_length",
-    "White Balance": "white_balance",
-    "Orientation": "orientation",
-    "Date Time": "datetime_original",
-    "Brightness": "brightness_value",
-    "Shutter Speed": "shutter_speed_value",
-    "Aperture": "aperture_value",
-    "GPS Latitude": "gps_latitude",
-    "GPS Latitude Direction": "gps_latitude_ref",
-    "GPS Longitude": "gps_longitude",
-    "GPS Longitude Direction": "gps_longitude_ref",
-    "GPS Timestamp": "gps_timestamp",
-    "GPS Speed": "gps_speed",
-    "GPS Altitude": "gps_altitude",
-    "Exposure Time": "exposure_time",
-    "Exposure Program": "exposure_program",
-    "OS Version": "software",
-    "Color": "color_space",
-    "F Number": "f_number",
-    "X Resolution":"pixel_x_dimension",
-    "Y Resolution": "pixel_y_dimension",
-}
-
-def encrypt(plaintext, key):
-    """
-    This function takes in two parameters: a plaintext  
-    string and a key. The plaintext is encrypted using 
-    one-time pad style encryption. 
-    """
-
-    # Convert plaintext and key from string to list
-    list1 = list(plaintext)
-    list2 = list(key)
-
-    # Convert each character in plaintext to a number
-    for count, i in enumerate(plaintext):
-        list1[count] = convert_to_nums.get(i)
-
-    # Convert each character in key to a number
-    for count, i in enumerate(key):
-        list2[count] = convert_to_nums.get(i)
-
-    # Add plaintext and key and store result in temp list 
-    temp = []
-    
-    for j in range(len(plaintext)):
-        sum = list1[j] + list2[j]
-        if (sum > 64):
-            sum = sum % 64
-            if (sum <= 0):
-                sum = sum + 64
-        temp.append(sum)
-
-    # Convert numbers back to characters
-    for count, i in enumerate(temp):
-        temp[count] = convert_to_chars.get(i)
-
-    # Change last character in string to a "=" for padding
-    temp[len(temp) - 1] = '='
+import tracing
 
-    # Convert list to string and return
-    encrypted_data = ''.join([elem for elem in temp])
-    return encrypted_data
+# Set this environment variable to "1" to sort with the external
+# alphabetical_sorting.py microservice instead of in-process
+SORT_PLUGIN_ENV = "METADATA_SORT_PLUGIN"
 
 
-def decrypt(encrypted_word, key):
+def save_new_image(imgpath, str, type):
     """
-    This function takes in two parameters: an encrypted string 
-    and a key. The string is decrypted with the key using  
-    one-time pad style encryption. 
+    This function saves a new image file next to imgpath and returns
+    its path. An existing file is never overwritten.
     """
+    import base64
+    from safeio import atomic_output
 
-    # Convert encrypted word and key from string to list
-    list1 = list(encrypted_word)
-    list2 = list(key)
-
-    # Convert each character in encrypted word to a number
-    for count, i in enumerate(encrypted_word):
-        list1[count] = convert_to_nums.get(i)
-
-    # Convert each character in key to a number
-    for count, i in enumerate(key):
-        list2[count] = convert_to_nums.get(i)
-
-    # Subtract key from encrypted_word and store result in temp list
-    temp = []
-    for j in range(len(encrypted_word)):
-        sub = list1[j] - list2[j]
-        while (sub <= 0):
-            sub = sub + 64   
-        temp.append(sub)
+    # Write string to new image
+    with tracing.span("save_new_image", path=imgpath) as trace:
+        data = base64.b64decode((str))
+        trace.phase("decode", len(data))
+        out_path = new_image_path(imgpath, type)
+        with atomic_output(out_path, overwrite=False) as updated_image:
+            updated_image.write(data)
+        trace.phase("write", len(data))
+        trace.set(bytes=len(data))
+    return out_path
+
+def password_window():
+    """
+    This function asks for the desired password length and returns
+    a generated password, or None if the user cancels.
+    """
+    import PySimpleGUI as sg
+    from passwords import generate_password
 
-    # Convert numbers back to characters
-    for count, i in enumerate(temp):
-        temp[count] = convert_to_chars.get(i)
+    message = "Enter desired password length (8-30 characters):"
 
-    # Change last character in string to a "=" for padding
-    temp[len(temp) - 1] = '='
+    while True:
+        password_length = sg.popup_get_text(message)
+        if password_length is None:
+            return None
 
-    # Convert list to string and return
-    decrypted_data = ''.join([elem for elem in temp])
-    return decrypted_data
+        # Ask again if invalid size entered
+        try:
+            return generate_password(password_length)
+        except ValueError:
+            message = "Invalid length. Please enter a number between 8 and 30:"
 
 
-def save_new_image(imgpath, str, type):
+def progress_window(title, job):
     """
-    This function saves a new image file.
+    This function starts a background job and shows its progress,
+    throughput and time left until it finishes. The Cancel button
+    stops the job and leaves the original image unchanged.
     """
+    import PySimpleGUI as sg
 
-    # Create new image name to save in same directory as encrypted image
-    extension = os.path.splitext(os.path.basename(imgpath))
-    directory = os.path.dirname(imgpath)
-    new_name = type + extension[1]
-    new_path = directory + "/" + new_name
+    # Window layout
+    layout = [
+        [sg.Text(title)],
+        [sg.ProgressBar(1000, orientation='h', size=(30, 20), key="-PROGRESS-")],
+        [sg.Text("Starting...", size=(40, 1), key="-STATUS-")],
+        [sg.Column([[sg.Button("Cancel")]], element_justification='center', expand_x=True)],
+    ]
 
-    # Write string to new image
-    with open(new_path, 'wb') as updated_image:
-        updated_image.write(base64.b64decode((str)))
-        updated_image.close()
+    window = sg.Window(title, layout, modal=True, disable_close=True, finalize=True)
+    job.start()
 
-def adjust_password(str, key):
-    """
-    This function adjusts password length to match image string length
-    """
-    
-    difference = len(str)/len(key)
-    difference = math.floor(difference)
-    key = key * difference
-    padding = len(str) - len(key)
-    key += ("=" * padding)
-    return key
-
-def password_generator_microservice():
-    """
-    This function runs the password generator microservice.
-    """
-    # Compile and run microservice in separate process
-    subprocess.run('g++ -std=c++11 password_generator.cpp -o password_generator.exe')
-    process = subprocess.Popen('password_generator.exe', shell=True, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-            
-    # Read microservice prompts into program dialog
-    output = process.stdout.read(92)
-    process.stdout.flush()
-    password_length = sg.popup_get_text(output)
-    process.stdin.write(password_length + '\n')
-    process.stdin.flush()
-
-    # Validate input if invalid size entered
-    while (int(password_length) < 8 or int(password_length) > 30):
-        password_length = sg.popup_get_text(process.stdout.read(103))
-        process.stdout.flush()
-        process.stdin.write(password_length + '\n')
-        process.stdin.flush()
+    # Update progress until the job finishes
+    while job.is_running():
+        event, values = window.read(timeout=100)
 
-    # Terminate subprocess
-    process.terminate()
-    time.sleep(1)
+        if event == "Cancel":
+            job.cancel()
+            window["Cancel"].update(disabled=True)
+            window["-STATUS-"].update("Cancelling...")
+        elif not job.cancel_requested():
+            window["-PROGRESS-"].update(int(job.fraction() * 1000))
+            window["-STATUS-"].update(job.status())
+
+    window.close()
+    return job
 
 
 def sort_alphabetical_microservice():
     """
     This function runs the alphabetical sorting microservice.
     """
+    import ast
+    import subprocess
+
     # Run the alphabetical sorting microservice as a separate process
-    process = subprocess.Popen('py alphabetical_sorting.py', shell=True, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    with tracing.span("microservice", service="alphabetical_sorting") as trace:
+        process = subprocess.Popen('py alphabetical_sorting.py', shell=True, stdout=subprocess.PIPE, stdin=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
 
-    # Read microservice output 
-    output = process.stdout.read()
-    process.stdout.flush()
-    process.terminate()
+        # Read microservice output 
+        output = process.stdout.read()
+        process.stdout.flush()
+        process.terminate()
+        trace.set(bytes=len(output))
 
-    # Remove all brackets and quotes from stringified list to convert back to list
-    str = re.sub(r"[\['\]]", "", output)
-    str = str.split(', ')
+    # Convert stringified list back to a list. Parsing it as a Python
+    # literal keeps values that contain commas, quotes or brackets intact.
+    items = ast.literal_eval(output)
+    if items and isinstance(items[0], (list, tuple)):
+        items = [elem for pair in items for elem in pair]
 
     # Create new nested list so that attributes and values are paired together
     sorted_data = []
-    tag = 0
-    val = 1
-    length = len(str)/2
-
-    for elem in range(int(length)):
-        sorted_data.append([str[tag], str[val]])
-        tag = tag + 2
-        val = val + 2
+    for tag in range(0, len(items) - 1, 2):
+        sorted_data.append([items[tag], items[tag + 1]])
 
     return sorted_data
 
@@ -368,41 +129,55 @@ def view_window(imgpath):
     exif data. Referred to https://exif.readthedocs.io/en/latest/usage.html 
     for reference on using the exif module to access exif data in image.
     """
+    import PySimpleGUI as sg
+    import catalog
+    from sorting import sorted_rows
     
-    # Open image file
-    with open(imgpath, "rb") as img_file:
-        current_image = exif.Image(img_file)
+    # Read EXIF data from the catalog, extracting it if the image changed
+    data = catalog.get_metadata(imgpath)
 
     # Check if image has EXIF data
-    data = []
-    if (current_image.has_exif):
-
-        # Extract EXIF data from image
-        for key, val in tags.items():
-            info = current_image.get(val, 'No Data')
-            data.append([key, info])
-       
-        # Write EXIF data to CSV file
-        with open("data.csv", "w", newline="") as outfile:
-            writer = csv.writer(outfile)
-            writer.writerows(data)
+    if (data is not None):
+
+        # The external sorting microservice reads the EXIF data from a CSV file
+        use_plugin = os.environ.get(SORT_PLUGIN_ENV) == "1"
+        if use_plugin:
+            with open("data.csv", "w", newline="") as outfile:
+                write_csv(data, outfile)
 
         # Window layout
         layout = [
             [sg.Text("Image Name: " + os.path.basename(imgpath), pad=(5,15))],
-            [sg.Table(values=data, headings=["TAG", "DATA"], auto_size_columns=True, justification='left', key="-TABLE-")],
+            [sg.Table(values=data, headings=["TAG", "DATA"], auto_size_columns=True, justification='left', key="-TABLE-", enable_click_events=True, tooltip="Click a column heading to sort by it")],
             [sg.Button("Sort Alphabetical", pad=(25,25))],
             [sg.Column([[sg.Button("Close")]], element_justification='center', expand_x=True)],
         ]
 
         window = sg.Window("View Metadata", layout, grab_anywhere=False)
+
+        # Current sort column and direction, None until sorted
+        sort_column = None
+        descending = False
         
         while True:
             event, values = window.read()
-        
-            if event == "Sort Alphabetical":
 
-                sorted_data = sort_alphabetical_microservice()  
+            # Sort by tag, or by the heading that was clicked. Sorting by
+            # the same column again reverses the order.
+            column = None
+            if event == "Sort Alphabetical":
+                column = 0
+            elif isinstance(event, tuple) and event[0] == "-TABLE-" and event[2][0] == -1:
+                column = event[2][1]
+
+            if column is not None and column >= 0:
+                descending = (column == sort_column and not descending)
+                sort_column = column
+
+                if use_plugin and event == "Sort Alphabetical":
+                    sorted_data = sort_alphabetical_microservice()
+                else:
+                    sorted_data = sorted_rows(imgpath, data, column, descending)
                 window['-TABLE-'].update(values=sorted_data)
         
             if event == "Close" or event == sg.WIN_CLOSED:
@@ -419,6 +194,20 @@ def encrypt_window(imgpath):
     This function opens the Encrypt window to allow user
     to create a password and encrypt the whole image.
     """
+    import PySimpleGUI as sg
+
+    # Check the image from its first few KB instead of parsing all of it
+    try:
+        classification = classify(imgpath)
+    except OSError:
+        sg.popup("Unable to read image.")
+        return
+    if classification.status == ENCRYPTED:
+        sg.popup("Error: This image is already encrypted. Decrypt it first.")
+        return
+    if classification.status == CORRUPT:
+        sg.popup("This image appears to be damaged (" + classification.detail + "). Unable to encrypt.")
+        return
     
     # Window layout
     layout = [
@@ -439,30 +228,15 @@ def encrypt_window(imgpath):
 
     window = sg.Window("Encrypt Metadata", layout, size=(475,500))
 
-    try:
-        # Open image file
-        with open(imgpath, "rb") as img_file:
-            current_image = exif.Image(img_file)
-    except:
-        sg.popup("Unable to read image.")
-        window.close()
-
     while True:
         event, values = window.read()
 
-        # Make sure password.txt file is clear
-        file = open('password.txt','w')
-        file.close()
-
         if event == "Generate random password":
 
-            password_generator_microservice()
-
-            # Open text file, read generated password, fill in text box
-            file = open('password.txt','r')
-            random_password = file.readline()
-            file.close()
-            window["-PASSWORD-"].update(value=random_password)
+            # Generate password and fill in text box
+            random_password = password_window()
+            if random_password is not None:
+                window["-PASSWORD-"].update(value=random_password)
 
         if event == "Encrypt":
 
@@ -483,32 +257,30 @@ def encrypt_window(imgpath):
                 sg.popup("Error: No selection made in Step 2. Please try again.")
                 break
 
-            try:
-                # Convert image to string
-                with open(imgpath, "rb") as imgfile:
-                    str = base64.b64encode(imgfile.read())
-                    str = str.decode('utf-8')
-                        
-                # Encrypt the string
-                key = adjust_password(str, key)
-                str = encrypt(str, key)
-
-                if (radio1 == True):
-                    # Write encrypted string to original image
-                    file = open(imgpath, 'wb')
-                    file.write(base64.b64decode((str)))
-                    file.close()
-
-                elif (radio2 == True):
-                    save_new_image(imgpath, str, "encrypted")
-  
+            # Encrypt the image one block at a time in the background.
+            # Either way the result goes to a temporary file first, so the
+            # original is only replaced once the encrypted image is complete.
+            if (radio1 == True):
+                out_path = imgpath
+                job = Job(encrypt_image, imgpath, key)
+
+            elif (radio2 == True):
+                out_path = new_image_path(imgpath, "encrypted")
+                job = Job(encrypt_image, imgpath, key, out_path)
+
+            progress_window("Encrypting " + os.path.basename(imgpath), job)
+
+            if job.cancelled:
+                sg.popup('Encryption cancelled. The image was not changed.')
+
+            elif job.error is not None:
+                sg.popup('Encryption failed.')
+
+            else:
                 # Display completion message
-                sg.popup('Encryption completed.')
+                sg.popup('Encryption completed. Saved as ' + os.path.basename(out_path) + '.')
                 break
             
-            except:
-                sg.popup('Encryption failed.')
-            
         if event == "Close" or event == sg.WIN_CLOSED:
             break    
 
@@ -521,6 +293,7 @@ def decrypt_window(imgpath):
     to enter a password to decrypt the image. Decrypted 
     image is saved as a new file.
     """
+    import PySimpleGUI as sg
 
     # Window layout
     layout = [
@@ -533,17 +306,15 @@ def decrypt_window(imgpath):
     window = sg.Window("Decrypt Metadata", layout)
 
     
-    # Close window if image opens correctly since it is not encrypted.
-    try:
-        with open(imgpath, "rb") as img_file:
-            current_image = exif.Image(img_file)
-            
+    # Close window if the image is a plain image since it is not encrypted.
+    classification = classify(imgpath)
+    if classification.status == CORRUPT:
+        sg.popup("This image appears to be damaged (" + classification.detail + "). Unable to decrypt.")
+        window.close()
+    elif classification.status != ENCRYPTED:
         sg.popup("This image is not encrypted. Unable to decrypt.")
         window.close()
     
-    except:
-        pass  
-    
     while True:
         event, values = window.read()
         
@@ -556,26 +327,26 @@ def decrypt_window(imgpath):
                 sg.popup("Error: No password entered. Please try again.")
                 break
 
-            try:
-                # Convert image to string
-                with open(imgpath, "rb") as imgfile:
-                    str = base64.b64encode(imgfile.read())
-                    str = str.decode('utf-8')
-                    
-                # Decrypt the string
-                key = adjust_password(str, key)
-                str = decrypt(str, key)
-                
-                # Save image
-                save_new_image(imgpath, str, "decrypted")
+            # Decrypt the image one block at a time into a new image in the background.
+            # A wrong password is rejected after the first block, before anything is written.
+            out_path = new_image_path(imgpath, "decrypted")
+            job = progress_window("Decrypting " + os.path.basename(imgpath),
+                                  Job(decrypt_image, imgpath, key, out_path))
 
-                # Display completion message
-                sg.popup('Decryption completed. Check file to verify.')
-                break
-            
-            except:
+            if job.cancelled:
+                sg.popup('Decryption cancelled.')
+
+            elif isinstance(job.error, WrongPassword):
+                sg.popup("Error: Incorrect password. Please try again.")
+
+            elif job.error is not None:
                 sg.popup("Decryption failed.")
                 break
+
+            else:
+                # Display completion message
+                sg.popup('Decryption completed. Saved as ' + os.path.basename(out_path) + '. Check file to verify.')
+                break
                 
         if event == "Close" or event == sg.WIN_CLOSED:
             break
@@ -588,6 +359,7 @@ def delete_window(imgpath):
     This function opens the Delete Metadata window to allow user
     to delete image EXIF data.
     """
+    import PySimpleGUI as sg
 
     # Window layout
     layout = [
@@ -602,11 +374,8 @@ def delete_window(imgpath):
     window = sg.Window("Delete Metadata", layout)
 
     try:
-        # Open image file
-        with open(imgpath, "rb") as img_file:
-            current_image = exif.Image(img_file)
-        
-        if (current_image.has_exif):
+        # Check image file for metadata
+        if (has_metadata(imgpath)):
 
             while True:
                 event, values = window.read()
@@ -616,16 +385,15 @@ def delete_window(imgpath):
                 
                 if event == "Yes":
 
-                    # Delete EXIF tag data
-                    for key, val in tags.items():
-                        try:
-                            current_image.delete(val)
-                        except:
-                            continue
+                    # Delete EXIF tag data and save changes in the background
+                    job = progress_window("Deleting metadata", Job(strip_metadata, imgpath))
+
+                    if job.cancelled:
+                        sg.popup('Cancelled. The image was not changed.')
+                        continue
 
-                    # Save changes
-                    with open(imgpath, 'wb') as updated_image:
-                        updated_image.write(current_image.get_file())
+                    if job.error is not None:
+                        raise job.error
                     
                     sg.popup('All metadata deleted.')
                     break
@@ -646,6 +414,7 @@ def help_window():
     """
     This function displays a user guide
     """
+    import PySimpleGUI as sg
 
     # Read text file containing user guide
     file = open('readme.txt','r')
@@ -669,91 +438,261 @@ def help_window():
     window.close()
 
 
-# Main screen layout
-
-column1 = [
-    [sg.Text("Select an image:")],
-    [
-        sg.Input(size=(25, 1), enable_events=True, key="-FILE-", tooltip="You can enter the file path here"),
-        sg.FileBrowse(tooltip="Click here to browse and select an image"),
-    ],
-]
-
-column2 = [
-    [sg.Image(key="-IMAGE-")],
-    [sg.Text("Error: Unable to display image", visible=False, key="-ERRORMSG-")], 
-    [sg.pin(sg.Button("View Metadata", key="-VIEW-", tooltip="View EXIF data for this image", visible=False)),
-    sg.pin(sg.Button("Delete Metadata", key="-DELETE-", tooltip="Delete the EXIF data for this image", visible=False)), 
-    sg.pin(sg.Button("Encrypt Image", key="-ENCRYPT-", tooltip="Encrypt the EXIF data for this image", visible=False)), 
-    sg.pin(sg.Button("Decrypt Image", key="-DECRYPT-", tooltip="Decrypt the EXIF data for this image", visible=False))],
-]
-
-layout = [
-    [
-        [sg.Button(" ? ", key="-HELP-", tooltip="Need help? Click here!")],
-        sg.VPush(),
-        sg.Column(column1),
-        sg.VSeperator(),
-        sg.Column(column2, element_justification='c'),
+def gallery_window(directory):
+    """
+    This function opens the Gallery window, which shows the images in a
+    folder as thumbnails. The tiles are reused as the gallery scrolls and
+    only the thumbnails in view are decoded, so large folders scroll as
+    smoothly as small ones. Selecting a tile enables the View, Delete,
+    Encrypt and Decrypt actions for that image.
+    """
+    import PySimpleGUI as sg
+    from gallery import list_images, visible_range, last_row, ThumbnailLoader
+    from gallery import THUMBNAIL_SIZE, THUMBNAIL_EVENT, GALLERY_COLUMNS, GALLERY_ROWS
+
+    paths = list_images(directory)
+    if not paths:
+        sg.popup("This folder does not contain any images.")
+        return
+
+    # Grey image shown while a thumbnail is decoding
+    width, height = THUMBNAIL_SIZE
+    blank = b"P6\n%d %d\n255\n" % (width, height) + b"\xe0" * (width * height * 3)
+
+    # Window layout
+    tile_count = GALLERY_ROWS * GALLERY_COLUMNS
+    tiles = []
+    for row in range(GALLERY_ROWS):
+        tiles.append([sg.Column([[sg.Image(data=blank, key=("-TILE-", i), enable_events=True)],
+                                 [sg.Text("", size=(16, 1), key=("-NAME-", i), justification='c')]],
+                                element_justification='c')
+                      for i in range(row * GALLERY_COLUMNS, (row + 1) * GALLERY_COLUMNS)])
+
+    layout = [
+        [sg.Text(directory + " (" + str(len(paths)) + " images)", key="-FOLDER-")],
+        [sg.Column(tiles),
+         sg.Slider(range=(0, last_row(len(paths))), orientation='v', size=(25, 20), disable_number_display=True,
+                   enable_events=True, key="-SCROLL-")],
+        [sg.Text("Select an image", size=(60, 1), key="-SELECTED-")],
+        [sg.Button("View Metadata", key="-VIEW-", disabled=True),
+         sg.Button("Delete Metadata", key="-DELETE-", disabled=True),
+         sg.Button("Encrypt Image", key="-ENCRYPT-", disabled=True),
+         sg.Button("Decrypt Image", key="-DECRYPT-", disabled=True),
+         sg.Button("Close")],
     ]
-]
 
-window = sg.Window("Image Metadata Manager", layout, size=(800,600))
+    window = sg.Window("Gallery", layout, finalize=True, return_keyboard_events=True)
+    window.bind("<MouseWheel>", "-WHEEL-")
+    window.bind("<Button-4>", "-WHEEL-UP-")
+    window.bind("<Button-5>", "-WHEEL-DOWN-")
+    loader = ThumbnailLoader(window)
+
+    def show(first_row):
+        """
+        This function fills the tiles with the images in view and
+        returns {path: tile number} for them.
+        """
+        start, stop = visible_range(len(paths), first_row)
+        shown = {}
+        for i in range(tile_count):
+            if start + i < stop:
+                path = paths[start + i]
+                shown[path] = i
+                cached = loader.cached(path)
+                name = os.path.basename(path)
+                if cached is not None and cached[1] is not None:
+                    name += " (no preview)"
+                window[("-TILE-", i)].update(data=cached[0] if cached is not None and cached[0] else blank)
+                window[("-NAME-", i)].update(name)
+            else:
+                window[("-TILE-", i)].update(data=blank)
+                window[("-NAME-", i)].update("")
+
+        # Decode the page below as well so scrolling down finds it ready
+        next_start, next_stop = visible_range(len(paths), first_row + GALLERY_ROWS)
+        loader.request(paths[start:stop] + paths[next_start:next_stop])
+        return shown
+
+    first_row = 0
+    shown = show(first_row)
+    selected = None
 
-# Display selected image and options to user
-while True:
-    event, values = window.read()
+    while True:
+        event, values = window.read()
 
-    # Used the following website examples as reference to convert and display jpg images in GUI:
-    # https://pysimplegui.readthedocs.io/en/latest/cookbook/#recipe-convert_to_bytes-function-pil-image-viewer    
-    if event == "-FILE-":
+        if event == "Close" or event == sg.WIN_CLOSED:
+            break
 
-        filename = values["-FILE-"]
-        if os.path.exists(filename):
+        # Put a finished thumbnail in its tile if it is still in view
+        if event == THUMBNAIL_EVENT:
+            path, data, error = values[THUMBNAIL_EVENT]
+            if path in shown:
+                i = shown[path]
+                window[("-TILE-", i)].update(data=data if data else blank)
+                if error is not None:
+                    window[("-NAME-", i)].update(os.path.basename(path) + " (no preview)")
+            continue
+
+        # Work out the new scroll position
+        row = first_row
+        if event == "-SCROLL-":
+            row = int(values["-SCROLL-"])
+        elif event == "-WHEEL-":
+            row -= 1 if window.user_bind_event.delta > 0 else -1
+        elif event == "-WHEEL-UP-" or str(event).startswith("Up:"):
+            row -= 1
+        elif event == "-WHEEL-DOWN-" or str(event).startswith("Down:"):
+            row += 1
+        elif str(event).startswith("Prior:"):
+            row -= GALLERY_ROWS
+        elif str(event).startswith("Next:"):
+            row += GALLERY_ROWS
+
+        row = max(0, min(row, last_row(len(paths))))
+        if row != first_row:
+            first_row = row
+            window["-SCROLL-"].update(value=first_row)
+            shown = show(first_row)
+
+        # Select the clicked image
+        if isinstance(event, tuple) and event[0] == "-TILE-":
+            start, stop = visible_range(len(paths), first_row)
+            if start + event[1] < stop:
+                selected = paths[start + event[1]]
+                window["-SELECTED-"].update("Selected: " + os.path.basename(selected))
+                for key in ("-VIEW-", "-DELETE-", "-ENCRYPT-", "-DECRYPT-"):
+                    window[key].update(disabled=False)
+
+        if event in ("-VIEW-", "-DELETE-", "-ENCRYPT-", "-DECRYPT-") and selected is not None:
+            if event == "-VIEW-":
+                try:
+                    view_window(selected)
+                except:
+                    sg.popup("Unable to read image.")
+            elif event == "-DELETE-":
+                delete_window(selected)
+            elif event == "-ENCRYPT-":
+                encrypt_window(selected)
+            else:
+                decrypt_window(selected)
+
+            # The action may have changed the image or added a new one
+            paths = list_images(directory)
+            first_row = min(first_row, last_row(len(paths)))
+            window["-FOLDER-"].update(directory + " (" + str(len(paths)) + " images)")
+            window["-SCROLL-"].update(value=first_row, range=(0, last_row(len(paths))))
+            shown = show(first_row)
+
+    loader.close()
+    window.close()
+
+
+def main():
+    """
+    This function displays the main screen and runs its event loop.
+    """
+    import PySimpleGUI as sg
+
+    # Main screen layout
+
+    column1 = [
+        [sg.Text("Select an image:")],
+        [
+            sg.Input(size=(25, 1), enable_events=True, key="-FILE-", tooltip="You can enter the file path here"),
+            sg.FileBrowse(tooltip="Click here to browse and select an image"),
+        ],
+        [sg.Text("Or browse a whole folder:")],
+        [
+            sg.Input(enable_events=True, key="-GALLERY-", visible=False),
+            sg.FolderBrowse("Open Gallery", target="-GALLERY-", tooltip="Click here to show a folder of images as thumbnails"),
+        ],
+    ]
+
+    column2 = [
+        [sg.Image(key="-IMAGE-")],
+        [sg.Text("Error: Unable to display image", visible=False, key="-ERRORMSG-")], 
+        [sg.pin(sg.Button("View Metadata", key="-VIEW-", tooltip="View EXIF data for this image", visible=False)),
+        sg.pin(sg.Button("Delete Metadata", key="-DELETE-", tooltip="Delete the EXIF data for this image", visible=False)), 
+        sg.pin(sg.Button("Encrypt Image", key="-ENCRYPT-", tooltip="Encrypt the EXIF data for this image", visible=False)), 
+        sg.pin(sg.Button("Decrypt Image", key="-DECRYPT-", tooltip="Decrypt the EXIF data for this image", visible=False))],
+    ]
+
+    layout = [
+        [
+            [sg.Button(" ? ", key="-HELP-", tooltip="Need help? Click here!")],
+            sg.VPush(),
+            sg.Column(column1),
+            sg.VSeperator(),
+            sg.Column(column2, element_justification='c'),
+        ]
+    ]
+
+    window = sg.Window("Image Metadata Manager", layout, size=(800,600), finalize=True)
+    previews = PreviewWorker(window)
+
+    # Display selected image and options to user
+    while True:
+        event, values = window.read()
+
+        # Decode the selected image on the preview thread
+        if event == "-FILE-":
+
+            filename = values["-FILE-"]
+            if os.path.exists(filename):
+                previews.request(filename)
+
+        # Display the preview if it is for the most recently selected image
+        if event == PREVIEW_EVENT:
+
+            request_id, data, error = values[PREVIEW_EVENT]
+            if previews.is_current(request_id):
+
+                if error is None:
+                    window["-IMAGE-"].update(data)
+                    window["-IMAGE-"].update(visible=True)
+                    window["-ERRORMSG-"].update(visible=False)
+                else:
+                    window["-IMAGE-"].update(visible=False)
+                    window["-ERRORMSG-"].update(visible=True)
 
-            try:
-                img = Image.open(values["-FILE-"])
-                img.thumbnail((400, 400))
-                pic = io.BytesIO()
-                img.save(pic, format="PNG")
-                window["-IMAGE-"].update(pic.getvalue())
-                window["-IMAGE-"].update(visible=True)
-                window["-ERRORMSG-"].update(visible=False)
                 window["-VIEW-"].update(visible=True)
                 window["-ENCRYPT-"].update(visible=True)
                 window["-DECRYPT-"].update(visible=True)
                 window["-DELETE-"].update(visible=True)
-                img.close()
 
+        # Show the selected folder as a gallery
+        if event == "-GALLERY-":
+
+            folder = values["-GALLERY-"]
+            if os.path.isdir(folder):
+                gallery_window(folder)
+            window["-GALLERY-"].update("")
+
+        image_path = values["-FILE-"]
+
+        if event == "-VIEW-":
+            try:
+                view_window(image_path)
             except:
-                window["-IMAGE-"].update(visible=False)
-                window["-ERRORMSG-"].update(visible=True)
-                window["-VIEW-"].update(visible=True)
-                window["-ENCRYPT-"].update(visible=True)
-                window["-DECRYPT-"].update(visible=True)
-                window["-DELETE-"].update(visible=True)
-     
-    image_path = values["-FILE-"]
+                sg.popup("Unable to read image.")
 
-    if event == "-VIEW-":
-        try:
-            view_window(image_path)
-        except:
-            sg.popup("Unable to read image.")
+        if event == "-ENCRYPT-":
+            encrypt_window(image_path)
+
+        if event == "-DECRYPT-":
+            decrypt_window(image_path)
+
+        if event == "-DELETE-":
+            delete_window(image_path)
+
+        if event == "-HELP-":
+            help_window()
+
+        if event == "Exit" or event == sg.WIN_CLOSED:
+            break
+
+    window.close()
 
-    if event == "-ENCRYPT-":
-        encrypt_window(image_path)
-        
-    if event == "-DECRYPT-":
-        decrypt_window(image_path)
-    
-    if event == "-DELETE-":
-        delete_window(image_path)
-        
-    if event == "-HELP-":
-        help_window()
-    
-    if event == "Exit" or event == sg.WIN_CLOSED:
-        break
 
-window.close()
+if __name__ == "__main__":
+    main()
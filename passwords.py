@@ -0,0 +1,25 @@
+# This module generates random passwords for encrypting images. It
+# replaces the password generator microservice, so no compiler, child
+# process or password.txt file is needed.
+
+import string
+
+from core import MIN_PASSWORD_LENGTH, MAX_PASSWORD_LENGTH
+
+# Characters used in generated passwords. All of them are in the cipher's
+# character index, so generated passwords also work with the legacy format.
+PASSWORD_CHARACTERS = string.ascii_letters + string.digits + "!@#$%^&*()_-?.:"
+
+
+def generate_password(length):
+    """
+    This function returns a random password of the given length,
+    which must be between 8 and 30 characters.
+    """
+    import secrets
+
+    length = int(length)
+    if (length < MIN_PASSWORD_LENGTH or length > MAX_PASSWORD_LENGTH):
+        raise ValueError("Password must be between 8 and 30 characters long.")
+
+    return ''.join(secrets.choice(PASSWORD_CHARACTERS) for i in range(length))
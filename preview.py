@@ -0,0 +1,183 @@
+# This module makes the preview shown on the main screen. Images are
+# decoded on a worker thread so the window stays responsive, JPEGs are
+# decoded at a reduced scale, and the result is handed to Tk as PPM,
+# which Tk reads directly without a PNG encode and decode. Very large
+# TIFFs are read a block at a time (see tiffreader.py), GIFs only have
+# their first frame decoded. Other images are decoded whole, like
+# Pillow would, as long as they are within Pillow's decompression bomb
+# limit or their pixels fit in PREVIEW_MEMORY_LIMIT bytes; larger ones
+# are refused instead of running out of memory.
+# Used https://pysimplegui.readthedocs.io/en/latest/cookbook/#recipe-convert_to_bytes-function-pil-image-viewer
+# as reference for converting images for display in the GUI.
+
+import contextlib
+import io
+import threading
+
+import tiffreader
+
+# Largest width and height of the preview
+PREVIEW_SIZE = (400, 400)
+
+# Event posted to the window when a preview is ready
+PREVIEW_EVENT = "-PREVIEW-"
+
+# Memory in bytes that decoding one preview may use for images beyond
+# Pillow's decompression bomb limit
+PREVIEW_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# TIFFs larger than this many pixels are read a block at a time
+TILED_PIXELS = 16 * 1024 * 1024
+
+# Images whose decoded pixels take more bytes than this count as large
+# for make_thumbnail()'s large_decodes
+LARGE_DECODE_BYTES = 32 * 1024 * 1024
+
+_open_lock = threading.Lock()
+
+
+def _open_image(imgpath):
+    """
+    This function opens an image without Pillow's decompression bomb
+    check, since make_thumbnail() enforces its own limits. Returns the
+    image and Pillow's pixel limit (None if there is none).
+    """
+    from PIL import Image
+
+    with _open_lock:
+        limit = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try:
+            return Image.open(imgpath), limit
+        finally:
+            Image.MAX_IMAGE_PIXELS = limit
+
+
+def _fits(img, pixel_limit, max_memory):
+    """
+    This function returns True if the image can be decoded whole: it is
+    within Pillow's pixel limit, or its pixels fit in max_memory bytes.
+    """
+    pixels = img.width * img.height
+    return pixel_limit is None or pixels <= pixel_limit or pixels * len(img.getbands()) <= max_memory
+
+
+def _to_ppm(img):
+    """
+    This function returns an image as RGB PPM bytes.
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    pic = io.BytesIO()
+    img.save(pic, format="PPM")
+    return pic.getvalue()
+
+
+def make_thumbnail(imgpath, size=PREVIEW_SIZE, max_memory=PREVIEW_MEMORY_LIMIT, large_decodes=None):
+    """
+    This function returns a preview of the image as PPM bytes that fit
+    within size. JPEGs are decoded with DCT scaling (Image.draft) so
+    only about as many pixels as needed are decoded, and the remaining
+    shrink uses Image.reduce before resampling. Large TIFFs are read a
+    block at a time, from a reduced-resolution copy when the file has
+    one. Other images are decoded whole if they are within Pillow's
+    decompression bomb limit or their pixels fit in max_memory bytes;
+    otherwise tiffreader.TooLarge is raised. Callers decoding on several
+    threads can pass a semaphore as large_decodes, which is held while
+    an image larger than LARGE_DECODE_BYTES is decoded, to limit how
+    many of those are in memory at once.
+    """
+    image, pixel_limit = _open_image(imgpath)
+    with image as img:
+        # JPEGs are only decoded at the scale set here. Only the first
+        # frame of an animated GIF is decoded, since the image is never
+        # seeked.
+        img.draft("RGB", size)
+
+        gate = contextlib.nullcontext()
+        if large_decodes is not None and img.width * img.height * len(img.getbands()) > LARGE_DECODE_BYTES:
+            gate = large_decodes
+        with gate:
+            return _decode(imgpath, img, size, max_memory, pixel_limit)
+
+
+def _decode(imgpath, img, size, max_memory, pixel_limit):
+    """
+    This function makes the preview for make_thumbnail() from the open
+    image.
+    """
+    if img.format == "TIFF" and img.width * img.height > TILED_PIXELS:
+        try:
+            with open(imgpath, "rb") as imgfile:
+                return _to_ppm(tiffreader.thumbnail(imgfile, size, max_memory))
+        except tiffreader.TooLarge:
+            # E.g. one huge compressed strip, which is decoded whole
+            # below if it fits
+            pass
+        except Exception:
+            # Layouts tiffreader does not handle are decoded whole
+            pass
+
+    if not _fits(img, pixel_limit, max_memory):
+        raise tiffreader.TooLarge("Image is too large to preview within %d MB." % (max_memory // (1024 * 1024)))
+
+    img.thumbnail(size, reducing_gap=2.0)
+    return _to_ppm(img)
+
+
+class PreviewWorker:
+    """
+    Background thread that makes previews for a window. Only the most
+    recent request matters: requests that are replaced before the
+    worker gets to them are skipped, and results are tagged with their
+    request number so the window can ignore outdated ones.
+    """
+
+    def __init__(self, window, size=PREVIEW_SIZE, event=PREVIEW_EVENT, max_memory=PREVIEW_MEMORY_LIMIT):
+        self.window = window
+        self.size = size
+        self.max_memory = max_memory
+        self.event = event
+        self.latest = 0
+        self._pending = None
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def request(self, imgpath):
+        """
+        This function asks for a preview of imgpath, replacing any
+        request that has not started yet, and returns its number.
+        """
+        with self._condition:
+            self.latest += 1
+            self._pending = (self.latest, imgpath)
+            self._condition.notify()
+            return self.latest
+
+    def is_current(self, request_id):
+        """
+        This function returns True if no newer preview was requested.
+        """
+        return request_id == self.latest
+
+    def _run(self):
+        """
+        This function waits for requests and posts
+        (request number, PPM bytes or None, error or None) to the window.
+        """
+        while True:
+            with self._condition:
+                while self._pending is None:
+                    self._condition.wait()
+                request_id, imgpath = self._pending
+                self._pending = None
+
+            try:
+                data, error = make_thumbnail(imgpath, self.size, self.max_memory), None
+            except Exception as exc:
+                data, error = None, exc
+
+            # Do not post results that were replaced while decoding
+            if self.is_current(request_id):
+                self.window.write_event_value(self.event, (request_id, data, error))
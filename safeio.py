@@ -0,0 +1,246 @@
+# This module contains helpers for writing output files safely. Output
+# is written to a temporary file in the same directory and only moved
+# over the real path once it is complete, so a failed or cancelled
+# operation never leaves a half-written file behind.
+#
+# By default the temporary file is flushed to disk (fsync) before it is
+# moved into place and the directory is flushed afterwards, so a crash
+# or power cut leaves either the old file or the whole new one. Runs
+# over many files can leave the finished temporary files for the caller
+# instead (see deferred()). Each one is still synced where it was
+# written, so the workers of a batch run flush their files in parallel
+# with each other and with the work. The files are then moved into
+# place as a group with GroupCommit, which renames them all and syncs
+# each directory once, instead of once per file.
+
+import contextlib
+import os
+import threading
+import time
+
+# Files committed together by a GroupCommit
+GROUP_FILES = 64
+
+# Seconds a finished file waits for its group to be committed
+GROUP_SECONDS = 2.0
+
+_local = threading.local()
+
+
+def _sync_file(path):
+    """
+    This function flushes a file's contents to disk.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        getattr(os, "fdatasync", os.fsync)(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_directory(directory):
+    """
+    This function flushes a directory's entries to disk, so files
+    renamed into it survive a crash. Not needed (or possible) on
+    Windows.
+    """
+    if os.name == "nt":
+        return
+    fd = os.open(directory or ".", os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _create_temp(out_path, mode):
+    """
+    This function creates a new temporary file next to out_path and
+    returns (file descriptor, path). The system applies the umask to
+    mode, like for any new file, without changing the process umask.
+    """
+    directory = os.path.dirname(os.path.abspath(out_path))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+    while True:
+        temp_path = os.path.join(directory, ".%s.%s.tmp" % (os.path.basename(out_path), os.urandom(6).hex()))
+        try:
+            return os.open(temp_path, flags, mode), temp_path
+        except FileExistsError:
+            continue
+
+
+def unique_path(path):
+    """
+    This function returns path if no file has that name, otherwise the
+    first free name of the form "name-2.ext", "name-3.ext", ...
+    """
+    stem, extension = os.path.splitext(path)
+    candidate = path
+    number = 1
+    while os.path.lexists(candidate):
+        number += 1
+        candidate = "%s-%d%s" % (stem, number, extension)
+    return candidate
+
+
+def _move_into_place(temp_path, out_path, overwrite):
+    """
+    This function renames a finished temporary file to out_path. When
+    overwrite is False it raises FileExistsError instead of replacing
+    a file that appeared in the meantime.
+    """
+    if overwrite:
+        os.replace(temp_path, out_path)
+        return
+
+    # A hard link fails if out_path exists, unlike a rename
+    try:
+        os.link(temp_path, out_path)
+    except FileExistsError:
+        raise
+    except OSError:
+        # File systems without hard links
+        if os.path.lexists(out_path):
+            raise FileExistsError(out_path)
+        os.rename(temp_path, out_path)
+        return
+    os.remove(temp_path)
+
+
+@contextlib.contextmanager
+def atomic_output(out_path, like=None, sync=True, overwrite=True):
+    """
+    This function opens a temporary file next to out_path for writing
+    and replaces out_path with it when the block finishes without an
+    error. If like is given, its permission bits are copied to the new
+    file, otherwise it gets the usual permissions for the umask. With
+    sync, the file is flushed to disk before it is moved and the
+    directory after. With overwrite=False, FileExistsError is raised
+    rather than replacing an existing out_path. Inside deferred(), the
+    finished (and, with sync, flushed) file is handed to the caller to
+    commit later instead. An already open binary file (e.g.
+    sys.stdout.buffer) is passed through unchanged.
+    """
+    if hasattr(out_path, 'write'):
+        yield out_path
+        return
+
+    import shutil
+
+    directory = os.path.dirname(os.path.abspath(out_path))
+    # Readable by the owner only until like's permissions are copied
+    fd, temp_path = _create_temp(out_path, 0o600 if like is not None else 0o666)
+    try:
+        with os.fdopen(fd, 'wb') as outfile:
+            yield outfile
+
+        if like is not None:
+            shutil.copymode(like, temp_path)
+
+        if sync:
+            _sync_file(temp_path)
+
+        pending = getattr(_local, "pending", None)
+        if pending is not None:
+            pending.append((temp_path, out_path, overwrite))
+            return
+
+        _move_into_place(temp_path, out_path, overwrite)
+        if sync:
+            sync_directory(directory)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+        raise
+
+
+@contextlib.contextmanager
+def deferred():
+    """
+    This function returns a context manager that collects the files
+    atomic_output() finishes on this thread as (temporary path, output
+    path, overwrite) instead of moving them into place. The caller
+    passes the list to GroupCommit.add() (or discard() on failure).
+    """
+    previous = getattr(_local, "pending", None)
+    pending = _local.pending = []
+    try:
+        yield pending
+    finally:
+        _local.pending = previous
+
+
+def written_path(path):
+    """
+    This function returns the file that currently holds what will become
+    path: inside deferred(), the finished temporary file waiting to be
+    moved there, otherwise path itself.
+    """
+    for temp_path, out_path, overwrite in reversed(getattr(_local, "pending", None) or ()):
+        if out_path == path:
+            return temp_path
+    return path
+
+
+def discard(pending):
+    """
+    This function deletes the temporary files of a deferred() block.
+    """
+    for temp_path, out_path, overwrite in pending:
+        with contextlib.suppress(OSError):
+            os.remove(temp_path)
+
+
+class GroupCommit:
+    """
+    Moves finished temporary files into place in groups of up to
+    max_files, or when the oldest has waited max_seconds. The files were
+    already synced by atomic_output(), so a group is renamed and then
+    each directory is synced once. Use as a context manager so the last
+    group is committed.
+    """
+
+    def __init__(self, max_files=GROUP_FILES, max_seconds=GROUP_SECONDS):
+        self.max_files = max_files
+        self.max_seconds = max_seconds
+        self.pending = []
+        self._oldest = None
+
+    def add(self, pending):
+        """
+        This function adds finished files from deferred() and returns
+        the output paths committed as a result, if any.
+        """
+        if pending and not self.pending:
+            self._oldest = time.monotonic()
+        self.pending.extend(pending)
+        if len(self.pending) >= self.max_files or (
+                self.pending and time.monotonic() - self._oldest >= self.max_seconds):
+            return self.commit()
+        return []
+
+    def commit(self):
+        """
+        This function renames all pending files and syncs their
+        directories, and returns their output paths.
+        """
+        pending, self.pending = self.pending, []
+        committed = []
+        try:
+            for temp_path, out_path, overwrite in pending:
+                _move_into_place(temp_path, out_path, overwrite)
+                committed.append(out_path)
+        except BaseException:
+            discard(pending[len(committed):])
+            raise
+        finally:
+            for directory in {os.path.dirname(os.path.abspath(path)) for path in committed}:
+                sync_directory(directory)
+        return committed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.commit()
+        return False
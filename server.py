@@ -0,0 +1,619 @@
+# This module runs view, delete, encrypt and decrypt as a long-running
+# local service, so other programs can use them without starting a new
+# Python process (and importing Pillow and friends) for every image. It
+# speaks plain HTTP/1.1 with keep-alive over localhost TCP or a Unix
+# socket, using asyncio from the standard library.
+#
+# Each action is a POST to /view, /strip, /encrypt or /decrypt. The body
+# is either JSON naming a file on this machine, e.g.
+#     {"path": "/photos/a.jpg", "out_path": "/clean/a.jpg", "password": "..."}
+# which answers with JSON, or the image bytes themselves (any other
+# Content-Type), which answers with the resulting image (or JSON for
+# /view). The password for uploaded images goes in the X-Password
+# header and the original file name in ?name=, for its extension.
+# GET /health returns the service counters.
+#
+# By default the service listens on a Unix socket that only this user can
+# open. Over TCP it only answers requests whose Host is localhost (so a
+# web page cannot reach it by DNS rebinding) and that carry the token
+# made when it starts, as "Authorization: Bearer <token>"; the token is
+# written to a file only this user can read. Paths in JSON requests can
+# also be limited to a set of root directories.
+#
+# The work runs in a pool of worker processes that are started (and
+# import everything they need) when the service starts. Uploads are
+# written to a temporary directory as they arrive and results are sent
+# back a chunk at a time, so large images are never held in memory. At
+# most max_jobs actions run at once and at most max_waiting more wait for
+# a slot; further requests get 503. A request that is not answered
+# within timeout seconds gets 504 (the worker still finishes the file,
+# since a running process cannot be interrupted safely).
+
+import asyncio
+import collections
+import concurrent.futures
+import hmac
+import http
+import json
+import os
+import secrets
+import shutil
+import tempfile
+import urllib.parse
+
+import tracing
+
+# Where the service listens over TCP
+HOST = "127.0.0.1"
+PORT = 8361
+
+# Host header values accepted over TCP, besides the address listened on
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+# File the TCP token is written to
+TOKEN_FILE = os.path.join(os.path.expanduser("~"), ".image_metadata_service_token")
+
+# Seconds a request may take, waiting for a slot included
+REQUEST_TIMEOUT = 60.0
+
+# Seconds an idle connection is kept open, and allowed for reading a
+# request line and headers
+IDLE_SECONDS = 30.0
+
+# Largest image accepted as a request body
+MAX_UPLOAD_BYTES = 1024 * 1024 * 1024
+
+# Largest JSON request body
+MAX_JSON_BYTES = 64 * 1024
+
+# Most header lines in a request
+MAX_HEADERS = 100
+
+# Bytes read or written at a time when streaming an image
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Actions served, by URL path
+ACTIONS = ("view", "strip", "encrypt", "decrypt")
+
+# A parsed request line and headers (names in lower case)
+Request = collections.namedtuple("Request", ["method", "path", "query", "version", "headers"])
+
+
+class HTTPError(Exception):
+    """
+    Raised to answer a request with an error status and message.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _start_worker():
+    """
+    This function prepares a worker process: it ignores Ctrl+C, so the
+    service shuts the pool down itself, and imports the image modules
+    now rather than on the first request.
+    """
+    import signal
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import core
+    import stripper
+    import sniffer
+    import exifreader
+    import cipher
+
+
+def _ping():
+    """
+    This function does nothing; running it once per worker starts the
+    worker processes ahead of the first request.
+    """
+    return os.getpid()
+
+
+def default_socket_path():
+    """
+    This function returns the Unix socket the service listens on by
+    default: in the user's runtime directory if there is one, otherwise
+    in the home directory.
+    """
+    runtime = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime:
+        return os.path.join(runtime, "image-metadata.sock")
+    return os.path.join(os.path.expanduser("~"), ".image_metadata.sock")
+
+
+def write_token(token, token_path=TOKEN_FILE):
+    """
+    This function saves the TCP token to a file only this user can read.
+    """
+    fd = os.open(token_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as token_file:
+        os.chmod(token_path, 0o600)
+        token_file.write(token + "\n")
+
+
+def run_action(action, path, password=None, out_path=None):
+    """
+    This function runs one action in a worker process. view returns the
+    image EXIF data as a dict of strings, or None; the other actions
+    return (path written, True if the image was changed). Only plain
+    images are encrypted.
+    """
+    import core
+    import sniffer
+    from safeio import atomic_output
+
+    if action == "view":
+        data = core.read_metadata(path)
+        return None if data is None else {key: str(val) for key, val in data}
+
+    if action == "strip":
+        changed = core.strip_metadata(path, out_path=out_path)
+        if out_path is not None and not changed:
+            # Nothing to delete, so the copy is the image as it is
+            with atomic_output(out_path, like=path) as outfile, open(path, "rb") as infile:
+                shutil.copyfileobj(infile, outfile)
+        return out_path or path, changed
+
+    if action == "encrypt":
+        core.check_password(password or "")
+        classification = sniffer.classify(path)
+        if classification.status != sniffer.PLAIN:
+            raise ValueError("Only plain images can be encrypted; this file is %s." % classification.status)
+        # Requests are already spread over processes, so use one thread each
+        core.encrypt_image(path, password, out_path, threads=1)
+        return out_path or path, True
+
+    if action == "decrypt":
+        return core.decrypt_image(path, password or "", out_path, threads=1), True
+
+    raise ValueError("Unknown action: " + action)
+
+
+def _error_status(error):
+    """
+    This function returns the HTTP status for an error raised by an
+    action.
+    """
+    from cipher import WrongPassword
+
+    if isinstance(error, WrongPassword):
+        return 403
+    if isinstance(error, FileNotFoundError):
+        return 404
+    if isinstance(error, (ValueError, OSError)):
+        return 400
+    return 500
+
+
+async def _read_request(reader):
+    """
+    This function reads a request line and headers and returns a
+    Request, or None if the connection was closed first.
+    """
+    line = await reader.readline()
+    if not line.strip():
+        return None
+    try:
+        method, target, version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line.")
+    if not version.startswith("HTTP/1."):
+        raise HTTPError(505, "Only HTTP/1.x is supported.")
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HTTPError(431, "Too many headers.")
+        name, sep, value = line.decode("latin-1").partition(":")
+        if not sep:
+            raise HTTPError(400, "Malformed header.")
+        headers[name.strip().lower()] = value.strip()
+
+    url = urllib.parse.urlsplit(target)
+    query = dict(urllib.parse.parse_qsl(url.query))
+    return Request(method.upper(), url.path, query, version, headers)
+
+
+async def _send_head(writer, status, content_type, length, keep_alive):
+    """
+    This function writes a response status line and headers.
+    """
+    head = "HTTP/1.1 %d %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: %s\r\n" % (
+        status, http.HTTPStatus(status).phrase, content_type, length, "keep-alive" if keep_alive else "close")
+    if status == 503:
+        head += "Retry-After: 1\r\n"
+    writer.write((head + "\r\n").encode("latin-1"))
+    await writer.drain()
+
+
+async def _send_json(writer, status, data, keep_alive):
+    """
+    This function writes a JSON response.
+    """
+    body = (json.dumps(data) + "\n").encode("utf-8")
+    await _send_head(writer, status, "application/json", len(body), keep_alive)
+    writer.write(body)
+    await writer.drain()
+
+
+async def _send_file(writer, path, keep_alive):
+    """
+    This function writes a file as the response body a chunk at a
+    time, waiting for the client to take each chunk.
+    """
+    with open(path, "rb") as result:
+        await _send_head(writer, 200, "application/octet-stream", os.fstat(result.fileno()).st_size, keep_alive)
+        while True:
+            chunk = result.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            writer.write(chunk)
+            await writer.drain()
+
+
+class Server:
+    """
+    Local HTTP service running actions in a pool of worker processes.
+    workers defaults to the CPU count, max_jobs to workers and
+    max_waiting to four times max_jobs.
+    """
+
+    def __init__(self, workers=None, max_jobs=None, max_waiting=None, timeout=REQUEST_TIMEOUT,
+                 max_upload=MAX_UPLOAD_BYTES, roots=None, token=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs or self.workers
+        self.max_waiting = max_waiting if max_waiting is not None else self.max_jobs * 4
+        self.timeout = timeout
+        self.max_upload = max_upload
+        self.roots = [os.path.realpath(root) for root in roots] if roots else None
+        # Made when serving over TCP if not given
+        self.token = token
+
+        self.counters = collections.Counter()
+        self._waiting = 0
+        self._running = 0
+        self._slots = None
+        self._pool = None
+        self._stopped = None
+        self._hosts = None
+
+    def stats(self):
+        """
+        This function returns the service counters as a dict.
+        """
+        stats = {key: self.counters[key] for key in ("requests", "completed", "failed", "rejected", "timeouts")}
+        stats.update(running=self._running, waiting=self._waiting, workers=self.workers,
+                     max_jobs=self.max_jobs, max_waiting=self.max_waiting)
+        return stats
+
+    async def _submit(self, action, path, password=None, out_path=None):
+        """
+        This function waits for a free slot and starts an action in the
+        pool. Returns the future of the worker's result.
+        """
+        if self._waiting >= self.max_waiting:
+            self.counters["rejected"] += 1
+            raise HTTPError(503, "Too many requests waiting.")
+
+        self._waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._running += 1
+        job = asyncio.get_running_loop().run_in_executor(self._pool, tracing.run_traced, run_action, action, path,
+                                                         password, out_path)
+        job.add_done_callback(self._finished)
+        return job
+
+    def _finished(self, job):
+        """
+        This function frees the slot of a finished action and adds its
+        span totals to the service's.
+        """
+        self._running -= 1
+        self._slots.release()
+        # Mark the error as seen when the request already timed out
+        if not job.cancelled() and job.exception() is None:
+            tracing.add_totals(job.result()[2])
+
+    async def _perform(self, action, path, password=None, out_path=None, cleanup=None):
+        """
+        This function runs an action within the request timeout and
+        returns its result. If the request fails, cleanup is called
+        once the worker is done with the files, which can be after the
+        request has timed out.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        job = None
+        try:
+            try:
+                job = await asyncio.wait_for(self._submit(action, path, password, out_path), self.timeout)
+                result, error, totals = await asyncio.wait_for(asyncio.shield(job), max(0.0, deadline - loop.time()))
+                if error is not None:
+                    raise error
+                return result
+            except asyncio.TimeoutError:
+                self.counters["timeouts"] += 1
+                raise HTTPError(504, "The request took longer than %g seconds." % self.timeout)
+            except HTTPError:
+                raise
+            except Exception as error:
+                raise HTTPError(_error_status(error), str(error) or type(error).__name__)
+        except BaseException:
+            if cleanup is not None:
+                if job is None or job.done():
+                    cleanup()
+                else:
+                    job.add_done_callback(lambda job: cleanup())
+            raise
+
+    async def _read_json(self, reader, length):
+        """
+        This function reads a JSON request body.
+        """
+        if length > MAX_JSON_BYTES:
+            raise HTTPError(413, "JSON request is too large.")
+        try:
+            data = json.loads(await reader.readexactly(length))
+        except ValueError:
+            raise HTTPError(400, "Request body is not valid JSON.")
+        if not isinstance(data, dict) or not isinstance(data.get("path"), str):
+            raise HTTPError(400, 'JSON request needs a "path".')
+        return data
+
+    async def _handle_path(self, request, reader, writer, length, keep_alive):
+        """
+        This function runs an action on a file named in a JSON request
+        and answers with JSON.
+        """
+        data = await self._read_json(reader, length)
+        action = request.path.strip("/")
+        for key in ("path", "out_path"):
+            if data.get(key) is not None:
+                self._check_path(data[key])
+        result = await self._perform(action, data["path"], data.get("password"), data.get("out_path"))
+
+        if action == "view":
+            await _send_json(writer, 200, {"path": data["path"], "metadata": result}, keep_alive)
+        else:
+            path, changed = result
+            await _send_json(writer, 200, {"path": path, "changed": changed}, keep_alive)
+
+    def _check_path(self, path):
+        """
+        This function raises HTTPError unless path is under one of the
+        root directories, when they are set.
+        """
+        if not isinstance(path, str):
+            raise HTTPError(400, "Paths must be strings.")
+        if self.roots is None:
+            return
+        path = os.path.realpath(path)
+        if not any(os.path.commonpath([root, path]) == root for root in self.roots):
+            raise HTTPError(403, "Path is outside the directories this service may use.")
+
+    def _check_client(self, request):
+        """
+        This function raises HTTPError for TCP requests that do not name
+        this machine as Host or do not carry the token.
+        """
+        if self._hosts is None:
+            return
+
+        host = request.headers.get("host", "")
+        if host.startswith("["):
+            host = host[1:].partition("]")[0]
+        else:
+            host = host.rpartition(":")[0] if ":" in host else host
+        if host.lower() not in self._hosts:
+            raise HTTPError(421, "Requests must be addressed to localhost.")
+
+        scheme, _, token = request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), self.token.encode()):
+            raise HTTPError(401, "Missing or wrong token.")
+
+    async def _handle_upload(self, request, reader, writer, length, keep_alive):
+        """
+        This function saves an uploaded image to a temporary directory,
+        runs an action on it and answers with the resulting image.
+        """
+        action = request.path.strip("/")
+        name = os.path.basename(request.query.get("name", "")).lstrip(".") or "image"
+        directory = tempfile.mkdtemp(prefix="metadata-serve-")
+
+        def cleanup():
+            shutil.rmtree(directory, ignore_errors=True)
+
+        path = os.path.join(directory, name)
+
+        try:
+            # Write the upload to disk as it arrives
+            with open(path, "wb") as upload:
+                remaining = length
+                while remaining:
+                    chunk = await reader.read(min(STREAM_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        raise asyncio.IncompleteReadError(b"", remaining)
+                    upload.write(chunk)
+                    remaining -= len(chunk)
+        except BaseException:
+            cleanup()
+            raise
+
+        out_path = None
+        if action == "decrypt":
+            stem, extension = os.path.splitext(name)
+            out_path = os.path.join(directory, stem + "-decrypted" + extension)
+
+        result = await self._perform(action, path, request.headers.get("x-password"), out_path, cleanup)
+        try:
+            if action == "view":
+                await _send_json(writer, 200, {"name": name, "metadata": result}, keep_alive)
+            else:
+                await _send_file(writer, result[0], keep_alive)
+        finally:
+            cleanup()
+
+    async def _respond(self, request, reader, writer):
+        """
+        This function answers one request. Returns False if the
+        connection cannot be used for another request.
+        """
+        keep_alive = request.headers.get("connection", "").lower() != "close" and request.version != "HTTP/1.0"
+        self._check_client(request)
+
+        if request.path == "/health":
+            if request.method != "GET":
+                raise HTTPError(405, "Use GET for /health.")
+            await _send_json(writer, 200, dict(self.stats(), status="ok"), keep_alive)
+            return keep_alive
+
+        if request.path.strip("/") not in ACTIONS:
+            raise HTTPError(404, "Unknown path: " + request.path)
+        if request.method != "POST":
+            raise HTTPError(405, "Use POST for " + request.path + ".")
+        if "transfer-encoding" in request.headers:
+            raise HTTPError(411, "Send the body with a Content-Length.")
+        try:
+            length = int(request.headers.get("content-length", "0"))
+        except ValueError:
+            raise HTTPError(400, "Bad Content-Length.")
+        if length <= 0:
+            raise HTTPError(400, "The request has no body.")
+
+        is_json = request.headers.get("content-type", "").split(";")[0].strip() == "application/json"
+        if not is_json and length > self.max_upload:
+            raise HTTPError(413, "Image is larger than %d bytes." % self.max_upload)
+
+        # Let clients such as curl send the body once it will be accepted
+        if request.headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+
+        if is_json:
+            await self._handle_path(request, reader, writer, length, keep_alive)
+        else:
+            await self._handle_upload(request, reader, writer, length, keep_alive)
+        return keep_alive
+
+    async def _connection(self, reader, writer):
+        """
+        This function serves the requests of one connection until it is
+        closed, idle for too long, or a request fails part way.
+        """
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(_read_request(reader), IDLE_SECONDS)
+                except HTTPError as error:
+                    await _send_json(writer, error.status, {"error": str(error)}, False)
+                    break
+                except (asyncio.TimeoutError, ValueError):
+                    break
+                if request is None:
+                    break
+
+                self.counters["requests"] += 1
+                try:
+                    keep_alive = await self._respond(request, reader, writer)
+                    self.counters["completed"] += 1
+                except HTTPError as error:
+                    self.counters["failed"] += 1
+                    # The unread body is in the way of the next request
+                    await _send_json(writer, error.status, {"error": str(error)}, False)
+                    break
+                except OSError as error:
+                    # E.g. the temporary directory is full
+                    self.counters["failed"] += 1
+                    await _send_json(writer, 500, {"error": str(error)}, False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def stop(self):
+        """
+        This function makes serve() return once the requests in
+        progress have been answered.
+        """
+        if self._stopped is not None:
+            self._stopped.set()
+
+    async def serve(self, host=HOST, port=PORT, socket_path=None, on_ready=None):
+        """
+        This function starts the worker processes and serves requests
+        on the Unix socket socket_path, or on host:port when it is None,
+        until stop() is called. Over TCP, requests need self.token (made
+        here if not set). on_ready(address) is called once the service
+        is accepting connections.
+        """
+        self._slots = asyncio.Semaphore(self.max_jobs)
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_start_worker) as pool:
+            self._pool = pool
+            # Start every worker now so the first requests do not wait
+            await asyncio.gather(*(loop.run_in_executor(pool, _ping) for _ in range(self.workers)))
+
+            if socket_path is not None:
+                _remove_stale_socket(socket_path)
+                # Create the socket so only this user can connect
+                umask = os.umask(0o077)
+                try:
+                    listener = await asyncio.start_unix_server(self._connection, socket_path)
+                finally:
+                    os.umask(umask)
+                address = socket_path
+            else:
+                if self.token is None:
+                    self.token = secrets.token_urlsafe(32)
+                self._hosts = set(LOCAL_HOSTS) | {host.lower().strip("[]")}
+                listener = await asyncio.start_server(self._connection, host, port)
+                address = "http://%s:%d" % listener.sockets[0].getsockname()[:2]
+
+            try:
+                async with listener:
+                    if on_ready is not None:
+                        on_ready(address)
+                    await self._stopped.wait()
+            finally:
+                if socket_path is not None:
+                    os.remove(socket_path)
+                tracing.write_metrics()
+
+
+def _remove_stale_socket(socket_path):
+    """
+    This function removes a Unix socket left behind by a service that
+    is no longer running. Raises OSError if one is still listening.
+    """
+    import socket
+    import stat
+
+    try:
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            raise OSError("%s exists and is not a socket." % socket_path)
+    except FileNotFoundError:
+        return
+
+    with socket.socket(socket.AF_UNIX) as probe:
+        try:
+            probe.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise OSError("Another service is already listening on %s." % socket_path)
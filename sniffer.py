@@ -0,0 +1,212 @@
+# This module tells plain, encrypted and corrupt images apart by looking
+# at their first few KB instead of parsing them. Plain images are
+# recognized by their signature and the structure of their first
+# header, images encrypted with the raw format by their trailer, and
+# images whose signature is gone are taken to use the legacy format,
+# which has no marker of its own.
+# Referred to the JPEG (ITU T.81), PNG, TIFF 6.0, GIF89a and BMP
+# specifications for the header layouts.
+
+import collections
+import os
+import struct
+import zlib
+
+from cipher import read_format, FORMAT_RAW
+
+# Classifications
+PLAIN = "plain"
+ENCRYPTED = "encrypted"
+CORRUPT = "corrupt"
+
+# Largest number of bytes read from the start of a file
+SNIFF_SIZE = 4096
+
+# Image type -> signatures it starts with
+SIGNATURES = {
+    "jpeg": (b"\xff\xd8\xff",),
+    "png": (b"\x89PNG\r\n\x1a\n",),
+    "gif": (b"GIF87a", b"GIF89a"),
+    "tiff": (b"II*\x00", b"MM\x00*"),
+    "bmp": (b"BM",),
+}
+
+# Result of classifying one file. kind is the image type for plain and
+# corrupt images and "raw" or "legacy" for encrypted ones.
+Classification = collections.namedtuple("Classification", ["status", "kind", "detail"])
+
+
+def _check_jpeg(header, size):
+    """
+    This function returns None if the JPEG segments in header are well
+    formed up to the start of scan or the end of header, otherwise a
+    description of the problem.
+    """
+    if len(header) < 4:
+        return "truncated header"
+    pos = 2
+    while pos + 4 <= len(header):
+        if header[pos] != 0xFF:
+            return "bad marker at byte %d" % pos
+        marker = header[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x00 or marker == 0xD8:
+            return "bad marker at byte %d" % pos
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xDA, 0xD9):
+            return None
+
+        length = (header[pos + 2] << 8) | header[pos + 3]
+        if length < 2 or pos + 2 + length > size:
+            return "bad segment length at byte %d" % pos
+        pos += 2 + length
+    return None
+
+
+def _check_png(header, size):
+    """
+    This function checks the IHDR chunk of a PNG, including its CRC.
+    """
+    if len(header) < 33:
+        return "truncated header"
+    length, type = struct.unpack(">I4s", header[8:16])
+    if type != b"IHDR" or length != 13:
+        return "first chunk is not IHDR"
+    crc, = struct.unpack(">I", header[29:33])
+    if zlib.crc32(header[12:29]) != crc:
+        return "IHDR checksum mismatch"
+    width, height = struct.unpack(">II", header[16:24])
+    if not width or not height:
+        return "zero image size"
+    return None
+
+
+def _check_tiff(header, size):
+    """
+    This function checks that the first IFD of a TIFF is in the file.
+    """
+    if len(header) < 8:
+        return "truncated header"
+    order = "<" if header[:2] == b"II" else ">"
+    offset, = struct.unpack(order + "I", header[4:8])
+    if offset < 8 or offset + 2 > size:
+        return "first IFD outside the file"
+    return None
+
+
+def _check_gif(header, size):
+    """
+    This function checks the logical screen descriptor of a GIF.
+    """
+    if len(header) < 13:
+        return "truncated header"
+    width, height = struct.unpack("<HH", header[6:10])
+    if not width or not height:
+        return "zero image size"
+    return None
+
+
+def _check_bmp(header, size):
+    """
+    This function checks the file and DIB headers of a BMP.
+    """
+    if len(header) < 18:
+        return "truncated header"
+    offset, dib_size = struct.unpack("<II", header[10:18])
+    if dib_size not in (12, 40, 52, 56, 64, 108, 124):
+        return "unknown DIB header size"
+    if offset < 14 + dib_size or offset > size:
+        return "pixel data outside the file"
+    return None
+
+
+# Image type -> header check
+_CHECKS = {
+    "jpeg": _check_jpeg,
+    "png": _check_png,
+    "gif": _check_gif,
+    "tiff": _check_tiff,
+    "bmp": _check_bmp,
+}
+
+
+def image_kind(header):
+    """
+    This function returns the image type whose signature header starts
+    with, or None.
+    """
+    for kind, signatures in SIGNATURES.items():
+        if header.startswith(signatures):
+            return kind
+    return None
+
+
+def classify(imgpath):
+    """
+    This function returns the Classification of a file, reading at most
+    SNIFF_SIZE bytes from its start and the raw format trailer from its
+    end.
+    """
+    with open(imgpath, "rb") as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size
+        if size == 0:
+            return Classification(CORRUPT, None, "empty file")
+
+        try:
+            if read_format(imgfile) == FORMAT_RAW:
+                return Classification(ENCRYPTED, "raw", None)
+        except ValueError as error:
+            # Raw format trailer with a version this program does not know
+            return Classification(ENCRYPTED, "raw", str(error))
+
+        header = imgfile.read(SNIFF_SIZE)
+
+    kind = image_kind(header)
+    if kind is None:
+        return Classification(ENCRYPTED, "legacy", None)
+
+    problem = _CHECKS[kind](header, size)
+    if problem is not None:
+        return Classification(CORRUPT, kind, problem)
+    return Classification(PLAIN, kind, None)
+
+
+def _classify_safely(path):
+    """
+    This function classifies one file, reporting read errors as corrupt.
+    """
+    try:
+        return classify(path)
+    except OSError as error:
+        return Classification(CORRUPT, None, str(error))
+
+
+def scan(root, workers=None):
+    """
+    This function classifies every image under root with a pool of
+    threads, since the work is mostly waiting for small reads. Yields
+    (path, Classification) in the same order as batch.find_images().
+    """
+    import batch
+    import concurrent.futures
+
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) * 4)
+
+    paths = batch.find_images(root)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded number of reads queued so huge trees stream
+        pending = collections.deque()
+        for path in paths:
+            pending.append((path, pool.submit(_classify_safely, path)))
+            if len(pending) >= workers * 4:
+                path, future = pending.popleft()
+                yield path, future.result()
+
+        while pending:
+            path, future = pending.popleft()
+            yield path, future.result()
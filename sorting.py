@@ -0,0 +1,96 @@
+# This module sorts the rows of the View Metadata table in-process.
+# Numbers, rationals such as "1/250" and tuples such as GPS coordinates
+# sort by value rather than as text, and missing values always go last.
+# Sorted results are cached per image so sorting again is instant.
+
+import collections
+import os
+import re
+
+# Value shown in the table when an image does not have a tag
+NO_DATA = 'No Data'
+
+# Most sorted tables kept in the cache
+CACHE_SIZE = 256
+
+# (path, size, mtime, column, descending) -> sorted rows
+_cache = collections.OrderedDict()
+
+_NUMBER = re.compile(r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$")
+
+
+def _number(text):
+    """
+    This function returns text as a float if it is a number or a
+    rational like "1/250", otherwise None.
+    """
+    if _NUMBER.match(text):
+        return float(text)
+
+    parts = text.split("/")
+    if len(parts) == 2 and _NUMBER.match(parts[0]) and _NUMBER.match(parts[1]):
+        denominator = float(parts[1])
+        if denominator:
+            return float(parts[0]) / denominator
+    return None
+
+
+def sort_key(value):
+    """
+    This function returns a key that orders numbers (and sequences of
+    numbers) by value before any text, with text compared without case.
+    """
+    if isinstance(value, bool):
+        value = int(value)
+
+    if isinstance(value, (int, float)):
+        return (0, (float(value),), "")
+
+    if isinstance(value, (tuple, list)) and value and all(isinstance(v, (int, float)) for v in value):
+        return (0, tuple(float(v) for v in value), "")
+
+    text = str(value)
+    number = _number(text)
+    if number is not None:
+        return (0, (number,), "")
+
+    # Tuples stored as text, e.g. "(45.0, 30.0, 12.34)"
+    if text.startswith("(") and text.endswith(")"):
+        numbers = [_number(part) for part in text[1:-1].split(",") if part.strip()]
+        if numbers and None not in numbers:
+            return (0, tuple(numbers), "")
+
+    return (1, (), text.casefold())
+
+
+def sort_rows(rows, column=0, descending=False):
+    """
+    This function returns the table rows sorted by one column. Rows
+    whose value is missing stay at the end in either direction.
+    """
+    present = [row for row in rows if row[column] != NO_DATA]
+    missing = [row for row in rows if row[column] == NO_DATA]
+    present.sort(key=lambda row: sort_key(row[column]), reverse=descending)
+    return present + missing
+
+
+def sorted_rows(imgpath, rows, column=0, descending=False):
+    """
+    This function returns sort_rows() for an image, reusing the result
+    from an earlier call while the image file is unchanged.
+    """
+    try:
+        stat = os.stat(imgpath)
+        key = (os.path.abspath(imgpath), stat.st_size, stat.st_mtime_ns, column, descending)
+    except OSError:
+        return sort_rows(rows, column, descending)
+
+    result = _cache.get(key)
+    if result is None:
+        result = sort_rows(rows, column, descending)
+        _cache[key] = result
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    else:
+        _cache.move_to_end(key)
+    return result
@@ -0,0 +1,161 @@
+# This module removes metadata from images by dropping whole segments
+# instead of parsing and re-encoding the metadata. JPEG APP1 (EXIF and
+# XMP) and APP13 (IPTC) segments and PNG eXIf/tEXt/iTXt/zTXt chunks are
+# dropped; everything else is copied through unchanged, using
+# os.sendfile where possible, so stripping costs about as much as a
+# file copy however many tags an image has.
+# Referred to the JPEG (ITU T.81) and PNG specifications for the layouts.
+
+import os
+import struct
+
+import tracing
+from safeio import atomic_output
+
+# JPEG markers whose segments are removed
+JPEG_METADATA_MARKERS = (0xE1, 0xED)
+
+# PNG chunks that are removed
+PNG_METADATA_CHUNKS = (b"eXIf", b"tEXt", b"iTXt", b"zTXt")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Largest number of bytes copied between progress reports
+COPY_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+def _jpeg_metadata(imgfile, size):
+    """
+    This function returns the (start, end) byte ranges of the metadata
+    segments in a JPEG. Only the 4 byte segment headers are read, up to
+    the start of the compressed image data.
+    """
+    spans = []
+    pos = 2
+    while pos + 4 <= size:
+        imgfile.seek(pos)
+        header = imgfile.read(4)
+        if header[0] != 0xFF:
+            raise ValueError("Corrupt JPEG marker.")
+        marker = header[1]
+
+        # Fill bytes and standalone markers have no length
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            pos += 2
+            continue
+
+        # Everything from the start of scan on is image data
+        if marker in (0xDA, 0xD9):
+            break
+
+        length = (header[2] << 8) | header[3]
+        end = pos + 2 + length
+        if marker in JPEG_METADATA_MARKERS:
+            spans.append((pos, min(end, size)))
+        pos = end
+
+    return spans
+
+
+def _png_metadata(imgfile, size):
+    """
+    This function returns the (start, end) byte ranges of the metadata
+    chunks in a PNG. Only the 8 byte chunk headers are read.
+    """
+    spans = []
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= size:
+        imgfile.seek(pos)
+        length, type = struct.unpack(">I4s", imgfile.read(8))
+        end = pos + 12 + length
+        if type in PNG_METADATA_CHUNKS:
+            spans.append((pos, min(end, size)))
+        if type == b"IEND":
+            break
+        pos = end
+
+    return spans
+
+
+def find_metadata(imgpath):
+    """
+    This function returns the (start, end) byte ranges of the metadata
+    segments in a JPEG or PNG. Other formats return an empty list.
+    """
+    with open(imgpath, "rb") as imgfile:
+        size = os.fstat(imgfile.fileno()).st_size
+        signature = imgfile.read(len(PNG_SIGNATURE))
+
+        if signature.startswith(b"\xff\xd8"):
+            return _jpeg_metadata(imgfile, size)
+        if signature == PNG_SIGNATURE:
+            return _png_metadata(imgfile, size)
+    return []
+
+
+def _copy_range(infile, outfile, start, end, progress, done, total):
+    """
+    This function copies bytes start..end of infile to the end of
+    outfile, in blocks so progress can be reported between them.
+    Returns the new number of bytes done.
+    """
+    in_fd = infile.fileno()
+    out_fd = outfile.fileno()
+    pos = start
+    while pos < end:
+        if progress is not None:
+            progress(done, total)
+        count = min(COPY_BLOCK_SIZE, end - pos)
+
+        try:
+            sent = os.sendfile(out_fd, in_fd, pos, count)
+        except (AttributeError, OSError):
+            # sendfile is not available for every platform and file type
+            infile.seek(pos)
+            sent = os.write(out_fd, infile.read(count))
+
+        if sent == 0:
+            raise ValueError("Unexpected end of file.")
+        pos += sent
+        done += sent
+    return done
+
+
+def strip_file(imgpath, out_path=None, progress=None):
+    """
+    This function removes the metadata segments from a JPEG or PNG and
+    writes the result to out_path, or over the image when no out_path
+    is given. The new file is written to a temporary file and moved into
+    place when complete. Returns the number of segments removed; when
+    there is nothing to remove the image is not rewritten.
+    progress(bytes done, total bytes) is called between blocks and may
+    raise to stop, leaving the image unchanged.
+    """
+    with tracing.span("strip_segments", path=imgpath) as trace:
+        spans = find_metadata(imgpath)
+        trace.phase("find_metadata")
+        trace.set(segments=len(spans))
+        if not spans:
+            return 0
+
+        if out_path is None:
+            out_path = imgpath
+
+        with open(imgpath, "rb") as infile, atomic_output(out_path, like=imgpath) as outfile:
+            size = os.fstat(infile.fileno()).st_size
+            total = size - sum(end - start for start, end in spans)
+
+            # Copy the ranges between the metadata segments
+            done = 0
+            pos = 0
+            for start, end in spans:
+                done = _copy_range(infile, outfile, pos, start, progress, done, total)
+                pos = end
+            _copy_range(infile, outfile, pos, size, progress, done, total)
+            trace.phase("copy", total)
+        trace.set(bytes=total)
+
+    return len(spans)
@@ -0,0 +1,271 @@
+# The cipher functions as they were in the original metadata.py, before
+# they were moved to cipher.py and rewritten. Kept unchanged so the
+# tests can check that the new code gives the same results.
+
+import base64
+import math
+
+# Index that is used for converting a character to a number
+convert_to_nums = {
+    'A': 1,
+    'B': 2,
+    'C': 3,
+    'D': 4,
+    'E': 5,
+    'F': 6,
+    'G': 7,
+    'H': 8,
+    'I': 9,
+    'J': 10,
+    'K': 11,
+    'L': 12,
+    'M': 13,
+    'N': 14,
+    'O': 15,
+    'P': 16,
+    'Q': 17,
+    'R': 18,
+    'S': 19,
+    'T': 20,
+    'U': 21,
+    'V': 22,
+    'W': 23,
+    'X': 24,
+    'Y': 25,
+    'Z': 26,
+    'a': 27,
+    'b': 28,
+    'c': 29,
+    'd': 30,
+    'e': 31,
+    'f': 32,
+    'g': 33,
+    'h': 34,
+    'i': 35,
+    'j': 36,
+    'k': 37,
+    'l': 38,
+    'm': 39,
+    'n': 40,
+    'o': 41,
+    'p': 42,
+    'q': 43,
+    'r': 44,
+    's': 45,
+    't': 46,
+    'u': 47,
+    'v': 48,
+    'w': 49,
+    'x': 50,
+    'y': 51,
+    'z': 52,
+    '0': 53,
+    '1': 54,
+    '2': 55,
+    '3': 56,
+    '4': 57,
+    '5': 58,
+    '6': 59,
+    '7': 60,
+    '8': 61,
+    '9': 62,
+    '+': 63,
+    '/': 64,
+    '=': 65,
+    '!': 66,
+    '@': 67,
+    '#': 68,
+    '$': 69,
+    '%': 70,
+    '^': 71,
+    '&': 72,
+    '*': 73,
+    '(': 74,
+    ')': 75,
+    '_': 76,
+    '-': 77,
+    ' ': 78,
+    '?': 79,
+    '.': 80,
+    ',': 81,
+    ':': 82,
+}
+
+# Index that is used for converting a number to a character
+convert_to_chars = {
+    1: 'A',
+    2: 'B',
+    3: 'C',
+    4: 'D',
+    5: 'E',
+    6: 'F',
+    7: 'G',
+    8: 'H',
+    9: 'I',
+    10: 'J',
+    11: 'K',
+    12: 'L',
+    13: 'M',
+    14: 'N',
+    15: 'O',
+    16: 'P',
+    17: 'Q',
+    18: 'R',
+    19: 'S',
+    20: 'T',
+    21: 'U',
+    22: 'V',
+    23: 'W',
+    24: 'X',
+    25: 'Y',
+    26: 'Z',
+    27: 'a',
+    28: 'b',
+    29: 'c',
+    30: 'd',
+    31: 'e',
+    32: 'f',
+    33: 'g',
+    34: 'h',
+    35: 'i',
+    36: 'j',
+    37: 'k',
+    38: 'l',
+    39: 'm',
+    40: 'n',
+    41: 'o',
+    42: 'p',
+    43: 'q',
+    44: 'r',
+    45: 's',
+    46: 't',
+    47: 'u',
+    48: 'v',
+    49: 'w',
+    50: 'x',
+    51: 'y',
+    52: 'z',
+    53: '0',
+    54: '1',
+    55: '2',
+    56: '3',
+    57: '4',
+    58: '5',
+    59: '6',
+    60: '7',
+    61: '8',
+    62: '9',
+    63: '+',
+    64: '/',
+}
+
+
+def encrypt(plaintext, key):
+    """
+    This function takes in two parameters: a plaintext  
+    string and a key. The plaintext is encrypted using 
+    one-time pad style encryption. 
+    """
+
+    # Convert plaintext and key from string to list
+    list1 = list(plaintext)
+    list2 = list(key)
+
+    # Convert each character in plaintext to a number
+    for count, i in enumerate(plaintext):
+        list1[count] = convert_to_nums.get(i)
+
+    # Convert each character in key to a number
+    for count, i in enumerate(key):
+        list2[count] = convert_to_nums.get(i)
+
+    # Add plaintext and key and store result in temp list 
+    temp = []
+    
+    for j in range(len(plaintext)):
+        sum = list1[j] + list2[j]
+        if (sum > 64):
+            sum = sum % 64
+            if (sum <= 0):
+                sum = sum + 64
+        temp.append(sum)
+
+    # Convert numbers back to characters
+    for count, i in enumerate(temp):
+        temp[count] = convert_to_chars.get(i)
+
+    # Change last character in string to a "=" for padding
+    temp[len(temp) - 1] = '='
+
+    # Convert list to string and return
+    encrypted_data = ''.join([elem for elem in temp])
+    return encrypted_data
+
+
+def decrypt(encrypted_word, key):
+    """
+    This function takes in two parameters: an encrypted string 
+    and a key. The string is decrypted with the key using  
+    one-time pad style encryption. 
+    """
+
+    # Convert encrypted word and key from string to list
+    list1 = list(encrypted_word)
+    list2 = list(key)
+
+    # Convert each character in encrypted word to a number
+    for count, i in enumerate(encrypted_word):
+        list1[count] = convert_to_nums.get(i)
+
+    # Convert each character in key to a number
+    for count, i in enumerate(key):
+        list2[count] = convert_to_nums.get(i)
+
+    # Subtract key from encrypted_word and store result in temp list
+    temp = []
+    for j in range(len(encrypted_word)):
+        sub = list1[j] - list2[j]
+        while (sub <= 0):
+            sub = sub + 64   
+        temp.append(sub)
+
+    # Convert numbers back to characters
+    for count, i in enumerate(temp):
+        temp[count] = convert_to_chars.get(i)
+
+    # Change last character in string to a "=" for padding
+    temp[len(temp) - 1] = '='
+
+    # Convert list to string and return
+    decrypted_data = ''.join([elem for elem in temp])
+    return decrypted_data
+
+def adjust_password(str, key):
+    """
+    This function adjusts password length to match image string length
+    """
+    
+    difference = len(str)/len(key)
+    difference = math.floor(difference)
+    key = key * difference
+    padding = len(str) - len(key)
+    key += ("=" * padding)
+    return key
+
+
+def encrypt_image_bytes(data, key):
+    """
+    This function encrypts image bytes the way the original encrypt
+    window did: the whole image as one base64 string.
+    """
+    text = base64.b64encode(data).decode('utf-8')
+    return base64.b64decode(encrypt(text, adjust_password(text, key)))
+
+
+def decrypt_image_bytes(data, key):
+    """
+    This function decrypts image bytes the way the original decrypt
+    window did.
+    """
+    text = base64.b64encode(data).decode('utf-8')
+    return base64.b64decode(decrypt(text, adjust_password(text, key)))
@@ -0,0 +1,179 @@
+# Tests for cipher.py. The text functions and the legacy file format are
+# checked against the original implementations in tests/original.py on
+# random inputs; the raw format is checked by round trips.
+
+import base64
+import os
+import random
+
+import pytest
+
+import cipher
+from tests import original
+
+# Characters the original cipher accepts in texts and passwords
+CHARS = "".join(original.convert_to_nums)
+
+PASSWORD = "correct-horse-battery-staple-9"
+
+
+def random_text(rng, length):
+    return "".join(rng.choice(CHARS) for _ in range(length))
+
+
+def random_image_text(rng, size):
+    # The original functions only handle base64 text, as made from an image
+    return base64.b64encode(rng.randbytes(size)).decode()
+
+
+def write(path, data):
+    with open(path, "wb") as outfile:
+        outfile.write(data)
+
+
+def read(path):
+    with open(path, "rb") as infile:
+        return infile.read()
+
+
+def test_index_tables_match_original():
+    assert cipher.convert_to_nums == original.convert_to_nums
+    assert cipher.convert_to_chars == original.convert_to_chars
+
+
+def test_adjust_password_matches_original():
+    rng = random.Random(1)
+    for _ in range(200):
+        text = random_image_text(rng, rng.randint(1, 150))
+        key = random_text(rng, rng.randint(1, 30))
+        assert cipher.adjust_password(text, key) == original.adjust_password(text, key)
+
+
+def test_encrypt_and_decrypt_match_original():
+    rng = random.Random(2)
+    for _ in range(200):
+        text = random_image_text(rng, rng.randint(1, 225))
+        key = original.adjust_password(text, random_text(rng, rng.randint(1, 30)))
+        assert cipher.encrypt(text, key) == original.encrypt(text, key)
+        assert cipher.decrypt(text, key) == original.decrypt(text, key)
+
+
+def test_text_helpers_match_original():
+    rng = random.Random(3)
+    for _ in range(200):
+        text = random_image_text(rng, rng.randint(1, 225))
+        password = random_text(rng, rng.randint(1, 30))
+        key = original.adjust_password(text, password)
+        assert cipher.encrypt_text(text, password) == original.encrypt(text, key)
+        assert cipher.decrypt_text(text, password) == original.decrypt(text, key)
+
+
+def test_characters_outside_the_index_are_rejected():
+    with pytest.raises(ValueError):
+        cipher.encrypt_text("QUJD", "bad~password")
+
+
+@pytest.mark.parametrize("block_size", [3, 9, 30, 3 * 1024, cipher.BLOCK_SIZE])
+def test_streamed_legacy_format_matches_original(tmp_path, block_size):
+    rng = random.Random(block_size)
+    for size in [1, 2, 3, 4, 5, 13, 100, 1000, 3001, 9999]:
+        data = rng.randbytes(size)
+        password = random_text(rng, rng.randint(8, 30))
+        image = tmp_path / "image.bin"
+        write(image, data)
+
+        cipher.encrypt_file(image, password, tmp_path / "encrypted.bin", block_size, cipher.FORMAT_LEGACY)
+        assert read(tmp_path / "encrypted.bin") == original.encrypt_image_bytes(data, password)
+
+        cipher.decrypt_file(image, password, tmp_path / "decrypted.bin", block_size, verify=False)
+        assert read(tmp_path / "decrypted.bin") == original.decrypt_image_bytes(data, password)
+
+        # Overwriting the original gives the same bytes
+        cipher.encrypt_file(image, password, None, block_size, cipher.FORMAT_LEGACY)
+        assert read(image) == original.encrypt_image_bytes(data, password)
+
+
+@pytest.mark.parametrize("block_size", [1, 7, 4096, cipher.BLOCK_SIZE])
+def test_raw_format_round_trip(tmp_path, block_size):
+    rng = random.Random(block_size)
+    for size in [1, 2, 17, 1000, 65537]:
+        data = rng.randbytes(size)
+        image = tmp_path / "image.jpg"
+        write(image, data)
+
+        cipher.encrypt_file(image, PASSWORD, tmp_path / "encrypted.jpg", block_size)
+        encrypted = read(tmp_path / "encrypted.jpg")
+        assert encrypted.endswith(cipher.RAW_MAGIC)
+        assert len(encrypted) == size + cipher._TRAILER.size
+        if size > 16:
+            assert encrypted[:size] != data
+
+        cipher.decrypt_file(tmp_path / "encrypted.jpg", PASSWORD, tmp_path / "decrypted.jpg", block_size)
+        assert read(tmp_path / "decrypted.jpg") == data
+
+        # In place, through a temporary file
+        cipher.encrypt_file(image, PASSWORD, None, block_size)
+        cipher.decrypt_file(image, PASSWORD, None, block_size)
+        assert read(image) == data
+
+
+def test_threaded_raw_format_matches_serial(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    # Use threads for small images so the test stays quick
+    monkeypatch.setattr(cipher, "PARALLEL_MIN_SIZE", 1024)
+    monkeypatch.setattr(cipher, "THREAD_CHUNK_SIZE", 4096)
+
+    data = random.Random(4).randbytes(300001)
+    image = tmp_path / "image.png"
+    write(image, data)
+
+    cipher.encrypt_file(image, PASSWORD, tmp_path / "serial.png", 3000, threads=1)
+    serial = read(tmp_path / "serial.png")
+    for threads in (2, 3, 8):
+        cipher.encrypt_file(image, PASSWORD, tmp_path / "threaded.png", 3000, threads=threads)
+        threaded = read(tmp_path / "threaded.png")
+        # Only the salted trailer differs
+        assert threaded[:len(data)] == serial[:len(data)]
+
+        cipher.decrypt_file(tmp_path / "threaded.png", PASSWORD, tmp_path / "decrypted.png", 3000, threads=threads)
+        assert read(tmp_path / "decrypted.png") == data
+
+
+@pytest.mark.parametrize("extension", [".jpg", ".png", ".gif", ".tif", ".bmp"])
+def test_raw_format_rejects_wrong_passwords(tmp_path, extension):
+    image = tmp_path / ("image" + extension)
+    encrypted = tmp_path / ("encrypted" + extension)
+    write(image, random.Random(5).randbytes(5000))
+    cipher.encrypt_file(image, PASSWORD, encrypted)
+
+    assert cipher.password_matches(encrypted, PASSWORD)
+    for wrong in [PASSWORD[:-1] + "8", "corXect" + PASSWORD[7:], PASSWORD + "x", PASSWORD[:-1], "x"]:
+        assert not cipher.password_matches(encrypted, wrong)
+        with pytest.raises(cipher.WrongPassword):
+            cipher.decrypt_file(encrypted, wrong, tmp_path / "decrypted.bin")
+        assert not os.path.exists(tmp_path / "decrypted.bin")
+
+
+def test_legacy_format_checks_the_image_header(tmp_path):
+    image = tmp_path / "image.png"
+    write(image, b"\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR" + random.Random(6).randbytes(1000))
+    cipher.encrypt_file(image, PASSWORD, tmp_path / "encrypted.png", format=cipher.FORMAT_LEGACY)
+
+    assert cipher.password_matches(tmp_path / "encrypted.png", PASSWORD)
+    assert not cipher.password_matches(tmp_path / "encrypted.png", "a-completely-different-password")
+
+
+def test_cancelled_overwrite_leaves_the_original(tmp_path):
+    data = random.Random(7).randbytes(10000)
+    image = tmp_path / "image.jpg"
+    write(image, data)
+
+    def progress(done, total):
+        if done:
+            raise cipher.Cancelled()
+
+    for format in (cipher.FORMAT_RAW, cipher.FORMAT_LEGACY):
+        with pytest.raises(cipher.Cancelled):
+            cipher.encrypt_file(image, PASSWORD, None, 3000, format, progress)
+        assert read(image) == data
+        assert os.listdir(tmp_path) == ["image.jpg"]
@@ -0,0 +1,83 @@
+# Tests for core.py.
+
+import struct
+
+import pytest
+
+import catalog
+import core
+
+PASSWORD = "correct-horse-battery-staple-9"
+
+# Smallest PNG header sniffer.classify() accepts as a plain image
+PNG = (b"\x89PNG\r\n\x1a\n\x00\x00\x00\x0dIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x02\x00\x00\x00"
+       b"\x90\x77\x53\xde" + bytes(1000))
+
+
+def jpeg_with_exif():
+    exif = b"Exif\x00\x00II*\x00\x08\x00\x00\x00\x00\x00"
+    return (b"\xff\xd8\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+            + b"\xff\xda\x00\x02" + bytes(100) + b"\xff\xd9")
+
+
+@pytest.fixture(autouse=True)
+def catalog_file(tmp_path, monkeypatch):
+    path = tmp_path / "catalog.sqlite3"
+    monkeypatch.setenv(catalog.CATALOG_ENV, str(path))
+    return path
+
+
+def cataloged(path):
+    conn = catalog.connect()
+    try:
+        return conn.execute("SELECT COUNT(*) FROM images WHERE path = ?", (str(path),)).fetchone()[0] > 0
+    finally:
+        conn.close()
+
+
+def add_to_catalog(path, like):
+    # An entry for path as if it had like's contents
+    conn = catalog.connect()
+    with conn:
+        catalog.store(conn, str(path), [["GPS GPSLatitude", "[51, 30, 0]"]], like.stat())
+    conn.close()
+
+
+@pytest.mark.parametrize("out_name", [None, "encrypted.png"])
+def test_encrypted_images_are_not_encrypted_again(tmp_path, out_name):
+    image = tmp_path / "image.png"
+    image.write_bytes(PNG)
+    core.encrypt_image(str(image), PASSWORD)
+    encrypted = image.read_bytes()
+
+    out_path = None if out_name is None else str(tmp_path / out_name)
+    with pytest.raises(core.AlreadyEncrypted):
+        core.encrypt_image(str(image), PASSWORD, out_path)
+    assert image.read_bytes() == encrypted
+    assert sorted(path.name for path in tmp_path.iterdir() if path.suffix == ".png") == ["image.png"]
+
+
+@pytest.mark.parametrize("action", ["strip", "encrypt"])
+@pytest.mark.parametrize("out_name", [None, "out.jpg"])
+def test_changed_images_leave_the_catalog(tmp_path, action, out_name):
+    image = tmp_path / "image.jpg"
+    image.write_bytes(jpeg_with_exif())
+    out_path = image if out_name is None else tmp_path / out_name
+    add_to_catalog(image, image)
+    add_to_catalog(out_path, image)
+
+    if action == "strip":
+        assert core.strip_metadata(str(image), out_path=None if out_name is None else str(out_path))
+    else:
+        core.encrypt_image(str(image), PASSWORD, None if out_name is None else str(out_path))
+
+    assert not cataloged(out_path)
+    # A copy written elsewhere leaves the original's entry alone
+    assert cataloged(image) == (out_name is not None)
+
+
+def test_no_catalog_is_created(tmp_path, catalog_file):
+    image = tmp_path / "image.jpg"
+    image.write_bytes(jpeg_with_exif())
+    assert core.strip_metadata(str(image))
+    assert not catalog_file.exists()
@@ -0,0 +1,37 @@
+# Tests for gallery.py.
+
+import queue
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import gallery
+
+
+class Window:
+    # Stands in for the PySimpleGUI window the loader posts to
+    def __init__(self):
+        self.events = queue.Queue()
+
+    def write_event_value(self, event, value):
+        self.events.put((event, value))
+
+
+def test_large_png_gets_a_thumbnail(tmp_path):
+    paths = []
+    for name in ("large.png", "small.png"):
+        paths.append(str(tmp_path / name))
+        size = (4000, 3000) if name == "large.png" else (300, 200)
+        Image.new("RGB", size, (10, 120, 200)).save(paths[-1], compress_level=1)
+
+    window = Window()
+    loader = gallery.ThumbnailLoader(window)
+    try:
+        loader.request(paths)
+        results = dict(window.events.get(timeout=30)[1][:2] for path in paths)
+    finally:
+        loader.close()
+
+    assert results[paths[0]].startswith(b"P6\n128 96\n")
+    assert results[paths[1]].startswith(b"P6\n128 85\n")
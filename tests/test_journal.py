@@ -0,0 +1,65 @@
+# Tests for journal.py.
+
+import json
+
+import pytest
+
+from journal import Journal
+
+PASSWORD = "correct-horse-battery-staple-9"
+
+
+def make_journal(tmp_path, **options):
+    image = tmp_path / "image.jpg"
+    image.write_bytes(b"data")
+    with Journal(str(tmp_path / "run.journal"), "encrypt", **options) as log:
+        log.record(str(image), "done", "in", "out")
+    return image
+
+
+def test_resumes_with_the_same_settings(tmp_path):
+    image = make_journal(tmp_path, out_dir=str(tmp_path / "out"), password=PASSWORD)
+    with Journal(str(tmp_path / "run.journal"), "encrypt", str(tmp_path / "out"), PASSWORD) as log:
+        assert log.finished(str(image), image.stat())
+        assert log.hashes == {"out"}
+    assert PASSWORD not in (tmp_path / "run.journal").read_text()
+
+
+@pytest.mark.parametrize("operation, out_dir, password", [
+    ("strip", None, PASSWORD),
+    ("encrypt", "elsewhere", PASSWORD),
+    ("encrypt", None, PASSWORD + "x"),
+    ("encrypt", None, None),
+])
+def test_refuses_a_journal_for_other_settings(tmp_path, operation, out_dir, password):
+    make_journal(tmp_path, password=PASSWORD)
+    out_dir = out_dir and str(tmp_path / out_dir)
+    with pytest.raises(ValueError):
+        Journal(str(tmp_path / "run.journal"), operation, out_dir, password)
+
+
+def test_cut_off_header_is_written_again(tmp_path):
+    path = tmp_path / "run.journal"
+    path.write_bytes(b'{"journal": 2, "operat')
+    Journal(str(path), "strip").close()
+
+    lines = path.read_bytes().splitlines()
+    assert len(lines) == 1
+    assert json.loads(lines[0])["operation"] == "strip"
+
+
+def test_cut_off_entry_is_dropped(tmp_path):
+    make_journal(tmp_path)
+    path = tmp_path / "run.journal"
+    complete = path.read_bytes()
+    path.write_bytes(complete + b'{"path": "/x", "si')
+    Journal(str(path), "encrypt").close()
+    assert path.read_bytes() == complete
+
+
+def test_other_files_are_not_overwritten(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_bytes(b"shopping list\n")
+    with pytest.raises(ValueError):
+        Journal(str(path), "strip")
+    assert path.read_bytes() == b"shopping list\n"
@@ -0,0 +1,52 @@
+# Tests for preview.py.
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+
+import preview
+import tiffreader
+
+
+def test_large_png_is_previewed_within_the_default_limit(tmp_path):
+    path = tmp_path / "large.png"
+    Image.new("RGB", (7000, 5000), (200, 40, 10)).save(path, compress_level=1)
+
+    thumbnail = preview.make_thumbnail(str(path))
+    assert thumbnail.startswith(b"P6\n400 286\n")
+
+
+def test_png_beyond_both_limits_is_refused(tmp_path, monkeypatch):
+    path = tmp_path / "large.png"
+    Image.new("RGB", (2000, 1000)).save(path, compress_level=1)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000000)
+
+    with pytest.raises(tiffreader.TooLarge):
+        preview.make_thumbnail(str(path), max_memory=4 * 1024 * 1024)
+    # Fits in memory even though Pillow would call it a bomb
+    assert preview.make_thumbnail(str(path), max_memory=8 * 1024 * 1024).startswith(b"P6")
+
+
+class Gate:
+    # Records whether make_thumbnail() held it
+    def __init__(self):
+        self.entered = 0
+
+    def __enter__(self):
+        self.entered += 1
+
+    def __exit__(self, *exc):
+        return False
+
+
+def test_only_large_decodes_hold_the_gate(tmp_path):
+    small = tmp_path / "small.png"
+    large = tmp_path / "large.png"
+    Image.new("RGB", (100, 100)).save(small)
+    Image.new("RGB", (4000, 3000)).save(large, compress_level=1)
+
+    gate = Gate()
+    preview.make_thumbnail(str(small), large_decodes=gate)
+    assert gate.entered == 0
+    preview.make_thumbnail(str(large), large_decodes=gate)
+    assert gate.entered == 1
@@ -0,0 +1,58 @@
+# Tests for safeio.py.
+
+import os
+import stat
+
+import pytest
+
+import safeio
+
+
+@pytest.mark.skipif(os.name == "nt", reason="Windows has no umask permission bits")
+@pytest.mark.parametrize("umask", [0o022, 0o077, 0o002])
+def test_new_outputs_follow_the_umask(tmp_path, umask):
+    previous = os.umask(umask)
+    try:
+        with safeio.atomic_output(tmp_path / "out.txt") as outfile:
+            outfile.write(b"data")
+    finally:
+        os.umask(previous)
+    assert stat.S_IMODE(os.stat(tmp_path / "out.txt").st_mode) == 0o666 & ~umask
+
+
+def test_writing_leaves_the_umask_alone(tmp_path, monkeypatch):
+    def umask(mask):
+        raise AssertionError("the umask is process-wide")
+
+    monkeypatch.setattr(os, "umask", umask)
+    with safeio.atomic_output(tmp_path / "out.txt") as outfile:
+        outfile.write(b"data")
+    assert (tmp_path / "out.txt").read_bytes() == b"data"
+
+
+def test_outputs_copy_the_mode_of_like(tmp_path):
+    source = tmp_path / "source.txt"
+    source.write_bytes(b"data")
+    os.chmod(source, 0o640)
+    with safeio.atomic_output(tmp_path / "out.txt", like=source) as outfile:
+        outfile.write(b"data")
+    assert stat.S_IMODE(os.stat(tmp_path / "out.txt").st_mode) == 0o640
+    assert sorted(os.listdir(tmp_path)) == ["out.txt", "source.txt"]
+
+
+def test_group_commit_leaves_the_data_flush_to_the_writers(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(safeio, "_sync_file", synced.append)
+
+    with safeio.deferred() as pending:
+        for name in ("a.jpg", "b.jpg"):
+            with safeio.atomic_output(str(tmp_path / name)) as outfile:
+                outfile.write(name.encode())
+    assert len(synced) == 2
+    assert not (tmp_path / "a.jpg").exists()
+
+    with safeio.GroupCommit() as group:
+        group.add(pending)
+    assert len(synced) == 2
+    assert (tmp_path / "a.jpg").read_bytes() == b"a.jpg"
+    assert (tmp_path / "b.jpg").read_bytes() == b"b.jpg"
@@ -0,0 +1,51 @@
+# Tests for tiffreader.py and the TIFF preview path in preview.py.
+
+import pytest
+
+Image = pytest.importorskip("PIL.Image")
+ImageChops = pytest.importorskip("PIL.ImageChops")
+
+import preview
+import tiffreader
+
+
+def gradient(size):
+    return Image.radial_gradient("L").resize(size).convert("RGB")
+
+
+def assert_close(a, b):
+    assert a.size == b.size
+    assert max(high for low, high in ImageChops.difference(a, b).getextrema()) <= 2
+
+
+def test_single_uncompressed_strip_is_read_a_few_rows_at_a_time(tmp_path):
+    img = gradient((3000, 2000))
+    path = tmp_path / "single.tif"
+    img.save(path, strip_size=2 ** 40)
+    with Image.open(path) as saved:
+        assert saved.tag_v2[278] == 2000
+
+    with open(path, "rb") as imgfile:
+        thumbnail = tiffreader.thumbnail(imgfile, (400, 400), 64 * 1024 * 1024)
+
+    expected = img.copy()
+    expected.thumbnail((400, 400))
+    assert_close(thumbnail, expected)
+
+
+def test_single_compressed_strip_falls_back_to_a_whole_decode(tmp_path, monkeypatch):
+    img = gradient((1000, 800))
+    path = tmp_path / "single.tif"
+    img.save(path, compression="tiff_adobe_deflate", strip_size=2 ** 40)
+    monkeypatch.setattr(preview, "TILED_PIXELS", 0)
+
+    # The strip is too tall to read a block at a time in 4 MB, but the
+    # 2.4 MB of pixels fit
+    with open(path, "rb") as imgfile, pytest.raises(tiffreader.TooLarge):
+        tiffreader.thumbnail(imgfile, (400, 400), 4 * 1024 * 1024)
+    assert preview.make_thumbnail(str(path), max_memory=4 * 1024 * 1024).startswith(b"P6")
+
+    # Beyond both Pillow's pixel limit and the memory limit
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100000)
+    with pytest.raises(tiffreader.TooLarge):
+        preview.make_thumbnail(str(path), max_memory=1024 * 1024)
@@ -0,0 +1,61 @@
+# Tests for tracing.py.
+
+import struct
+
+import batch
+import tracing
+
+
+def jpeg_with_exif():
+    exif = b"Exif\x00\x00II*\x00\x08\x00\x00\x00\x00\x00"
+    return (b"\xff\xd8\xff\xe1" + struct.pack(">H", len(exif) + 2) + exif
+            + b"\xff\xda\x00\x02" + bytes(100) + b"\xff\xd9")
+
+
+def test_batch_workers_add_to_the_metrics_file(tmp_path, monkeypatch):
+    monkeypatch.setenv(tracing.METRICS_ENV, str(tmp_path / "metrics.prom"))
+    monkeypatch.setenv("METADATA_CATALOG", str(tmp_path / "catalog.sqlite3"))
+    monkeypatch.setattr(tracing, "_totals", {})
+    (tmp_path / "images").mkdir()
+    for name in ("a.jpg", "b.jpg", "c.jpg"):
+        (tmp_path / "images" / name).write_bytes(jpeg_with_exif())
+
+    summary = batch.run_batch(str(tmp_path / "images"), "strip", workers=2)
+    assert summary["files"] == 3 and summary["failed"] == 0
+
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'metadata_span_count_total{span="strip_metadata",error=""} 3' in metrics
+
+
+def test_run_traced_returns_errors_with_the_totals(monkeypatch):
+    monkeypatch.setenv(tracing.METRICS_ENV, "")
+    monkeypatch.setenv(tracing.TRACE_ENV, "/dev/null")
+    monkeypatch.setattr(tracing, "_totals", {})
+
+    def fail():
+        with tracing.span("step"):
+            raise KeyError("x")
+
+    result, error, totals = tracing.run_traced(fail)
+    assert result is None and isinstance(error, KeyError)
+    assert totals == {("step", "KeyError"): [1, totals[("step", "KeyError")][1], 0]}
+    assert tracing.take_totals() == {}
+
+
+def test_batch_decrypts_are_traced_and_done_in_place(tmp_path, monkeypatch):
+    monkeypatch.setenv(tracing.METRICS_ENV, str(tmp_path / "metrics.prom"))
+    monkeypatch.setenv("METADATA_CATALOG", str(tmp_path / "catalog.sqlite3"))
+    monkeypatch.setattr(tracing, "_totals", {})
+    (tmp_path / "images").mkdir()
+    image = tmp_path / "images" / "a.jpg"
+    image.write_bytes(jpeg_with_exif())
+
+    password = "correct-horse-battery-staple-9"
+    for operation in ("encrypt", "decrypt"):
+        summary = batch.run_batch(str(tmp_path / "images"), operation, password, workers=1)
+        assert summary["failed"] == 0
+
+    assert image.read_bytes() == jpeg_with_exif()
+    assert sorted(path.name for path in (tmp_path / "images").iterdir()) == ["a.jpg"]
+    metrics = (tmp_path / "metrics.prom").read_text()
+    assert 'metadata_span_count_total{span="decrypt_image",error=""} 1' in metrics
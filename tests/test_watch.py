@@ -0,0 +1,50 @@
+# Tests for watch.py.
+
+import os
+
+import pytest
+
+import watch
+
+
+def handled(watcher, directory, names):
+    # Mark files as already handled, as after processing them
+    for name in names:
+        path = os.path.join(str(directory), name)
+        with open(path, "wb") as outfile:
+            outfile.write(b"data")
+        stat = os.stat(path)
+        watcher._done[path] = (stat.st_size, stat.st_mtime_ns)
+
+
+def test_polling_forgets_files_that_are_gone(tmp_path):
+    watcher = watch.Watcher([str(tmp_path)], "strip", use_inotify=False, poll=0)
+    handled(watcher, tmp_path, ["a.jpg", "b.jpg"])
+    os.remove(tmp_path / "a.jpg")
+
+    watcher._changes(0, 0)
+    assert list(watcher._done) == [str(tmp_path / "b.jpg")]
+
+
+def test_inotify_forgets_deleted_and_moved_files(tmp_path):
+    watcher = watch.Watcher([str(tmp_path)], "strip")
+    if watcher.mode() != "inotify":
+        pytest.skip("inotify is not available")
+    (tmp_path / "sub").mkdir()
+    watcher._walk(str(tmp_path), add_watches=True)
+    handled(watcher, tmp_path, ["a.jpg", "b.jpg", "c.jpg"])
+    handled(watcher, tmp_path / "sub", ["d.jpg"])
+    try:
+        os.remove(tmp_path / "a.jpg")
+        os.rename(tmp_path / "b.jpg", tmp_path.parent / (tmp_path.name + "-b.jpg"))
+        os.remove(tmp_path / "sub" / "d.jpg")
+        os.rmdir(tmp_path / "sub")
+
+        # Events can arrive over more than one read
+        for _ in range(10):
+            watcher._changes(0.1, 0)
+            if len(watcher._done) == 1:
+                break
+        assert list(watcher._done) == [str(tmp_path / "c.jpg")]
+    finally:
+        watcher._inotify.close()
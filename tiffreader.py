@@ -0,0 +1,258 @@
+# This module makes small previews of very large TIFFs without decoding
+# the whole image. TIFFs store their pixels in strips or tiles that are
+# compressed separately, so the image can be read a block at a time:
+# each block's strips or tiles are copied into a small in-memory TIFF
+# that Pillow decodes, the block is shrunk, and only the shrunk result
+# is kept. When the file holds reduced-resolution copies of the image
+# (a pyramid, either as later pages marked as reduced images or as
+# SubIFDs), the smallest copy that is still large enough is read
+# instead of the full image.
+# Referred to the TIFF 6.0 specification (sections 2, 8 and 15) and
+# the Adobe TIFF Technical Note 1 (SubIFDs).
+
+import collections
+import io
+import math
+import struct
+
+# Tags read from an image file directory
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SUB_IFDS = 330
+
+# Tags not copied into the in-memory TIFFs, since they point at other
+# parts of the original file
+_POINTER_TAGS = {STRIP_OFFSETS, STRIP_BYTE_COUNTS, TILE_OFFSETS, TILE_BYTE_COUNTS, SUB_IFDS,
+                 34665, 34853, 40965}
+
+# Most image file directories followed, in case the file loops
+MAX_IFDS = 256
+
+# Bit of NewSubfileType marking a reduced-resolution copy
+_REDUCED_IMAGE = 1
+
+# One image in the file: the file header, its directory and pixel size
+Level = collections.namedtuple("Level", ["header", "ifd", "width", "height"])
+
+
+class TooLarge(ValueError):
+    """
+    Raised when an image cannot be read a block at a time within the
+    memory allowed, e.g. because it is stored as one huge strip.
+    """
+
+
+def _read_ifd(imgfile, header, offset):
+    """
+    This function reads the image file directory at offset.
+    """
+    from PIL import TiffImagePlugin
+
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(header)
+    imgfile.seek(offset)
+    ifd.load(imgfile)
+    return ifd
+
+
+def _as_tuple(value):
+    """
+    This function returns a tag value as a tuple.
+    """
+    return value if isinstance(value, tuple) else (value,)
+
+
+def levels(imgfile):
+    """
+    This function returns the Level of the first image in a classic
+    (not BigTIFF) TIFF file followed by its reduced-resolution copies.
+    Later pages that are not marked as reduced copies are left out, as
+    they are other pictures.
+    """
+    header = imgfile.read(8)
+    if header[:4] not in (b"II*\x00", b"MM\x00*"):
+        raise ValueError("Not a classic TIFF file.")
+    order = "<" if header[:2] == b"II" else ">"
+    offset, = struct.unpack(order + "I", header[4:8])
+
+    found = []
+    seen = set()
+    pending = [offset]
+    while pending and len(seen) < MAX_IFDS:
+        offset = pending.pop(0)
+        if not offset or offset in seen:
+            continue
+        seen.add(offset)
+
+        ifd = _read_ifd(imgfile, header, offset)
+        if not found or ifd.get(NEW_SUBFILE_TYPE, 0) & _REDUCED_IMAGE:
+            if IMAGE_WIDTH in ifd and IMAGE_LENGTH in ifd:
+                found.append(Level(header, ifd, ifd[IMAGE_WIDTH], ifd[IMAGE_LENGTH]))
+        pending.extend(_as_tuple(ifd.get(SUB_IFDS, ())))
+        pending.append(ifd.next)
+    return found
+
+
+def choose_level(found, size):
+    """
+    This function returns the smallest level that is at least as large
+    as a preview of the first level that fits within size.
+    """
+    full = found[0]
+    scale = min(size[0] / full.width, size[1] / full.height, 1.0)
+    need = (full.width * scale, full.height * scale)
+
+    # Only use copies with the same shape as the full image
+    usable = [level for level in found
+              if level.width >= need[0] and level.height >= need[1]
+              and abs(level.width / level.height - full.width / full.height) < 0.02 * full.width / full.height]
+    return min(usable, key=lambda level: level.width * level.height) if usable else full
+
+
+def _layout(level, max_rows=None):
+    """
+    This function returns (block width, block height, offsets, byte
+    counts, blocks across) for the strips or tiles of a level.
+    Uncompressed strips taller than max_rows are split into strips of
+    max_rows rows, since their rows can be found without decoding.
+    """
+    ifd = level.ifd
+    if ifd.get(PLANAR_CONFIGURATION, 1) != 1:
+        raise ValueError("Separate colour planes are not read a block at a time.")
+
+    if TILE_OFFSETS in ifd:
+        width, height = ifd[TILE_WIDTH], ifd[TILE_LENGTH]
+        offsets, counts = _as_tuple(ifd[TILE_OFFSETS]), _as_tuple(ifd[TILE_BYTE_COUNTS])
+        return width, height, offsets, counts, math.ceil(level.width / width)
+
+    rows = min(ifd.get(ROWS_PER_STRIP, level.height), level.height)
+    offsets, counts = _as_tuple(ifd[STRIP_OFFSETS]), _as_tuple(ifd[STRIP_BYTE_COUNTS])
+    if max_rows is None or rows <= max_rows or ifd.get(COMPRESSION, 1) != 1:
+        return level.width, rows, offsets, counts, 1
+
+    # Rows of an uncompressed strip are stored one after another, each
+    # padded to a whole byte
+    bits = _as_tuple(ifd.get(BITS_PER_SAMPLE, 1))[0]
+    row_bytes = math.ceil(level.width * ifd.get(SAMPLES_PER_PIXEL, 1) * bits / 8)
+    split_offsets, split_counts = [], []
+    for index, offset in enumerate(offsets):
+        strip_rows = min(rows, level.height - index * rows)
+        for first in range(0, strip_rows, max_rows):
+            split_offsets.append(offset + first * row_bytes)
+            split_counts.append(min(max_rows, strip_rows - first) * row_bytes)
+    return level.width, max_rows, tuple(split_offsets), tuple(split_counts), 1
+
+
+def _decode(imgfile, level, layout, box):
+    """
+    This function decodes the strips or tiles covering box = (left,
+    top, right, bottom) by copying them into an in-memory TIFF, and
+    returns the box as an RGB image.
+    """
+    from PIL import Image, TiffImagePlugin, TiffTags
+
+    block_width, block_height, offsets, counts, across = layout
+    first_col, last_col = box[0] // block_width, math.ceil(box[2] / block_width)
+    first_row, last_row = box[1] // block_height, math.ceil(box[3] / block_height)
+
+    data = bytearray()
+    positions = []
+    for row in range(first_row, last_row):
+        for col in range(first_col, last_col):
+            index = row * across + col
+            imgfile.seek(offsets[index])
+            positions.append(len(data))
+            data += imgfile.read(counts[index])
+
+    src = level.ifd
+    ifd = TiffImagePlugin.ImageFileDirectory_v2(level.header)
+    for tag in src:
+        if tag not in _POINTER_TAGS:
+            ifd.tagtype[tag] = src.tagtype[tag]
+            ifd[tag] = src[tag]
+
+    top = first_row * block_height
+    counts_tag, offsets_tag = (TILE_BYTE_COUNTS, TILE_OFFSETS) if TILE_OFFSETS in src else (STRIP_BYTE_COUNTS, STRIP_OFFSETS)
+    if offsets_tag == STRIP_OFFSETS:
+        # Strips may have been split (see _layout())
+        ifd.tagtype[ROWS_PER_STRIP] = TiffTags.LONG
+        ifd[ROWS_PER_STRIP] = block_height
+    for tag in (IMAGE_WIDTH, IMAGE_LENGTH, counts_tag, offsets_tag):
+        ifd.tagtype[tag] = TiffTags.LONG
+    ifd[IMAGE_WIDTH] = (last_col - first_col) * block_width
+    ifd[IMAGE_LENGTH] = min(last_row * block_height, level.height) - top
+    ifd[counts_tag] = tuple(counts[row * across + col]
+                            for row in range(first_row, last_row) for col in range(first_col, last_col))
+
+    # The pixel data goes after the directory, so work out where that ends
+    ifd[offsets_tag] = tuple(positions)
+    start = 8 + len(ifd.tobytes(8))
+    if offsets_tag == TILE_OFFSETS:
+        # Pillow only moves strip offsets past the directory itself
+        ifd[offsets_tag] = tuple(start + position for position in positions)
+
+    order = "<" if level.header[:2] == b"II" else ">"
+    tiff = level.header[:4] + struct.pack(order + "I", 8) + ifd.tobytes(8)
+    tiff += b"\0" * (start - len(tiff)) + data
+
+    with Image.open(io.BytesIO(tiff)) as block:
+        left = first_col * block_width
+        block = block.crop((box[0] - left, box[1] - top, box[2] - left, box[3] - top))
+        return block.convert("RGB")
+
+
+def thumbnail(imgfile, size, max_memory):
+    """
+    This function returns an RGB image of the TIFF in imgfile (an open
+    binary file) that fits within size, reading its pixels a block at a
+    time so no more than about max_memory bytes are decoded at once.
+    Raises TooLarge if the image cannot be split into small enough
+    blocks.
+    """
+    from PIL import Image
+
+    found = levels(imgfile)
+    if not found:
+        raise ValueError("No image found in the TIFF file.")
+    level = choose_level(found, size)
+
+    # Shrink each block by a whole factor, leaving the final resize at
+    # least twice the preview size for quality (like reducing_gap=2.0)
+    scale = min(size[0] / level.width, size[1] / level.height, 1.0)
+    factor = max(1, int(1 / scale / 2))
+
+    # Blocks are whole multiples of the factor so their shrunk pixels
+    # line up. A decoded pixel takes 4 bytes and is copied about 4 times
+    # (decode, crop, convert, reduce), and the strips or tiles around a
+    # block are decoded too, so blocks get a quarter of the budget.
+    pixels = max_memory // 16 // 4
+    layout = _layout(level, max_rows=max(1, pixels // level.width))
+    block_width, block_height = layout[:2]
+    side = max(factor, math.isqrt(pixels) // factor * factor)
+    step_x = level.width if layout[4] == 1 else min(level.width, side)
+    step_y = max(factor, pixels // step_x // factor * factor)
+
+    needed = (step_x + block_width) * (step_y + block_height) * 16
+    if needed > max_memory:
+        raise TooLarge("Image is too large to preview within %d MB." % (max_memory // (1024 * 1024)))
+
+    out = Image.new("RGB", (math.ceil(level.width / factor), math.ceil(level.height / factor)))
+    for top in range(0, level.height, step_y):
+        for left in range(0, level.width, step_x):
+            box = (left, top, min(left + step_x, level.width), min(top + step_y, level.height))
+            block = _decode(imgfile, level, layout, box)
+            out.paste(block.reduce(factor), (left // factor, top // factor))
+
+    out.thumbnail(size)
+    return out
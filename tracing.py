@@ -0,0 +1,310 @@
+# This module records how long each part of an operation takes so slow
+# reports can be looked into. Tracing is off unless METADATA_TRACE names
+# a log file (or --trace is given on the command line); while it is off,
+# spans cost one environment lookup.
+#
+# Each finished span is written as one JSON line with its name, parent,
+# duration, byte count and the type of any exception. Repeated steps
+# inside a span, such as reading or ciphering each block of a file, are
+# added up with Span.phase() and written as one child span each.
+# METADATA_TRACE_METRICS names a Prometheus textfile that gets running
+# totals per span, and METADATA_PROFILE names a directory that gets a
+# cProfile dump for each top-level operation. Worker processes do not
+# write the textfile themselves: their tasks run through run_traced(),
+# which hands the span totals back with each result, and the main
+# process adds them to its own with add_totals().
+
+import itertools
+import os
+import threading
+import time
+
+# Environment variable naming the JSON-lines span log
+TRACE_ENV = "METADATA_TRACE"
+
+# Environment variable naming the Prometheus textfile
+METRICS_ENV = "METADATA_TRACE_METRICS"
+
+# Environment variable naming the directory for cProfile dumps
+PROFILE_ENV = "METADATA_PROFILE"
+
+# Seconds between rewrites of the textfile while adding worker totals
+METRICS_SECONDS = 1.0
+
+_ids = itertools.count(1)
+_lock = threading.Lock()
+_local = threading.local()
+
+# (span name, exception type or "") -> [count, seconds, bytes]
+_totals = {}
+
+# time.monotonic() of the last add_totals() that wrote the textfile
+_metrics_written = 0.0
+
+
+def configure(log_path=None, metrics_path=None, profile_dir=None):
+    """
+    This function turns tracing on for this process and the processes
+    it starts, as if the environment variables had been set.
+    """
+    for name, value in ((TRACE_ENV, log_path), (METRICS_ENV, metrics_path), (PROFILE_ENV, profile_dir)):
+        if value:
+            os.environ[name] = value
+
+
+def enabled():
+    """
+    This function returns True if spans are being recorded.
+    """
+    return bool(os.environ.get(TRACE_ENV) or os.environ.get(METRICS_ENV))
+
+
+class _NullSpan:
+    """
+    Span used while tracing is off. Every method does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def phase(self, name, nbytes=0):
+        pass
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    One timed step of an operation. Use span() or operation() to make
+    one rather than creating it directly.
+    """
+
+    def __init__(self, name, attrs, profile=False):
+        self.name = name
+        self.attrs = attrs
+        self.id = next(_ids)
+        self.bytes = attrs.pop("bytes", 0)
+        self.profile = profile
+        self._phases = {}
+        self._profiler = None
+
+    def __enter__(self):
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.parent = stack[-1].id if stack else None
+        self.root = stack[0].name if stack else self.name
+        stack.append(self)
+
+        profile_dir = os.environ.get(PROFILE_ENV)
+        if self.profile and self.parent is None and profile_dir:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError:
+                # Another profiler is already running on this thread
+                self._profiler = None
+
+        self.wall = time.time()
+        self.start = self._tick = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        _local.stack.pop()
+        error = exc_type.__name__ if exc_type is not None else None
+
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._dump_profile(os.environ.get(PROFILE_ENV))
+
+        for name, (count, phase_seconds, nbytes) in self._phases.items():
+            _record({"name": name, "id": next(_ids), "parent": self.id, "operation": self.root,
+                     "start": self.wall, "seconds": phase_seconds, "bytes": nbytes, "count": count,
+                     "error": None})
+
+        record = {"name": self.name, "id": self.id, "parent": self.parent, "operation": self.root,
+                  "start": self.wall, "seconds": seconds, "bytes": self.bytes, "error": error}
+        record.update(self.attrs)
+        _record(record)
+
+        if self.parent is None:
+            write_metrics()
+        return False
+
+    def phase(self, name, nbytes=0):
+        """
+        This function adds the time since the span started, or since
+        the last phase() call, to the phase called name. Called after
+        each repeated step, e.g. span.phase("read", len(block)).
+        """
+        now = time.perf_counter()
+        totals = self._phases.get(name)
+        if totals is None:
+            totals = self._phases[name] = [0, 0.0, 0]
+        totals[0] += 1
+        totals[1] += now - self._tick
+        totals[2] += nbytes
+        self._tick = now
+
+    def set(self, **attrs):
+        """
+        This function adds attributes to the span, e.g. its byte count.
+        """
+        self.bytes = attrs.pop("bytes", self.bytes)
+        self.attrs.update(attrs)
+
+    def _dump_profile(self, profile_dir):
+        """
+        This function saves the cProfile statistics of the operation.
+        """
+        os.makedirs(profile_dir, exist_ok=True)
+        name = "%s-%s-%d-%d.prof" % (self.name, time.strftime("%Y%m%d-%H%M%S"), os.getpid(), self.id)
+        self._profiler.dump_stats(os.path.join(profile_dir, name))
+
+
+def span(name, **attrs):
+    """
+    This function returns a context manager that records one step of
+    an operation, e.g. "with span('exif_parse', path=imgpath):".
+    A bytes= attribute is reported as the span's byte count.
+    """
+    if not enabled():
+        return _NULL_SPAN
+    return Span(name, attrs)
+
+
+def operation(name, **attrs):
+    """
+    This function works like span() for a whole user operation such as
+    encrypting an image. A top-level operation is also profiled when
+    METADATA_PROFILE is set and updates the metrics file when it ends.
+    """
+    if not enabled():
+        return _NULL_SPAN
+    return Span(name, attrs, profile=True)
+
+
+def _record(record):
+    """
+    This function adds a finished span to the totals and the log.
+    """
+    import json
+
+    key = (record["name"], record["error"] or "")
+    with _lock:
+        totals = _totals.get(key)
+        if totals is None:
+            totals = _totals[key] = [0, 0.0, 0]
+        totals[0] += record.get("count", 1)
+        totals[1] += record["seconds"]
+        totals[2] += record["bytes"] or 0
+
+        log_path = os.environ.get(TRACE_ENV)
+        if log_path:
+            record["pid"] = os.getpid()
+            record["thread"] = threading.current_thread().name
+            # Lines are appended with one write so processes can share the log
+            with open(log_path, "a") as log:
+                log.write(json.dumps(record, default=str) + "\n")
+
+
+def take_totals():
+    """
+    This function returns the span totals recorded since the last call
+    and clears them, for a worker process to send to the main process.
+    """
+    global _totals
+
+    with _lock:
+        totals, _totals = _totals, {}
+    return totals
+
+
+def add_totals(totals):
+    """
+    This function adds span totals from a worker process to this
+    process's totals, and rewrites the textfile at most once every
+    METRICS_SECONDS. Call write_metrics() when the work is done.
+    """
+    global _metrics_written
+
+    if not totals:
+        return
+    with _lock:
+        for key, values in totals.items():
+            mine = _totals.get(key)
+            if mine is None:
+                mine = _totals[key] = [0, 0.0, 0]
+            for index, value in enumerate(values):
+                mine[index] += value
+        now = time.monotonic()
+        due = now - _metrics_written >= METRICS_SECONDS
+        if due:
+            _metrics_written = now
+    if due:
+        write_metrics()
+
+
+def run_traced(func, *args):
+    """
+    This function runs func(*args) in a worker process and returns
+    (result, exception raised or None, span totals) so the main process
+    can pass the totals to add_totals() whether or not func failed.
+    """
+    try:
+        result, error = func(*args), None
+    except Exception as exc:
+        result, error = None, exc
+    return result, error, take_totals()
+
+
+def _label(value):
+    """
+    This function escapes a Prometheus label value.
+    """
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_metrics():
+    """
+    This function writes the span totals of this process to the
+    Prometheus textfile. Worker processes (e.g. of a batch run) leave it
+    to the main process, which gets their totals from run_traced().
+    """
+    metrics_path = os.environ.get(METRICS_ENV)
+    if not metrics_path:
+        return
+
+    import multiprocessing
+    if multiprocessing.parent_process() is not None:
+        return
+
+    from safeio import atomic_output
+
+    with _lock:
+        totals = sorted(_totals.items())
+
+    lines = []
+    metrics = (
+        ("metadata_span_count_total", "Number of times each span finished.", 0),
+        ("metadata_span_seconds_total", "Seconds spent in each span.", 1),
+        ("metadata_span_bytes_total", "Bytes processed in each span.", 2),
+    )
+    for metric, help, index in metrics:
+        lines.append("# HELP %s %s" % (metric, help))
+        lines.append("# TYPE %s counter" % metric)
+        for (name, error), values in totals:
+            lines.append('%s{span="%s",error="%s"} %s' % (metric, _label(name), _label(error), values[index]))
+
+    # Rewritten often and cheap to lose, so not synced to disk
+    with atomic_output(metrics_path, sync=False) as outfile:
+        outfile.write(("\n".join(lines) + "\n").encode())
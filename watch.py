@@ -0,0 +1,512 @@
+# This module watches directories and strips or encrypts images as they
+# arrive, for machines that take in uploads. New files are found with
+# inotify on Linux and by rescanning the directories elsewhere. A file
+# is only processed once its size and modification time have stopped
+# changing for a while, so files that are still being copied in are left
+# alone. Settled files are handed to a pool of worker processes with a
+# bounded number in flight; when the workers (or the disk under them)
+# fall behind, the watcher waits for a slot instead of queueing more,
+# and counts the wait as backpressure. Files that are deleted or moved
+# away are forgotten, so a long-running watcher does not remember every
+# file it ever handled.
+
+import collections
+import os
+import select
+import struct
+import threading
+import time
+
+import sniffer
+import tracing
+from batch import IMAGE_EXTENSIONS, FileResult, process_file
+
+# Actions the watcher can run on new images
+OPERATIONS = ("strip", "encrypt")
+
+# Seconds a file must stay unchanged before it is processed
+SETTLE_SECONDS = 2.0
+
+# Seconds between directory scans when inotify is not available
+POLL_SECONDS = 1.0
+
+# Seconds between writes of the metrics file
+METRICS_SECONDS = 10.0
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+_WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event without its name
+_EVENT = struct.Struct("iIII")
+
+
+def is_candidate(name):
+    """
+    This function returns True for file names the watcher handles.
+    Hidden files are skipped since uploaders (and atomic_output) use
+    them for files that are still being written.
+    """
+    return not name.startswith(".") and name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+class Inotify:
+    """
+    Small inotify wrapper using ctypes. Raises OSError where inotify is
+    not available, so callers can fall back to polling.
+    """
+
+    def __init__(self):
+        import ctypes
+        import ctypes.util
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this system.")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+
+    def add(self, directory):
+        """
+        This function starts watching one directory.
+        """
+        import ctypes
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed", directory)
+        self._dirs[wd] = directory
+
+    def read(self, timeout):
+        """
+        This function waits up to timeout seconds for events and returns
+        a list of (path, is directory, removed) for the entries that
+        changed, where removed is True if the entry was deleted or moved
+        away. A path of None means events were lost and everything
+        should be scanned again.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        changes = []
+        pos = 0
+        while pos + _EVENT.size <= len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, pos)
+            name = data[pos + _EVENT.size:pos + _EVENT.size + length].split(b"\0", 1)[0]
+            pos += _EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                changes.append((None, False, False))
+            elif wd in self._dirs and name:
+                changes.append((os.path.join(self._dirs[wd], os.fsdecode(name)), bool(mask & IN_ISDIR),
+                                bool(mask & (IN_DELETE | IN_MOVED_FROM))))
+        return changes
+
+    def close(self):
+        """
+        This function stops watching.
+        """
+        os.close(self.fd)
+
+
+def _ignore_interrupts():
+    """
+    This function makes a worker process ignore Ctrl+C, so only the
+    watcher handles it and files in progress are finished.
+    """
+    import signal
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def watch_file(operation, path, password=None, out_path=None):
+    """
+    This function runs one action on a settled file in a worker process
+    and returns a FileResult, or None if there was nothing to do because
+    the file is already encrypted.
+    """
+    if operation == "encrypt":
+        try:
+            if sniffer.classify(path).status == sniffer.ENCRYPTED:
+                return None
+        except OSError:
+            pass
+    return process_file(operation, path, password, out_path)
+
+
+class Watcher:
+    """
+    Watches directories and runs operation ("strip" or "encrypt") on
+    every image that appears in them, and on the images already there
+    unless new_only is True. Results go to out_dir when given, with the
+    same relative paths, instead of changing the originals. At most
+    max_in_flight files are queued for the workers at a time.
+    """
+
+    def __init__(self, directories, operation, password=None, out_dir=None, workers=None,
+                 max_in_flight=None, settle=SETTLE_SECONDS, poll=POLL_SECONDS, use_inotify=True,
+                 new_only=False, metrics_path=None, on_result=None):
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown operation: " + operation)
+
+        self.directories = [os.path.abspath(directory) for directory in directories]
+        self.operation = operation
+        self.password = password
+        self.out_dir = os.path.abspath(out_dir) if out_dir is not None else None
+        self.workers = workers or os.cpu_count() or 1
+        self.max_in_flight = max_in_flight or self.workers * 4
+        self.settle = settle
+        self.poll = poll
+        self.new_only = new_only
+        self.metrics_path = metrics_path
+        self.on_result = on_result
+
+        self.counters = collections.Counter()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._in_flight = set()
+        self._stop = threading.Event()
+
+        # path -> [size, mtime_ns, time it last changed, time first seen]
+        self._candidates = {}
+        # path -> (size, mtime_ns) after the watcher last handled it, for
+        # files that still exist
+        self._done = {}
+
+        self._inotify = None
+        if use_inotify:
+            try:
+                self._inotify = Inotify()
+            except OSError:
+                self._inotify = None
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def mode(self):
+        """
+        This function returns "inotify" or "polling".
+        """
+        return "inotify" if self._inotify is not None else "polling"
+
+    def stats(self):
+        """
+        This function returns a dict of counters: files seen, queued,
+        processed, skipped and failed, files waiting to settle, the
+        current and highest queue depth, seconds from a file being seen
+        to it being done, and how often and how long the watcher waited
+        for a free slot.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+            stats["queue_depth"] = len(self._in_flight)
+        stats["settling"] = len(self._candidates)
+        for name in ("seen", "queued", "processed", "skipped", "failed", "queue_high_water",
+                     "latency_seconds", "latency_max_seconds", "backpressure_waits", "backpressure_seconds"):
+            stats.setdefault(name, 0)
+        finished = stats["processed"] + stats["skipped"] + stats["failed"]
+        stats["latency_avg_seconds"] = stats["latency_seconds"] / finished if finished else 0.0
+        return stats
+
+    def write_metrics(self):
+        """
+        This function writes stats() to the Prometheus textfile.
+        """
+        from safeio import atomic_output
+
+        lines = []
+        for name, value in sorted(self.stats().items()):
+            metric = "metadata_watch_" + name
+            if name in ("queue_depth", "settling", "queue_high_water", "latency_avg_seconds", "latency_max_seconds"):
+                lines.append("# TYPE %s gauge" % metric)
+            else:
+                metric += "_total"
+                lines.append("# TYPE %s counter" % metric)
+            lines.append("%s %s" % (metric, value))
+
+        # Rewritten often and cheap to lose, so not synced to disk
+        with atomic_output(self.metrics_path, sync=False) as outfile:
+            outfile.write(("\n".join(lines) + "\n").encode())
+
+    def _excluded(self, path):
+        """
+        This function returns True for paths inside out_dir.
+        """
+        return self.out_dir is not None and (path == self.out_dir or path.startswith(self.out_dir + os.sep))
+
+    def _walk(self, directory, add_watches=False):
+        """
+        This function returns the images under a directory, adding an
+        inotify watch for each subdirectory when add_watches is True.
+        """
+        found = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [name for name in dirnames if not self._excluded(os.path.join(dirpath, name))]
+            if add_watches:
+                try:
+                    self._inotify.add(dirpath)
+                except OSError:
+                    self._count("watch_errors")
+            found.extend(os.path.join(dirpath, name) for name in filenames if is_candidate(name))
+        return found
+
+    def _scan(self):
+        """
+        This function returns every image in the watched directories.
+        """
+        return [path for directory in self.directories for path in self._walk(directory)]
+
+    def _seen(self, path, now):
+        """
+        This function notes that a file may have changed. Its settle
+        timer restarts whenever its size or modification time changes.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._candidates.pop(path, None)
+            return
+        key = (stat.st_size, stat.st_mtime_ns)
+
+        with self._lock:
+            # Ignore files being processed and the result of processing them
+            if path in self._in_flight or self._done.get(path) == key:
+                return
+
+        candidate = self._candidates.get(path)
+        if candidate is None:
+            self._count("seen")
+            self._candidates[path] = [stat.st_size, stat.st_mtime_ns, now, now]
+        elif candidate[:2] != list(key):
+            candidate[:3] = [stat.st_size, stat.st_mtime_ns, now]
+
+    def _forget(self, path, is_dir):
+        """
+        This function drops a deleted or moved file, or everything under
+        a deleted or moved directory, from the files handled so far.
+        """
+        self._candidates.pop(path, None)
+        with self._lock:
+            if not is_dir:
+                self._done.pop(path, None)
+                return
+            prefix = path + os.sep
+            for done in [done for done in self._done if done.startswith(prefix)]:
+                del self._done[done]
+
+    def _prune(self, existing):
+        """
+        This function keeps only the handled files that a full scan
+        found, so files that disappeared without an event are forgotten.
+        """
+        existing = set(existing)
+        with self._lock:
+            for done in [done for done in self._done if done not in existing]:
+                del self._done[done]
+
+    def _settled(self, now):
+        """
+        This function returns the files whose size and modification time
+        have not changed for settle seconds, oldest first.
+        """
+        ready = []
+        for path, candidate in list(self._candidates.items()):
+            if now - candidate[2] < self.settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._candidates[path]
+                continue
+            if [stat.st_size, stat.st_mtime_ns] != candidate[:2]:
+                # Changed without an event reaching us yet
+                candidate[:3] = [stat.st_size, stat.st_mtime_ns, now]
+                continue
+            ready.append((candidate[3], path))
+        return [path for first_seen, path in sorted(ready)]
+
+    def _next_timeout(self, now):
+        """
+        This function returns how long to wait for events, which is the
+        poll interval or less if a file is about to settle.
+        """
+        timeout = self.poll
+        if self._candidates:
+            changed = min(candidate[2] for candidate in self._candidates.values())
+            timeout = min(timeout, changed + self.settle - now)
+        return max(0.05, timeout)
+
+    def _acquire_slot(self):
+        """
+        This function waits for room in the worker queue and returns
+        False if the watcher was stopped while waiting.
+        """
+        if self._slots.acquire(blocking=False):
+            return True
+
+        self._count("backpressure_waits")
+        start = time.perf_counter()
+        try:
+            while not self._stop.is_set():
+                if self._slots.acquire(timeout=0.5):
+                    return True
+            return False
+        finally:
+            self._count("backpressure_seconds", time.perf_counter() - start)
+
+    def _submit(self, pool, path):
+        """
+        This function queues a settled file for the workers. Returns
+        False if the watcher was stopped while waiting for room.
+        """
+        if not self._acquire_slot():
+            return False
+        first_seen = self._candidates.pop(path)[3]
+
+        out_path = None
+        if self.out_dir is not None:
+            root = next(directory for directory in self.directories if path.startswith(directory + os.sep))
+            out_path = os.path.join(self.out_dir, os.path.relpath(path, root))
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+
+        with self._lock:
+            self._in_flight.add(path)
+            self.counters["queued"] += 1
+            self.counters["queue_high_water"] = max(self.counters["queue_high_water"], len(self._in_flight))
+
+        future = pool.submit(tracing.run_traced, watch_file, self.operation, path, self.password, out_path)
+        future.add_done_callback(lambda future: self._finished(path, first_seen, future))
+        return True
+
+    def _finished(self, path, first_seen, future):
+        """
+        This function records a file the workers are done with.
+        """
+        try:
+            result, error, totals = future.result()
+            tracing.add_totals(totals)
+        except Exception as exc:
+            # The worker process itself failed
+            error = exc
+        if error is not None:
+            result = FileResult(path, False, 0, type(error).__name__ + ": " + str(error))
+
+        # Remember the file as it is now so its own rewrite is not processed again
+        try:
+            stat = os.stat(path)
+            done = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            done = None
+
+        latency = time.monotonic() - first_seen
+        with self._lock:
+            self._done[path] = done
+            self._in_flight.discard(path)
+            if result is None:
+                self.counters["skipped"] += 1
+            else:
+                self.counters["processed" if result.ok else "failed"] += 1
+                self.counters["bytes"] += result.size
+            self.counters["latency_seconds"] += latency
+            self.counters["latency_max_seconds"] = max(self.counters["latency_max_seconds"], latency)
+        self._slots.release()
+
+        if result is not None and self.on_result is not None:
+            self.on_result(result)
+
+    def _changes(self, timeout, last_scan):
+        """
+        This function waits up to timeout seconds and returns the paths
+        that may have changed, and the time of the last full scan.
+        """
+        if self._inotify is None:
+            self._stop.wait(timeout)
+            if time.monotonic() - last_scan < self.poll:
+                return [], last_scan
+            paths = self._scan()
+            self._prune(paths)
+            return paths, time.monotonic()
+
+        paths = []
+        for path, is_dir, removed in self._inotify.read(timeout):
+            if path is None:
+                # The kernel queue overflowed, so look at everything
+                self._count("overflows")
+                scanned = self._scan()
+                self._prune(scanned)
+                paths.extend(scanned)
+            elif self._excluded(path):
+                continue
+            elif removed:
+                self._forget(path, is_dir)
+            elif is_dir:
+                # Watch new subdirectories and pick up files already in them
+                paths.extend(self._walk(path, add_watches=True))
+            elif is_candidate(os.path.basename(path)):
+                paths.append(path)
+        return paths, last_scan
+
+    def run(self):
+        """
+        This function watches until stop() is called, then waits for the
+        files already queued to finish.
+        """
+        import concurrent.futures
+
+        now = time.monotonic()
+        existing = [path for directory in self.directories
+                    for path in self._walk(directory, add_watches=self._inotify is not None)]
+        for path in existing:
+            if self.new_only:
+                try:
+                    stat = os.stat(path)
+                    self._done[path] = (stat.st_size, stat.st_mtime_ns)
+                except OSError:
+                    pass
+            else:
+                self._seen(path, now)
+
+        last_scan = last_metrics = now
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_ignore_interrupts) as pool:
+                while not self._stop.is_set():
+                    paths, last_scan = self._changes(self._next_timeout(time.monotonic()), last_scan)
+                    now = time.monotonic()
+                    for path in paths:
+                        self._seen(path, now)
+
+                    for path in self._settled(now):
+                        if not self._submit(pool, path):
+                            break
+
+                    if self.metrics_path and now - last_metrics >= METRICS_SECONDS:
+                        self.write_metrics()
+                        last_metrics = now
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+            if self.metrics_path:
+                self.write_metrics()
+            tracing.write_metrics()
+
+    def stop(self):
+        """
+        This function asks run() to return. It can be called from
+        another thread or a signal handler.
+        """
+        self._stop.set()